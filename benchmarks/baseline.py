@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import json
+import os
+import platform
+import socket
+import time
+import timeit
+import numpy as np
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def metric(value, unit, better="lower"):
+    return {"value": float(value), "unit": unit, "better": better}
+
+
+def time_call(fn, repeat=5):
+    """
+    Median seconds per call of fn, timeit picks the calls per sample so a
+    sample takes at least 0.2 sec
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return float(np.median(timer.repeat(repeat=repeat, number=number))) / number
+
+
+def environment():
+    return {
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def baseline_path(suite):
+    # numbers only compare on the same machine, one baseline per host
+    return os.path.join(BASELINE_DIR, "%s_%s.json" % (suite, socket.gethostname()))
+
+
+def save_report(report, path):
+    dir_name = os.path.dirname(path)
+    if dir_name and not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+    with open(path + ".tmp", "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def load_report(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    (name, baseline, current, relative change, regressed) of every metric
+    in both {stage: {name: metric}} results. A metric regresses when it
+    got worse by more than threshold, relative to the baseline
+    """
+    rows = list()
+    for stage, metrics in sorted(results.items()):
+        for name, current in sorted(metrics.items()):
+            base = baseline.get(stage, {}).get(name)
+            if base is None or not base["value"]:
+                continue
+            change = (current["value"] - base["value"]) / base["value"]
+            worse = change if current["better"] == "lower" else -change
+            rows.append(("%s.%s" % (stage, name), base["value"], current["value"], change, worse > threshold))
+    return rows
+
+
+def print_comparison(rows, threshold):
+    """
+    Print the rows of compare, returns the number of regressions
+    """
+    print("%-44s %12s %12s %8s" % ("metric", "baseline", "current", "change"))
+    for name, base, current, change, regressed in rows:
+        print("%-44s %12.4f %12.4f %+7.1f%%%s" % (name, base, current, change * 100,
+                                                   "  REGRESSION" if regressed else ""))
+    regressions = sum(1 for row in rows if row[-1])
+    print("%d of %d metrics regressed by more than %.0f%%" % (regressions, len(rows), threshold * 100))
+    return regressions
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import argparse
+import io
+import itertools
+import os
+import pickle
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+from benchmarks.baseline import (metric, time_call, environment, baseline_path, save_report, load_report, compare,
+                                 print_comparison)
+from models.dataset_cns import PickledImageProvider, get_batch_iter, handle_cns
+from models.profiling import peak_rss_mb, run_isolated
+from models.utils import bytes_to_file, read_split_image, shift_and_resize_image, normalize_image
+
+SUITE = "data_pipeline"
+
+
+def synthetic_examples(count, image_size=256, embedding_num=7, cns_vocab_size=518, font_len=28, seed=0):
+    """
+    Packed examples like package_cns.py writes, (cns_code, label, jpg bytes)
+    of a target | source image pair with a few dark strokes on white, so
+    the jpgs compress about as well as real glyphs
+    """
+    rng = np.random.RandomState(seed)
+    examples = list()
+    for _ in range(count):
+        img = np.full((image_size, image_size * 2), 255, dtype=np.uint8)
+        for _ in range(rng.randint(4, 12)):
+            x, y = rng.randint(0, image_size * 2 - 16), rng.randint(0, image_size - 16)
+            w, h = rng.randint(8, image_size // 2), rng.randint(8, image_size // 8)
+            if rng.rand() < 0.5:
+                w, h = h, w
+            img[y:y + h, x:x + w] = rng.randint(0, 64)
+        buf = io.BytesIO()
+        Image.fromarray(img).save(buf, format="JPEG")
+        cns_code = ",".join(str(n) for n in rng.randint(1, cns_vocab_size, rng.randint(1, font_len + 1)))
+        examples.append((cns_code, int(rng.randint(0, embedding_num)), buf.getvalue()))
+    return examples
+
+
+def rss_mb():
+    # resident set size now, the peak where /proc is missing
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024. * 1024.)
+    except (IOError, OSError):
+        return peak_rss_mb()
+
+
+def load_provider(obj_path):
+    # runs in a fresh process, the rss growth is what the examples take
+    rss_before = rss_mb()
+    start_time = time.time()
+    provider = PickledImageProvider(obj_path)
+    return {"seconds": time.time() - start_time, "examples": len(provider.examples),
+            "rss_mb": rss_mb() - rss_before}
+
+
+def run_suite(num_examples=256, load_examples=5000, batch_size=16, image_size=256, repeat=5):
+    """
+    {stage: {name: metric}} of every stage of the input path timed alone
+    on synthetic examples
+    """
+    examples = synthetic_examples(num_examples, image_size)
+    results = dict()
+
+    jpgs = itertools.cycle([e[2] for e in examples])
+    sec = time_call(lambda: read_split_image(bytes_to_file(next(jpgs))), repeat)
+    results["read_split_image"] = {"ms_per_image": metric(sec * 1e3, "ms")}
+
+    img_A, _ = read_split_image(bytes_to_file(examples[0][2]))
+    # the mean enlargement of get_batch_iter's augmentation
+    w, h = img_A.shape
+    nw, nh = int(1.1 * w) + 1, int(1.1 * h) + 1
+    sec = time_call(lambda: shift_and_resize_image(img_A, (nw - w) // 2, (nh - h) // 2, nw, nh), repeat)
+    results["shift_and_resize_image"] = {"ms_per_image": metric(sec * 1e3, "ms")}
+
+    sec = time_call(lambda: normalize_image(img_A), repeat)
+    results["normalize_image"] = {"ms_per_image": metric(sec * 1e3, "ms")}
+
+    cns_codes = [e[0] for e in examples[:batch_size]]
+    sec = time_call(lambda: handle_cns(cns_codes), repeat)
+    results["handle_cns"] = {"ms_per_batch": metric(sec * 1e3, "ms")}
+
+    for augment in (False, True):
+        num_batches = len(examples) // batch_size
+
+        def one_pass():
+            for _ in get_batch_iter(examples[:num_batches * batch_size], batch_size, augment=augment):
+                pass
+
+        sec = float(np.median([time_call(one_pass, 1) for _ in range(repeat)])) / num_batches
+        results["get_batch_iter_augment" if augment else "get_batch_iter"] = {
+            "ms_per_batch": metric(sec * 1e3, "ms"),
+            "batches_per_sec": metric(1. / sec, "batches/sec", better="higher"),
+        }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        obj_path = os.path.join(tmp_dir, "bench.obj")
+        with open(obj_path, "wb") as f:
+            for e in itertools.islice(itertools.cycle(examples), load_examples):
+                pickle.dump(e, f)
+        obj_mb = os.path.getsize(obj_path) / (1024. * 1024.)
+        runs = [run_isolated(load_provider, obj_path=obj_path) for _ in range(max(repeat // 2, 1))]
+    errors = [run["error"] for run in runs if "error" in run]
+    if errors:
+        raise Exception("loading the pickled examples failed: %s" % errors[0])
+    results["PickledImageProvider"] = {
+        "sec_per_1k_examples": metric(np.median([run["seconds"] for run in runs]) * 1e3 / load_examples, "sec"),
+        "rss_mb_per_obj_mb": metric(np.median([run["rss_mb"] for run in runs]) / obj_mb, "MB/MB"),
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every stage of the input path on synthetic data")
+    parser.add_argument("--examples", type=int, default=256, help="synthetic examples for the per stage timings")
+    parser.add_argument("--load_examples", type=int, default=5000, help="examples in the pickled file loaded")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--image_size", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=5, help="samples per timing, the median is reported")
+    parser.add_argument("--baseline", default=None, help="baseline json, benchmarks/baselines/%s_<host>.json "
+                                                         "by default" % SUITE)
+    parser.add_argument("--save_baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown against the baseline that counts as a regression")
+    parser.add_argument("--json", default=None, help="also write the results to this json file")
+    args = parser.parse_args()
+
+    baseline = args.baseline or baseline_path(SUITE)
+    settings = {"examples": args.examples, "load_examples": args.load_examples, "batch_size": args.batch_size,
+                "image_size": args.image_size, "repeat": args.repeat}
+    results = run_suite(args.examples, args.load_examples, args.batch_size, args.image_size, args.repeat)
+    report = {"suite": SUITE, "environment": environment(), "settings": settings, "results": results}
+    for stage, metrics in sorted(results.items()):
+        print("%-24s %s" % (stage, ", ".join("%s %.4f" % (name, m["value"]) for name, m in sorted(metrics.items()))))
+    if args.json:
+        save_report(report, args.json)
+
+    regressions = 0
+    previous = load_report(baseline)
+    if previous is not None:
+        if previous["settings"] != settings:
+            print("baseline %s was run with %s, the numbers may not compare" % (baseline, previous["settings"]))
+        regressions = print_comparison(compare(results, previous["results"], args.threshold), args.threshold)
+    elif not args.save_baseline:
+        print("no baseline at %s, run with --save_baseline to create it" % baseline)
+    if args.save_baseline:
+        save_report(report, baseline)
+        print("baseline saved to %s" % baseline)
+    # non zero exit for scripts and CI
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import argparse
+import csv
+import multiprocessing
+import sys
+import time
+
+from benchmarks.baseline import (metric, environment, baseline_path, save_report, load_report, compare,
+                                 print_comparison)
+from models.profiling import profile_model, run_isolated, thread_grid
+
+SUITE = "model_compute"
+TRAIN_PHASES = ("d_step", "g_step", "train")
+PHASES = TRAIN_PHASES + ("infer",)
+CSV_FIELDS = ("batch_size", "intra_op_threads", "inter_op_threads", "phase", "warmup_sec", "step_sec",
+              "images_per_sec", "peak_rss_mb", "error")
+
+
+def run_setting(batch_size, intra, inter, steps, model_kwargs):
+    """
+    {phase: timings} of one batch size and thread setting. The training
+    graph and the inference graph are timed in separate fresh processes,
+    as train.py and infer.py build them
+    """
+    trials = {
+        "train": run_isolated(profile_model, batch_size=batch_size, intra_op_threads=intra, inter_op_threads=inter,
+                              train=True, split_steps=True, steps=steps, **model_kwargs),
+        "infer": run_isolated(profile_model, batch_size=batch_size, intra_op_threads=intra, inter_op_threads=inter,
+                              train=False, steps=steps, **model_kwargs),
+    }
+    phases = dict()
+    for phase in PHASES:
+        trial = trials["train" if phase in TRAIN_PHASES else "infer"]
+        if "error" in trial:
+            phases[phase] = {"error": trial["error"]}
+        else:
+            phases[phase] = dict(trial[phase], peak_rss_mb=trial["peak_rss_mb"])
+    return phases
+
+
+def run_suite(batch_sizes, intra_grid, inter_grid, steps=5, model_kwargs=None):
+    """
+    Timings of every phase for every setting, a failed batch size, usually
+    out of memory, ends the sweep of its thread setting
+    """
+    trials = list()
+    for intra in intra_grid:
+        for inter in inter_grid:
+            for batch_size in batch_sizes:
+                phases = run_setting(batch_size, intra, inter, steps, model_kwargs or dict())
+                trials.append({"batch_size": batch_size, "intra_op_threads": intra, "inter_op_threads": inter,
+                               "phases": phases})
+                print("batch %d, intra %d, inter %d -> %s" % (batch_size, intra, inter, ", ".join(
+                    "%s %s" % (phase, phases[phase]["error"] if "error" in phases[phase]
+                               else "%.2f images/sec" % phases[phase]["images_per_sec"]) for phase in PHASES)))
+                if any("error" in p for p in phases.values()):
+                    break
+    return trials
+
+
+def to_results(trials):
+    # {setting: {name: metric}}, the form benchmarks.baseline compares
+    results = dict()
+    for trial in trials:
+        setting = "batch%d_intra%d_inter%d" % (trial["batch_size"], trial["intra_op_threads"],
+                                               trial["inter_op_threads"])
+        results[setting] = dict()
+        for phase, timing in trial["phases"].items():
+            if "error" not in timing:
+                results[setting][phase + "_images_per_sec"] = metric(timing["images_per_sec"], "images/sec",
+                                                                      better="higher")
+                results[setting][phase + "_peak_rss_mb"] = metric(timing["peak_rss_mb"], "MB")
+    return results
+
+
+def write_csv(trials, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for trial in trials:
+            for phase in PHASES:
+                timing = trial["phases"][phase]
+                row = dict((k, trial[k]) for k in ("batch_size", "intra_op_threads", "inter_op_threads"))
+                row["phase"] = phase
+                row.update((k, timing.get(k, "")) for k in CSV_FIELDS[4:])
+                writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time D step, G step, the full train iteration and inference "
+                                                 "on synthetic inputs, apart from any io")
+    parser.add_argument("--batch_sizes", default="1,4,16", help="comma separated batch sizes, in growing order")
+    parser.add_argument("--intra_op_threads", default=None,
+                        help="comma separated, powers of two up to the core count by default, 0 lets tf pick")
+    parser.add_argument("--inter_op_threads", default="0", help="comma separated, 0 lets tf pick")
+    parser.add_argument("--steps", type=int, default=5, help="steady state steps per phase, after one warm up")
+    parser.add_argument("--embedding_num", type=int, default=7)
+    parser.add_argument("--cns_embedding_size", type=int, default=128)
+    parser.add_argument("--image_size", type=int, default=256)
+    parser.add_argument("--inst_norm", type=int, default=0)
+    parser.add_argument("--xla", type=int, default=0)
+    parser.add_argument("--json", default=None, help="write the report to this json file")
+    parser.add_argument("--csv", default=None, help="write one row per setting and phase to this csv file")
+    parser.add_argument("--baseline", default=None, help="baseline json, benchmarks/baselines/%s_<host>.json "
+                                                         "by default" % SUITE)
+    parser.add_argument("--save_baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown against the baseline that counts as a regression")
+    args = parser.parse_args()
+
+    batch_sizes = [int(i) for i in args.batch_sizes.split(",")]
+    if args.intra_op_threads:
+        intra_grid = [int(i) for i in args.intra_op_threads.split(",")]
+    else:
+        intra_grid = thread_grid(multiprocessing.cpu_count())
+    inter_grid = [int(i) for i in args.inter_op_threads.split(",")]
+    model_kwargs = {"embedding_num": args.embedding_num, "cns_embedding_size": args.cns_embedding_size,
+                    "input_width": args.image_size, "output_width": args.image_size,
+                    "inst_norm": bool(args.inst_norm), "xla": bool(args.xla)}
+    settings = dict(model_kwargs, batch_sizes=batch_sizes, intra_op_threads=intra_grid, inter_op_threads=inter_grid,
+                    steps=args.steps)
+
+    start_time = time.time()
+    trials = run_suite(batch_sizes, intra_grid, inter_grid, args.steps, model_kwargs)
+    print("benchmark took %.1f sec" % (time.time() - start_time))
+    results = to_results(trials)
+    report = {"suite": SUITE, "environment": environment(), "settings": settings, "results": results,
+              "trials": trials}
+    if args.json:
+        save_report(report, args.json)
+    if args.csv:
+        write_csv(trials, args.csv)
+
+    baseline = args.baseline or baseline_path(SUITE)
+    regressions = 0
+    previous = load_report(baseline)
+    if previous is not None:
+        if previous["settings"] != settings:
+            print("baseline %s was run with %s, the numbers may not compare" % (baseline, previous["settings"]))
+        regressions = print_comparison(compare(results, previous["results"], args.threshold), args.threshold)
+    if args.save_baseline:
+        save_report(report, baseline)
+        print("baseline saved to %s" % baseline)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import argparse
+import os
+import pickle
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+from benchmarks.baseline import (metric, environment, baseline_path, save_report, load_report, compare,
+                                 print_comparison)
+from benchmarks.data_pipeline import synthetic_examples
+from models.profiling import run_isolated
+
+SUITE = "startup"
+STARTUP_LINE = re.compile(r"startup: imports ([\d.]+) sec, graph ([\d.]+) sec \((\w+)\), first glyphs ([\d.]+) sec")
+
+
+def save_random_checkpoint(model_dir, batch_size, embedding_num, cns_embedding_size):
+    # runs in a fresh process, a randomly initialized model times the same as a trained one
+    import tensorflow as tf
+    from models.unet_onehot_cns_font_attention import UNet
+
+    with tf.Graph().as_default(), tf.compat.v1.Session() as sess:
+        model = UNet(batch_size=batch_size, embedding_num=embedding_num, cns_embedding_size=cns_embedding_size)
+        model.register_session(sess)
+        model.build_model(is_training=False)
+        sess.run(tf.compat.v1.global_variables_initializer())
+        tf.compat.v1.train.Saver().save(sess, os.path.join(model_dir, "unet.model"), global_step=0)
+    return {"model_dir": model_dir}
+
+
+def run_infer(args, graph_cache_dir):
+    """
+    Wall clock seconds of one infer.py process and the startup it reports
+    """
+    start_time = time.time()
+    out = subprocess.run([sys.executable, "infer.py"] + args + ["--graph_cache_dir", graph_cache_dir],
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    seconds = time.time() - start_time
+    match = STARTUP_LINE.search(out.stdout)
+    if out.returncode or not match:
+        raise Exception("infer.py failed:\n%s" % out.stdout[-2000:])
+    return {"process_sec": seconds, "imports_sec": float(match.group(1)), "graph_sec": float(match.group(2)),
+            "graph": match.group(3), "first_glyphs_sec": float(match.group(4))}
+
+
+def run_suite(repeat=3, batch_size=16, embedding_num=7, cns_embedding_size=128, examples=32):
+    """
+    Time to first inference of infer.py with an empty graph cache (cold)
+    and with the graph cached by an earlier run (warm)
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_dir = os.path.join(tmp_dir, "checkpoint")
+        result = run_isolated(save_random_checkpoint, model_dir=model_dir, batch_size=batch_size,
+                              embedding_num=embedding_num, cns_embedding_size=cns_embedding_size)
+        if "error" in result:
+            raise Exception("saving a checkpoint failed: %s" % result["error"])
+        source_obj = os.path.join(tmp_dir, "source.obj")
+        with open(source_obj, "wb") as f:
+            for e in synthetic_examples(examples, embedding_num=embedding_num):
+                pickle.dump(e, f)
+        args = ["--model_dir", model_dir, "--source_obj", source_obj, "--embedding_ids", "0",
+                "--batch_size", str(batch_size), "--embedding_num", str(embedding_num),
+                "--cns_embedding_size", str(cns_embedding_size), "--save_dir", os.path.join(tmp_dir, "out")]
+        runs = {"cold": list(), "warm": list()}
+        for i in range(repeat):
+            graph_cache_dir = os.path.join(tmp_dir, "graphs_%d" % i)
+            for mode in ("cold", "warm"):
+                runs[mode].append(run_infer(args, graph_cache_dir))
+                print("%s run %d: %s" % (mode, i, runs[mode][-1]))
+
+    results = dict()
+    for mode in ("cold", "warm"):
+        results[mode] = dict((name, metric(np.median([run[name] for run in runs[mode]]), "sec"))
+                             for name in ("process_sec", "imports_sec", "graph_sec", "first_glyphs_sec"))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to first inference of infer.py, with and without the "
+                                                 "cached graph")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode, the median is reported")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--embedding_num", type=int, default=7)
+    parser.add_argument("--cns_embedding_size", type=int, default=128)
+    parser.add_argument("--baseline", default=None, help="baseline json, benchmarks/baselines/%s_<host>.json "
+                                                         "by default" % SUITE)
+    parser.add_argument("--save_baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown against the baseline that counts as a regression")
+    parser.add_argument("--json", default=None, help="also write the results to this json file")
+    args = parser.parse_args()
+
+    settings = {"repeat": args.repeat, "batch_size": args.batch_size, "embedding_num": args.embedding_num,
+                "cns_embedding_size": args.cns_embedding_size}
+    results = run_suite(args.repeat, args.batch_size, args.embedding_num, args.cns_embedding_size)
+    report = {"suite": SUITE, "environment": environment(), "settings": settings, "results": results}
+    for mode in ("cold", "warm"):
+        print("%-5s %s" % (mode, ", ".join("%s %.2f" % (name, m["value"]) for name, m in sorted(results[mode].items()))))
+    print("cached graph saves %.2f sec to first inference"
+          % (results["cold"]["first_glyphs_sec"]["value"] - results["warm"]["first_glyphs_sec"]["value"]))
+    if args.json:
+        save_report(report, args.json)
+
+    baseline = args.baseline or baseline_path(SUITE)
+    regressions = 0
+    previous = load_report(baseline)
+    if previous is not None:
+        if previous["settings"] != settings:
+            print("baseline %s was run with %s, the numbers may not compare" % (baseline, previous["settings"]))
+        regressions = print_comparison(compare(results, previous["results"], args.threshold), args.threshold)
+    if args.save_baseline:
+        save_report(report, baseline)
+        print("baseline saved to %s" % baseline)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import models.parser as parser
+from models.bulk import init_worker, load_done, merge_shards, run_shard, shard_chars, shard_digest
+from models.glyph_source import GlyphSource, read_chars
+from models.tuning import apply_tuning
+
+
+def main():
+    args = apply_tuning(parser.arg_parse(), "infer")
+    if args.embedding_ids == 'embedding_ids':
+        styles = list(range(args.embedding_num))
+    else:
+        styles = [int(i) for i in args.embedding_ids.split(",")]
+    glyph_source = GlyphSource(args.src_font)
+    # the whole CNS character set unless told otherwise
+    chars = read_chars(args.chars) if args.chars else glyph_source.charset()
+    shards = shard_chars(chars, args.shard_size)
+
+    todo = list()
+    for index, shard in enumerate(shards):
+        digest = shard_digest(shard, styles, args.output_format)
+        if args.resume and load_done(args.save_dir, index, digest):
+            continue
+        todo.append(index)
+    print("%d characters x %d styles in %d shards, %d to run" % (len(chars), len(styles), len(shards), len(todo)))
+
+    workers = max(1, min(args.bulk_workers, len(todo)))
+    # split the cores between the workers unless told otherwise
+    threads = args.intra_op_threads or max(1, (os.cpu_count() or 1) // workers)
+    config = {
+        "model_dir": args.model_dir,
+        "save_dir": args.save_dir,
+        "src_font": args.src_font,
+        "styles": styles,
+        "image_format": args.output_format,
+        "writer_threads": args.writer_threads,
+        "batch_size": args.batch_size,
+        "embedding_num": args.embedding_num,
+        "cns_embedding_size": args.cns_embedding_size,
+        "inst_norm": args.inst_norm,
+        "deterministic": args.deterministic,
+        "threads": threads,
+    }
+
+    if todo:
+        start_time = time.time()
+        done_chars = 0
+        # spawn, tensorflow does not survive a fork
+        ctx = multiprocessing.get_context("spawn")
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=init_worker,
+                                     initargs=(config,)) as pool:
+                futures = [pool.submit(run_shard, index, shards[index]) for index in todo]
+                for count, future in enumerate(as_completed(futures)):
+                    done = future.result()
+                    done_chars += done["chars"]
+                    elapsed = time.time() - start_time
+                    print("shard %d done in %.1f sec, %d/%d shards, %.1f chars/sec" % (
+                        done["shard"], done["seconds"], count + 1, len(todo), done_chars / elapsed))
+        except BrokenProcessPool:
+            raise Exception("a worker process died, run again with the same arguments to resume")
+
+    merge_shards(args.save_dir, len(shards), styles, args.output_format)
+
+
+if __name__ == '__main__':
+    main()
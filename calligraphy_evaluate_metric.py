@@ -1,78 +1,133 @@
 import argparse
 import glob
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
-from skimage.metrics import structural_similarity as ssim
-from skimage.metrics import peak_signal_noise_ratio as psnr
-from matplotlib import pyplot as plt
-
-
-def read_image(path):
-    img = plt.imread(path)
-    return img
-
-def get_mse(img_1, img_2):
-    return np.mean((img_1 - img_2) ** 2)
-
-def get_ssim(img_1, img_2):
-    return ssim(img_1, img_2, multichannel= True)
-
-def get_psnr(img_1, img_2):
-    return psnr(img_1, img_2)
-
-def get_average_mse_ssim_psnr(fig_names_1, fig_names_2):
-    mse_total = 0
-    ssim_total = 0
-    psnr_total = 0
-    for i in range(len(fig_names_1)):
-        img_1 = read_image(fig_names_1[i])
-        img_2 = read_image(fig_names_2[i])
-        # img_1 = img_1[:,:,0]
-        # img_2 = img_2[:,:,0]
-        mse_total += get_mse(img_1, img_2)
-        ssim_total += get_ssim(img_1, img_2)
-        psnr_total += get_psnr(img_1, img_2)
-    mse_avg = mse_total / (i + 1)
-    ssim_avg = ssim_total / (i + 1)
-    psnr_avg = psnr_total / (i + 1)
-    return mse_avg, ssim_avg, psnr_avg
+from models.metrics import METRICS, MetricCache, file_digest, file_metrics, summarize
+
+# extensions infer.py writes, tried in this order
+PRED_EXTENSIONS = (".jpg", ".png")
+
+
+def find_styles(gt_dir):
+    styles = [int(os.path.basename(d)[len("gt_"):]) for d in glob.glob(os.path.join(gt_dir, "gt_*"))
+              if os.path.basename(d)[len("gt_"):].isdigit()]
+    return sorted(styles)
+
+
+def find_pairs(gt_dir, pred_dir, style):
+    """
+    (ground truth, prediction) paths of style paired by name,
+    gt_<style>/<name>.jpg with style_<style>/inferred_<name>.jpg or .png,
+    and the names that have no prediction
+    """
+    pairs = list()
+    missing = list()
+    for gt_path in sorted(glob.glob(os.path.join(gt_dir, "gt_%d" % style, "*.jpg"))):
+        name = os.path.splitext(os.path.basename(gt_path))[0]
+        for ext in PRED_EXTENSIONS:
+            pred_path = os.path.join(pred_dir, "style_%d" % style, "inferred_%s%s" % (name, ext))
+            if os.path.exists(pred_path):
+                pairs.append((gt_path, pred_path))
+                break
+        else:
+            missing.append(name)
+    return pairs, missing
+
+
+def evaluate(gt_dir, pred_dir, styles=None, workers=None, chunk_size=8, cache=None):
+    """
+    Per style and overall mean MSE, SSIM and PSNR. Decoding and metrics run
+    in chunks of chunk_size pairs on a pool of worker processes. With a
+    MetricCache only the pairs it has not seen are scored
+    """
+    styles = styles if styles is not None else find_styles(gt_dir)
+    pairs = dict()
+    missing = dict()
+    for style in styles:
+        pairs[style], missing[style] = find_pairs(gt_dir, pred_dir, style)
+
+    values = dict((style, dict((m, list()) for m in METRICS)) for style in styles)
+    todo = dict((style, pairs[style]) for style in styles)
+    keys = dict()
+    if cache is not None:
+        paths = sorted(set(path for style in styles for pair in pairs[style] for path in pair))
+        # hashing is io bound, threads are enough
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            digests = dict(zip(paths, pool.map(file_digest, paths)))
+        for style in styles:
+            todo[style] = list()
+            for gt_path, pred_path in pairs[style]:
+                key = MetricCache.key(digests[gt_path], digests[pred_path])
+                cached = cache.get(key)
+                if cached is None:
+                    keys[(gt_path, pred_path)] = key
+                    todo[style].append((gt_path, pred_path))
+                else:
+                    for m in METRICS:
+                        values[style][m].append(cached[m])
+
+    tasks = [(style, todo[style][i:i + chunk_size])
+             for style in styles for i in range(0, len(todo[style]), chunk_size)]
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for (style, chunk), result in zip(tasks, pool.map(file_metrics, [chunk for _, chunk in tasks])):
+                for i, pair in enumerate(chunk):
+                    for m in METRICS:
+                        values[style][m].append(result[m][i])
+                    if cache is not None:
+                        cache.put(keys[pair], dict((m, result[m][i]) for m in METRICS))
+
+    report = summarize(values)
+    for style in styles:
+        report["styles"][str(style)]["missing"] = len(missing[style])
+    return report
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-g", help= "Path to ground truth folder")
     parser.add_argument("-p", help= "Path to prediction folder")
+    parser.add_argument("--styles", default=None, help="comma separated styles, every gt_<style> folder by default")
+    parser.add_argument("--workers", type=int, default=None, help="decoding processes, one per core by default")
+    parser.add_argument("--chunk_size", type=int, default=8, help="image pairs per batch of metrics")
+    parser.add_argument("--json", default=None, help="also write the results to this json file")
+    parser.add_argument("--cache", default=None,
+                        help="json file of the metrics of every image pair seen before, by content, "
+                             "only new or changed pairs are scored")
     args = parser.parse_args()
-    total_mse, total_ssim, total_psnr = 0, 0, 0
+    styles = [int(i) for i in args.styles.split(",")] if args.styles else None
 
-    for idx in range(7):
-        gt_folder_name = 'gt_' + str(idx)
-        output_folder_name = 'style_' + str(idx)
+    cache = MetricCache(args.cache) if args.cache else None
 
-        img_gt_paths = []
-        img_pred_paths = []
-        for gt_path in glob.glob(os.path.join(args.g, gt_folder_name, '*.jpg')):
-            file_name = gt_path[len(os.path.join(args.g, gt_folder_name))+1:-4]
-            img_gt_paths.append(gt_path)
-            img_pred_paths.append(os.path.join(args.p, output_folder_name, 'inferred_{}.jpg'.format(file_name)))
+    start_time = time.time()
+    report = evaluate(args.g, args.p, styles=styles, workers=args.workers, chunk_size=args.chunk_size,
+                      cache=cache)
+    report["seconds"] = time.time() - start_time
+    if cache is not None:
+        cache.save()
+        report["cache"] = {"hits": cache.hits, "misses": cache.misses}
+        print("metric cache: {} pairs reused, {} scored".format(cache.hits, cache.misses))
 
-        img_gt_paths.sort()
-        img_pred_paths.sort()
-
-        mse, ssim, psnr = get_average_mse_ssim_psnr(img_gt_paths, img_pred_paths)
-        print("Average MSE for style {}: {:.5f}".format(idx, mse))
-        print("Average SSIM for style {}: {:.5f}".format(idx, ssim))
-        print("Average PSNR for style {}: {:.5f}".format(idx, psnr))
-        total_mse += mse
-        total_ssim += ssim
-        total_psnr += psnr
-
-    print("Average MSE for total styles: {:.5f}".format(total_mse / 7))
-    print("Average SSIM for total styles: {:.5f}".format(total_ssim / 7))
-    print("Average PSNR for total styles: {:.5f}".format(total_psnr / 7))
+    for style, entry in sorted(report["styles"].items(), key=lambda item: int(item[0])):
+        if entry["missing"]:
+            print("{} ground truth images of style {} have no prediction".format(entry["missing"], style))
+        if not entry["count"]:
+            continue
+        print("Average MSE for style {}: {:.5f}".format(style, entry["mse"]))
+        print("Average SSIM for style {}: {:.5f}".format(style, entry["ssim"]))
+        print("Average PSNR for style {}: {:.5f}".format(style, entry["psnr"]))
+    if report["overall"]["count"]:
+        print("Average MSE for total styles: {:.5f}".format(report["overall"]["mse"]))
+        print("Average SSIM for total styles: {:.5f}".format(report["overall"]["ssim"]))
+        print("Average PSNR for total styles: {:.5f}".format(report["overall"]["psnr"]))
+    print("{} pairs evaluated in {:.1f} sec".format(report["overall"]["count"], report["seconds"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
 
 
 if __name__ == "__main__":
     main()
-
-# calculate mse, ssim score for each folder
-# calculate total_mse, total_ssim score for all folders
\ No newline at end of file
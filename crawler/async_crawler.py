@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+from http_cache import ContentStore, HttpCache
+
+NEXT_PAGE = "下一張"
+
+
+class RateLimiter(object):
+    """
+    Token bucket per host: at most rate requests per second on average and
+    burst at once, shared by every album crawled from that host
+    """
+
+    def __init__(self, rate=1.0, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = dict()
+
+    async def wait(self, url):
+        host = urlparse(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = {"tokens": float(self.burst), "time": time.monotonic(), "lock": asyncio.Lock()}
+        bucket = self.buckets[host]
+        async with bucket["lock"]:
+            while True:
+                now = time.monotonic()
+                bucket["tokens"] = min(self.burst, bucket["tokens"] + (now - bucket["time"]) * self.rate)
+                bucket["time"] = now
+                if bucket["tokens"] >= 1:
+                    bucket["tokens"] -= 1
+                    return
+                await asyncio.sleep((1 - bucket["tokens"]) / self.rate)
+
+
+class AlbumState(object):
+    """
+    Where a crawl of one album is: the next page to fetch and the images
+    already saved, kept in state_dir/<post_name>.json after every page
+    """
+
+    def __init__(self, path, start_url):
+        self.path = path
+        self.state = {"start_url": start_url, "next_url": start_url, "pages": 0, "downloaded": [], "done": False}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.state = json.load(f)
+        self.downloaded = set(self.state["downloaded"])
+
+    def save(self):
+        self.state["downloaded"] = sorted(self.downloaded)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def parse_page(html, page_url):
+    """
+    (image url, character, next page url) of an album page, None for
+    whatever the page does not have
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    img_url, char, next_url = None, None, None
+    img = soup.find_all("img", align="center")
+    if img:
+        img_url = urljoin(page_url, img[0]["src"])
+        char = img[0]["title"]
+    u = soup.find_all("a", string=NEXT_PAGE)
+    if u:
+        next_url = urljoin(page_url, u[0]["href"])
+    return img_url, char, next_url
+
+
+async def crawl_album(session, limiter, cache, store, url, post_name, state_dir="crawl_state", recrawl=False):
+    """
+    Follow the next page links of an album from url, or from where the last
+    run stopped, and put every image into the content store. With recrawl a
+    finished album is walked again, the cache only transfers what changed
+    """
+    state = AlbumState(os.path.join(state_dir, post_name + ".json"), url)
+    if state.state["done"]:
+        if not recrawl:
+            print("%s already crawled, %d images" % (post_name, len(state.downloaded)))
+            return len(state.downloaded)
+        state.state.update(next_url=state.state["start_url"], pages=0, done=False)
+        state.downloaded.clear()
+
+    while state.state["next_url"]:
+        page_url = state.state["next_url"]
+        html = (await cache.fetch(session, limiter, page_url)).decode("utf-8", errors="replace")
+        img_url, char, next_url = parse_page(html, page_url)
+        state.state["pages"] += 1
+        if img_url is None:
+            print("%s: cannot get image url for page %d" % (post_name, state.state["pages"]))
+        elif img_url not in state.downloaded:
+            data = await cache.fetch(session, limiter, img_url)
+            store.put(post_name, char, page_url, img_url, data)
+            state.downloaded.add(img_url)
+        state.state["next_url"] = next_url
+        state.state["done"] = next_url is None
+        state.save()
+    print("%s done, %d pages, %d images" % (post_name, state.state["pages"], len(state.downloaded)))
+    return len(state.downloaded)
+
+
+async def crawl(albums, out_dir=".", state_dir="crawl_state", rate=1.0, burst=1, connections=4,
+                cache_dir=None, max_age=0, recrawl=False):
+    """
+    Crawl the (url, post_name) albums concurrently over one pool of keep
+    alive connections, the rate limit holds for all of them together
+    """
+    if not os.path.exists(state_dir):
+        os.makedirs(state_dir)
+    limiter = RateLimiter(rate, burst)
+    cache = HttpCache(cache_dir, max_age)
+    store = ContentStore(out_dir)
+    connector = aiohttp.TCPConnector(limit_per_host=connections)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        results = await asyncio.gather(
+            *[crawl_album(session, limiter, cache, store, url, name, state_dir, recrawl) for url, name in albums],
+            return_exceptions=True)
+    for (url, name), result in zip(albums, results):
+        if isinstance(result, Exception):
+            print("%s failed: %s, run again to resume" % (name, result))
+    print("http cache: %s" % dict(cache.stats))
+    return results
+
+
+def read_albums(path):
+    # "url post_name" per line, as in download_data.sh
+    albums = list()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            split = line.split()
+            if len(split) >= 2 and not line.lstrip().startswith("#"):
+                albums.append((split[-2], split[-1]))
+    return albums
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("albums", nargs="*", help="start url and post name of every album, in pairs")
+    parser.add_argument("--album_file", default=None, help="file of 'url post_name' lines")
+    parser.add_argument("--out_dir", default=".",
+                        help="every album is saved at out_dir/post_name, out_dir/manifest.jsonl lists the images")
+    parser.add_argument("--state_dir", default="crawl_state", help="progress of every album, to resume from")
+    parser.add_argument("--rate", type=float, default=0.33, help="requests per second per host")
+    parser.add_argument("--burst", type=int, default=1, help="requests per host that may go out at once")
+    parser.add_argument("--connections", type=int, default=4, help="keep alive connections per host")
+    parser.add_argument("--cache_dir", default="crawl_cache",
+                        help="pages and images by url, revalidated with ETag and Last-Modified")
+    parser.add_argument("--cache_max_age", type=float, default=0,
+                        help="seconds a cached response is used without asking the server")
+    parser.add_argument("--recrawl", action="store_true",
+                        help="walk finished albums again, only new or changed content is downloaded")
+    args = parser.parse_args()
+
+    albums = list(zip(args.albums[0::2], args.albums[1::2]))
+    if args.album_file:
+        albums += read_albums(args.album_file)
+    if not albums:
+        parser.error("no albums given")
+    asyncio.run(crawl(albums, args.out_dir, args.state_dir, args.rate, args.burst, args.connections,
+                      args.cache_dir, args.cache_max_age, args.recrawl))
+
+
+if __name__ == "__main__":
+    main()
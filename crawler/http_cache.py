@@ -0,0 +1,140 @@
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import time
+
+import aiohttp
+
+
+async def request(session, limiter, url, headers=None, retries=3):
+    """
+    (status, headers, body) of a GET, retried with backoff on connection
+    errors and server errors
+    """
+    for attempt in range(retries):
+        await limiter.wait(url)
+        try:
+            async with session.get(url, headers=headers) as r:
+                if r.status >= 500:
+                    r.raise_for_status()
+                body = await r.read()
+                if r.status not in (200, 304):
+                    r.raise_for_status()
+                return r.status, r.headers, body
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == retries - 1:
+                raise
+            print("retry %s after %s" % (url, e))
+            await asyncio.sleep(2 ** attempt)
+
+
+class HttpCache(object):
+    """
+    Responses on disk by url, with their ETag and Last-Modified. A cached
+    url is revalidated with a conditional request, a 304 costs no body.
+    Within max_age seconds of the last check it is not requested at all.
+    Without cache_dir every fetch goes to the network
+    """
+
+    def __init__(self, cache_dir=None, max_age=0):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.stats = collections.Counter()
+
+    def paths(self, url):
+        digest = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, digest[:2], digest)
+        return base + ".json", base + ".body"
+
+    def load(self, url):
+        meta_path, body_path = self.paths(url)
+        if not os.path.exists(meta_path) or not os.path.exists(body_path):
+            return None, None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(body_path, "rb") as f:
+            return meta, f.read()
+
+    def store(self, url, meta, body=None):
+        meta_path, body_path = self.paths(url)
+        if not os.path.exists(os.path.dirname(meta_path)):
+            os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        # body first, a meta file always has its body
+        if body is not None:
+            with open(body_path + ".tmp", "wb") as f:
+                f.write(body)
+            os.replace(body_path + ".tmp", body_path)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    async def fetch(self, session, limiter, url):
+        if not self.cache_dir:
+            _, _, body = await request(session, limiter, url)
+            self.stats["downloaded"] += 1
+            self.stats["bytes"] += len(body)
+            return body
+        meta, cached = self.load(url)
+        headers = dict()
+        if meta:
+            if time.time() - meta["checked"] < self.max_age:
+                self.stats["fresh"] += 1
+                return cached
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        status, response_headers, body = await request(session, limiter, url, headers=headers)
+        if status == 304 and meta:
+            meta["checked"] = time.time()
+            self.store(url, meta)
+            self.stats["revalidated"] += 1
+            return cached
+        self.store(url, {"url": url, "etag": response_headers.get("ETag"),
+                         "last_modified": response_headers.get("Last-Modified"), "checked": time.time()}, body)
+        self.stats["downloaded"] += 1
+        self.stats["bytes"] += len(body)
+        return body
+
+
+class ContentStore(object):
+    """
+    Crawled images of every album saved once per distinct content as
+    out_dir/<album>/<char>_<sha8>.png, so variants of a character never
+    overwrite each other. out_dir/manifest.jsonl has a line per (char,
+    album, page) with the file it points to, appended as images arrive
+    """
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.manifest_path = os.path.join(out_dir, "manifest.jsonl")
+        # (album, page) -> manifest entry, the last line of a page wins
+        self.entries = dict()
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.entries[(entry["album"], entry["page"])] = entry
+
+    def put(self, album, char, page_url, img_url, data):
+        """
+        Manifest entry of the image, written only if its content is new
+        """
+        sha1 = hashlib.sha1(data).hexdigest()
+        name = "%s_%s.png" % (char, sha1[:8])
+        path = os.path.join(self.out_dir, album, name)
+        if not os.path.exists(path):
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        entry = {"char": char, "album": album, "page": page_url, "url": img_url, "sha1": sha1,
+                 "file": os.path.join(album, name)}
+        if self.entries.get((album, page_url)) != entry:
+            self.entries[(album, page_url)] = entry
+            with open(self.manifest_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return entry
@@ -0,0 +1,150 @@
+"""
+async_crawler against a local stub of an album site, run from the
+repository root with
+
+    python -m unittest discover -s crawler
+"""
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from async_crawler import AlbumState, RateLimiter, crawl
+
+CHARS = ["永", "和", "九"]
+
+
+class StubAlbum(BaseHTTPRequestHandler):
+    """
+    /album/<n> shows the image of CHARS[n - 1] with a link to the next
+    page, the last page has none. Pages in server.broken answer 503
+    """
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, time.monotonic()))
+        kind, _, n = self.path.strip("/").partition("/")
+        n = int(n) if n.isdigit() else 0
+        if not 1 <= n <= len(CHARS) or kind not in ("album", "img") or self.path in server.broken:
+            self.send_error(503 if self.path in server.broken else 404)
+            return
+        if kind == "img":
+            body, content_type = ("image %d" % n).encode("utf-8"), "image/png"
+        else:
+            link = '<a href="/album/%d">下一張</a>' % (n + 1) if n < len(CHARS) else ""
+            body = ('<html><body><img align="center" src="/img/%d" title="%s">%s</body></html>'
+                    % (n, CHARS[n - 1], link)).encode("utf-8")
+            content_type = "text/html; charset=utf-8"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AsyncCrawlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubAlbum)
+        self.server.lock = threading.Lock()
+        self.server.requests = list()
+        self.server.broken = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.dir = tempfile.mkdtemp()
+        self.out_dir = os.path.join(self.dir, "out")
+        self.state_dir = os.path.join(self.dir, "state")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def crawl(self, rate=100.0, burst=5):
+        return asyncio.run(crawl([(self.base + "/album/1", "post")], self.out_dir, self.state_dir,
+                                 rate=rate, burst=burst, cache_dir=os.path.join(self.dir, "cache")))
+
+    def requested(self):
+        with self.server.lock:
+            paths = [path for path, _ in self.server.requests]
+            self.server.requests.clear()
+        return paths
+
+    def manifest(self):
+        with open(os.path.join(self.out_dir, "manifest.jsonl"), encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def state(self):
+        return AlbumState(os.path.join(self.state_dir, "post.json"), None).state
+
+    def test_three_page_album(self):
+        self.assertEqual(self.crawl(), [3])
+        self.assertEqual(self.requested(), ["/album/1", "/img/1", "/album/2", "/img/2", "/album/3", "/img/3"])
+        entries = self.manifest()
+        self.assertEqual([entry["char"] for entry in entries], CHARS)
+        for n, entry in enumerate(entries, 1):
+            with open(os.path.join(self.out_dir, entry["file"]), "rb") as f:
+                self.assertEqual(f.read(), ("image %d" % n).encode("utf-8"))
+        state = self.state()
+        self.assertTrue(state["done"])
+        self.assertEqual(state["pages"], 3)
+
+        # a finished album is not requested again
+        self.assertEqual(self.crawl(), [3])
+        self.assertEqual(self.requested(), [])
+
+    def test_resume_after_interruption(self):
+        self.server.broken.add("/album/3")
+        results = self.crawl()
+        self.assertIsInstance(results[0], Exception)
+        state = self.state()
+        self.assertFalse(state["done"])
+        self.assertEqual(state["next_url"], self.base + "/album/3")
+        self.assertEqual(len(state["downloaded"]), 2)
+        self.assertEqual([entry["char"] for entry in self.manifest()], CHARS[:2])
+        self.requested()
+
+        self.server.broken.clear()
+        self.assertEqual(self.crawl(), [3])
+        self.assertEqual(self.requested(), ["/album/3", "/img/3"])
+        self.assertEqual([entry["char"] for entry in self.manifest()], CHARS)
+        self.assertTrue(self.state()["done"])
+
+    def test_rate_limit(self):
+        rate = 20.0
+        self.crawl(rate=rate, burst=1)
+        times = [t for _, t in self.server.requests]
+        self.assertEqual(len(times), 6)
+        # some slack for the timer, the bucket refills at exactly rate
+        self.assertGreaterEqual(times[-1] - times[0], 5 / rate * 0.9)
+
+    def test_rate_limiter_burst_and_hosts(self):
+        async def run():
+            limiter = RateLimiter(rate=10.0, burst=2)
+            start = time.monotonic()
+            await limiter.wait("http://a.test/1")
+            await limiter.wait("http://a.test/2")
+            burst = time.monotonic() - start
+            # another host has a bucket of its own
+            await limiter.wait("http://b.test/1")
+            other = time.monotonic() - start
+            await limiter.wait("http://a.test/3")
+            return burst, other, time.monotonic() - start
+
+        burst, other, limited = asyncio.run(run())
+        self.assertLess(burst, 0.05)
+        self.assertLess(other, 0.05)
+        self.assertGreaterEqual(limited, 0.09)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+import os
+import numpy as np
+import models.parser as parser
+import tensorflow as tf
+from models.cns_memory import build_cns_memory_table
+from models.tuning import apply_tuning, session_config
+from models.unet_onehot_cns_font_attention import UNet
+
+
+def main(_):
+    args = apply_tuning(parser.arg_parse(), "infer")
+    config = session_config(args)
+    if not os.path.exists(args.export_dir):
+        os.makedirs(args.export_dir)
+
+    with tf.compat.v1.Session(config=config) as sess:
+        model = UNet(batch_size=args.batch_size, embedding_num=args.embedding_num,
+                     cns_embedding_size=args.cns_embedding_size, deterministic=True)
+        model.register_session(sess)
+        model.build_model(is_training=False, inst_norm=args.inst_norm)
+        model.export_generator(args.export_dir, args.model_dir)
+        build_cns_memory_table(model, args.export_dir, component_path=args.component_path,
+                               dtype=np.float16 if args.memory_float16 else np.float32)
+
+
+if __name__ == '__main__':
+    tf.compat.v1.app.run()
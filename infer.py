@@ -1,38 +1,84 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 from __future__ import absolute_import
+import json
+import os
+import time
+# before the heavy imports, the time to first inference counts them
+START_TIME = time.time()
 import models.parser as parser
 import tensorflow as tf
+from models.glyph_cache import GlyphCache
+from models.graph_cache import build_model_cached, graph_cache_dir
+from models.glyph_source import GlyphSource, read_chars
+from models.jobs import style_pairs
 from models.unet_onehot_cns_font_attention import UNet
+from models.tuning import apply_tuning, session_config
 
 
 def main(_):
-    args = parser.arg_parse()
-    config = tf.compat.v1.ConfigProto()
-    config.gpu_options.allow_growth = True
+    main_start = time.time()
+    args = apply_tuning(parser.arg_parse(), "infer")
+    config = session_config(args)
+    if args.cache_dir and not args.deterministic:
+        # a cached dropout sample would stand in for every later run
+        print("cached glyphs have to be reproducible, infer with dropout off")
+        args.deterministic = 1
 
     with tf.compat.v1.Session(config=config) as sess:
-        model = UNet(batch_size=args.batch_size, embedding_num=args.embedding_num, cns_embedding_size=args.cns_embedding_size)
+        model = UNet(batch_size=args.batch_size, embedding_num=args.embedding_num, cns_embedding_size=args.cns_embedding_size,
+                     xla=args.xla, deterministic=args.deterministic)
         model.register_session(sess)
-        model.build_model(is_training=False, inst_norm=args.inst_norm)
+        graph_start = time.time()
+        if args.fanout:
+            # the fan-out graph reuses the variables through the variable store
+            model.build_model(is_training=False, inst_norm=args.inst_norm)
+            graph_source = "built"
+        else:
+            graph_source = build_model_cached(model, graph_cache_dir(args), is_training=False,
+                                              inst_norm=args.inst_norm)
+        graph_seconds = time.time() - graph_start
+        if args.evaluate:
+            # no images written, scored against the targets in memory
+            report = model.evaluate(source_obj=args.source_obj, model_dir=args.model_dir)
+            model.log_evaluation(report, 0, 0)
+            if not os.path.exists(args.save_dir):
+                os.makedirs(args.save_dir)
+            with open(os.path.join(args.save_dir, "metrics.json"), "w") as f:
+                json.dump(report, f, indent=2)
+            return
         embedding_ids = [int(i) for i in args.embedding_ids.split(",")]
-        if not args.interpolate:
-            if len(embedding_ids) == 1:
-                embedding_ids = embedding_ids[0]
-            model.infer(model_dir=args.model_dir, source_obj=args.source_obj, embedding_ids=embedding_ids,
-                        save_dir=args.save_dir)
+        if args.fanout:
+            model.build_fanout(len(embedding_ids), inst_norm=args.inst_norm)
+            model.infer_fanout(model_dir=args.model_dir, source_obj=args.source_obj, embedding_ids=embedding_ids,
+                               save_dir=args.save_dir, image_format=args.output_format,
+                               writer_threads=args.writer_threads)
+        elif not args.interpolate:
+            cache = None
+            if args.cache_dir:
+                cache = GlyphCache(args.model_dir, capacity=args.cache_size, cache_dir=args.cache_dir,
+                                   max_disk_mb=args.cache_mb)
+            if args.chars:
+                # no packed source needed, render the glyphs on the fly
+                glyph_source = GlyphSource(args.src_font)
+                model.infer_chars(read_chars(args.chars), glyph_source, embedding_ids=embedding_ids,
+                                  model_dir=args.model_dir, save_dir=args.save_dir, cache=cache,
+                                  image_format=args.output_format, writer_threads=args.writer_threads)
+            else:
+                if len(embedding_ids) == 1:
+                    embedding_ids = embedding_ids[0]
+                model.infer(model_dir=args.model_dir, source_obj=args.source_obj, embedding_ids=embedding_ids,
+                            save_dir=args.save_dir, cache=cache, image_format=args.output_format,
+                            writer_threads=args.writer_threads)
+            if cache:
+                print("glyph cache: %s" % cache.metrics())
         else:
-            if len(embedding_ids) < 2:
-                raise Exception("no need to interpolate yourself unless you are a narcissist")
-            chains = embedding_ids[:]
-            if args.uroboros:
-                chains.append(chains[0])
-            pairs = list()
-            for i in range(len(chains) - 1):
-                pairs.append((chains[i], chains[i + 1]))
-            for s, e in pairs:
-                model.interpolate(model_dir=args.model_dir, source_obj=args.source_obj, between=[s, e],
-                                  save_dir=args.save_dir, steps=args.steps)
+            model.interpolate(model_dir=args.model_dir, source_obj=args.source_obj,
+                              pairs=style_pairs(embedding_ids, args.uroboros), save_dir=args.save_dir,
+                              steps=args.steps)
+        if model.first_output_time:
+            print("startup: imports %.2f sec, graph %.2f sec (%s), first glyphs %.2f sec after start"
+                  % (main_start - START_TIME, graph_seconds, graph_source, model.first_output_time - START_TIME))
 
 
 if __name__ == '__main__':
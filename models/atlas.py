@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from models.glyph_writer import to_uint8
+
+ATLAS_NAME = "atlas.bin"
+INDEX_NAME = "atlas_index.json"
+# output format -> tile format, gray is a byte per pixel, bits a bit
+ATLAS_FORMATS = {"atlas": "gray", "atlas_bits": "bits"}
+
+
+def tile_bytes(tile_shape, tile_format):
+    pixels = tile_shape[0] * tile_shape[1]
+    return pixels if tile_format == "gray" else (pixels + 7) // 8
+
+
+def write_index(save_dir, index):
+    # the index is written last and renamed, readers never see one that
+    # points past the end of the tiles
+    path = os.path.join(save_dir, INDEX_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)
+
+
+class AtlasWriter(object):
+    """
+    Write generated glyphs as fixed size tiles into save_dir/atlas.bin,
+    addressed by save_dir/atlas_index.json: {"tiles": {style: {name: slot}}}.
+    Tile slot starts at byte slot * tile_bytes. Same interface as
+    GlyphWriter, tiles are converted and appended on a background thread in
+    the order they were queued. A glyph written again overwrites its slot,
+    every slot is in the index
+    """
+
+    def __init__(self, save_dir, image_format="atlas", max_pending=8, threshold=0.5):
+        if image_format not in ATLAS_FORMATS:
+            raise Exception("unknown atlas format %s, use one of %s" % (image_format, sorted(ATLAS_FORMATS)))
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        self.save_dir = save_dir
+        self.tile_format = ATLAS_FORMATS[image_format]
+        self.threshold = int(threshold * 255)
+        self.file = open(os.path.join(save_dir, ATLAS_NAME), "wb")
+        self.tiles = dict()
+        self.tile_shape = None
+        self.slots = 0
+        # one thread keeps the slots in queue order
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.futures = list()
+        self.count = 0
+
+    def tile(self, image):
+        img = to_uint8(image)
+        if self.tile_shape is None:
+            self.tile_shape = list(img.shape)
+        elif list(img.shape) != self.tile_shape:
+            raise Exception("tile of shape %s in an atlas of %s" % (img.shape, self.tile_shape))
+        if self.tile_format == "bits":
+            return np.packbits(img > self.threshold).tobytes()
+        return img.tobytes()
+
+    def write_all(self, names, styles, images):
+        try:
+            for name, style, image in zip(names, styles, images):
+                tiles = self.tiles.setdefault(str(style), dict())
+                data = self.tile(image)
+                if name in tiles:
+                    # a repeated glyph replaces its tile in place
+                    self.file.seek(tiles[name] * len(data))
+                    self.file.write(data)
+                    self.file.seek(0, os.SEEK_END)
+                    continue
+                tiles[name] = self.slots
+                self.slots += 1
+                self.file.write(data)
+        finally:
+            self.pending.release()
+
+    def write_batch(self, names, styles, images):
+        """
+        Queue a batch, only the first len(names) images are written so the
+        padding of the last batch can be left out
+        """
+        self.pending.acquire()
+        self.futures.append(self.pool.submit(self.write_all, list(names), list(styles), images[:len(names)]))
+        self.count += len(names)
+        pending = list()
+        for f in self.futures:
+            if f.done():
+                f.result()
+            else:
+                pending.append(f)
+        self.futures = pending
+
+    def close(self):
+        try:
+            for f in self.futures:
+                f.result()
+        finally:
+            self.pool.shutdown()
+            self.file.close()
+        write_index(self.save_dir, {
+            "format": self.tile_format,
+            "tile_shape": self.tile_shape,
+            "tile_bytes": tile_bytes(self.tile_shape, self.tile_format) if self.tile_shape else 0,
+            "slots": self.slots,
+            "tiles": self.tiles,
+        })
+        print("%d glyphs written to %s" % (self.count, os.path.join(self.save_dir, ATLAS_NAME)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class GlyphAtlas(object):
+    """
+    Read side of AtlasWriter. atlas.bin is memory mapped, fetching a glyph
+    reads one contiguous tile
+    """
+
+    def __init__(self, save_dir):
+        with open(os.path.join(save_dir, INDEX_NAME)) as f:
+            index = json.load(f)
+        self.tile_format = index["format"]
+        self.tile_shape = index["tile_shape"]
+        self.tile_bytes = index["tile_bytes"]
+        self.tiles = index["tiles"]
+        self.path = os.path.join(save_dir, ATLAS_NAME)
+        self.data = None
+        if index["slots"]:
+            self.data = np.memmap(self.path, dtype=np.uint8, mode="r", shape=(index["slots"], self.tile_bytes))
+
+    def __contains__(self, key):
+        name, style = key
+        return name in self.tiles.get(str(style), {})
+
+    def __len__(self):
+        return sum(len(names) for names in self.tiles.values())
+
+    def styles(self):
+        return sorted(int(style) for style in self.tiles)
+
+    def names(self, style):
+        return sorted(self.tiles.get(str(style), {}))
+
+    def offset(self, name, style):
+        """
+        Byte offset of the tile in atlas.bin, for readers that seek themselves
+        """
+        return self.tiles[str(style)][name] * self.tile_bytes
+
+    def raw(self, name, style):
+        return self.data[self.tiles[str(style)][name]]
+
+    def get(self, name, style):
+        """
+        The glyph as a 2d uint8 gray scale image
+        """
+        tile = self.raw(name, style)
+        if self.tile_format == "bits":
+            pixels = self.tile_shape[0] * self.tile_shape[1]
+            return (np.unpackbits(tile)[:pixels] * 255).reshape(self.tile_shape)
+        return np.asarray(tile).reshape(self.tile_shape)
+
+
+def merge_atlases(atlas_dirs, save_dir):
+    """
+    Combine the atlases of atlas_dirs into one at save_dir, later ones win
+    for glyphs that are in several. Only the tiles the merged index points
+    to are copied
+    """
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    index = None
+    parts = list()
+    # (style, name) -> (part, slot) of the tile that wins
+    winners = dict()
+    for atlas_dir in atlas_dirs:
+        with open(os.path.join(atlas_dir, INDEX_NAME)) as f:
+            part = json.load(f)
+        if not part["slots"]:
+            continue
+        if index is None:
+            index = dict(part, slots=0, tiles=dict())
+        elif (part["format"], part["tile_shape"]) != (index["format"], index["tile_shape"]):
+            raise Exception("cannot merge %s atlas %s into %s atlas %s" % (
+                part["format"], part["tile_shape"], index["format"], index["tile_shape"]))
+        for style, names in part["tiles"].items():
+            for name, slot in names.items():
+                winners[(style, name)] = (len(parts), slot)
+        parts.append(atlas_dir)
+
+    with open(os.path.join(save_dir, ATLAS_NAME), "wb") as out:
+        for i, atlas_dir in enumerate(parts):
+            # in slot order, the reads of a part stay sequential
+            tiles = sorted((slot, key) for key, (part, slot) in winners.items() if part == i)
+            with open(os.path.join(atlas_dir, ATLAS_NAME), "rb") as f:
+                for slot, (style, name) in tiles:
+                    f.seek(slot * index["tile_bytes"])
+                    out.write(f.read(index["tile_bytes"]))
+                    index["tiles"].setdefault(style, dict())[name] = index["slots"]
+                    index["slots"] += 1
+    index = index or {"format": None, "tile_shape": None, "tile_bytes": 0, "slots": 0, "tiles": {}}
+    write_index(save_dir, index)
+    return index
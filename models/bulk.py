@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+
+SHARD_DIR = "shards"
+MANIFEST_NAME = "bulk_manifest.json"
+
+# state of a worker process, set up once by init_worker
+_worker = dict()
+
+
+def shard_chars(chars, shard_size):
+    return [chars[i:i + shard_size] for i in range(0, len(chars), shard_size)]
+
+
+def shard_digest(chars, styles, image_format):
+    """
+    Identity of a shard's work, a finished shard is only reused for the same
+    characters, styles and format
+    """
+    key = "%s|%s|%s" % ("".join(chars), ",".join(str(s) for s in styles), image_format)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def shard_paths(save_dir, index):
+    """
+    (output dir, done marker) of shard index
+    """
+    base = os.path.join(save_dir, SHARD_DIR, "shard_%05d" % index)
+    return base, base + ".done"
+
+
+def load_done(save_dir, index, digest):
+    _, marker = shard_paths(save_dir, index)
+    if not os.path.exists(marker):
+        return None
+    with open(marker) as f:
+        done = json.load(f)
+    return done if done.get("digest") == digest else None
+
+
+def init_worker(config):
+    """
+    Build and restore the fan-out generator once per process. The session
+    gets config["threads"] intra op threads, so workers do not oversubscribe
+    the cores between them
+    """
+    import tensorflow as tf
+    from models.glyph_source import GlyphSource
+    from models.unet_onehot_cns_font_attention import UNet
+
+    session_config = tf.compat.v1.ConfigProto()
+    session_config.intra_op_parallelism_threads = config["threads"]
+    session_config.inter_op_parallelism_threads = 2
+    sess = tf.compat.v1.Session(config=session_config)
+    model = UNet(batch_size=config["batch_size"], embedding_num=config["embedding_num"],
+                 cns_embedding_size=config["cns_embedding_size"], deterministic=config["deterministic"])
+    model.register_session(sess)
+    # the session outlives this function, its graph is only made the default while building
+    with sess.graph.as_default():
+        model.build_model(is_training=False, inst_norm=config["inst_norm"])
+        model.build_fanout(len(config["styles"]), inst_norm=config["inst_norm"])
+        model.restore_generator(config["model_dir"])
+    _worker.update(config, model=model, glyph_source=GlyphSource(config["src_font"]))
+    print("worker %d ready, %d threads" % (os.getpid(), config["threads"]))
+
+
+def run_shard(index, chars):
+    """
+    Generate every style of chars into the shard's own directory, then drop
+    the done marker. A shard that was cut off is started over
+    """
+    from models.glyph_writer import char_name, make_writer
+
+    model = _worker["model"]
+    styles = _worker["styles"]
+    image_format = _worker["image_format"]
+    shard_dir, marker = shard_paths(_worker["save_dir"], index)
+    if os.path.exists(shard_dir):
+        shutil.rmtree(shard_dir)
+    start_time = time.time()
+    written = set()
+    with make_writer(shard_dir, image_format, num_workers=_worker["writer_threads"]) as writer:
+        for batch_chars, cns_code, seq_len, _, source_imgs in \
+                _worker["glyph_source"].batch_iter(chars, model.batch_size, styles):
+            fake_imgs = model.generate_fanout(source_imgs, cns_code, seq_len, styles)
+            # the padding of the last batch repeats earlier characters, also of the same batch
+            new = list()
+            for i, ch in enumerate(batch_chars):
+                if ch not in written:
+                    written.add(ch)
+                    new.append(i)
+            for j, style in enumerate(styles):
+                writer.write_batch([char_name(batch_chars[i]) for i in new], [style] * len(new),
+                                   fake_imgs[new, j])
+    done = {
+        "shard": index,
+        "digest": shard_digest(chars, styles, image_format),
+        "chars": len(chars),
+        "generated": len(written),
+        "glyphs": len(written) * len(styles),
+        "seconds": time.time() - start_time,
+        "pid": os.getpid(),
+    }
+    # the marker is written aside and renamed, a crash never leaves half of it
+    with open(marker + ".tmp", "w") as f:
+        json.dump(done, f)
+    os.replace(marker + ".tmp", marker)
+    return done
+
+
+def merge_shards(save_dir, num_shards, styles, image_format="jpg"):
+    """
+    Move the glyphs of every finished shard to save_dir/style_<id>/, the
+    layout infer.py writes, or into one atlas at save_dir, and record the
+    run in a manifest. Merged shard directories are removed, their done
+    markers are kept for resuming
+    """
+    from models.atlas import ATLAS_FORMATS, ATLAS_NAME, INDEX_NAME, merge_atlases
+
+    moved = 0
+    shards = list()
+    shard_dirs = list()
+    for index in range(num_shards):
+        shard_dir, marker = shard_paths(save_dir, index)
+        with open(marker) as f:
+            shards.append(json.load(f))
+        if os.path.exists(shard_dir):
+            shard_dirs.append(shard_dir)
+    if image_format in ATLAS_FORMATS and shard_dirs:
+        # shards of an earlier merge are in the atlas at save_dir already
+        parts = shard_dirs
+        if os.path.exists(os.path.join(save_dir, INDEX_NAME)):
+            parts = [save_dir] + parts
+        merged_dir = os.path.join(save_dir, SHARD_DIR, "merged")
+        tiles = merge_atlases(parts, merged_dir)["tiles"]
+        moved = sum(len(names) for names in tiles.values())
+        for name in (ATLAS_NAME, INDEX_NAME):
+            os.replace(os.path.join(merged_dir, name), os.path.join(save_dir, name))
+        shutil.rmtree(merged_dir)
+    for shard_dir in shard_dirs:
+        for path in glob.glob(os.path.join(shard_dir, "style_*", "*")):
+            style_dir = os.path.join(save_dir, os.path.basename(os.path.dirname(path)))
+            if not os.path.exists(style_dir):
+                os.makedirs(style_dir)
+            os.replace(path, os.path.join(style_dir, os.path.basename(path)))
+            moved += 1
+        if os.path.exists(shard_dir):
+            shutil.rmtree(shard_dir)
+    manifest = {
+        "styles": list(styles),
+        "shards": shards,
+        "chars": sum(s["chars"] for s in shards),
+        "glyphs": sum(s["glyphs"] for s in shards),
+        "shard_seconds": sum(s["seconds"] for s in shards),
+    }
+    with open(os.path.join(save_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print("merged %d glyphs of %d shards into %s" % (moved, num_shards, save_dir))
+    return manifest
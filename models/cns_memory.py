@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import json
+import os
+import time
+import numpy as np
+from models.glyph_source import code_in_vocab
+
+TABLE_NAME = "cns_memory.npy"
+INDEX_NAME = "cns_memory_index.json"
+
+
+def component_codes(component_path, vocab_size, max_len):
+    """
+    Distinct first decompositions in CNS_component.txt the cns encoder can
+    embed, in file order
+    """
+    codes = list()
+    seen = set()
+    skipped = 0
+    with open(component_path, "rb") as f:
+        for line in f:
+            split = line.decode().strip().split("\t")
+            if len(split) != 2:
+                continue
+            code = split[1].split(";")[0]
+            if code in seen:
+                continue
+            seen.add(code)
+            if not code_in_vocab(code, vocab_size, max_len):
+                skipped += 1
+                continue
+            codes.append(code)
+    if skipped:
+        print("skip %d component codes outside of the cns vocabulary" % skipped)
+    return codes
+
+
+def build_cns_memory_table(model, save_dir, component_path="CNS_component.txt", batch_size=256,
+                           dtype=np.float32):
+    """
+    Run the cns encoder of a restored, deterministic model over every
+    component code and store the memories as a dense [codes, font_len,
+    cns_embedding_size] table next to an index of code -> row. float32
+    gives the computed memory back exactly, float16 halves the table but
+    is off by up to about 1e-3 and the generated images by about 1e-4
+    """
+    import tensorflow as tf
+
+    if not model.deterministic:
+        raise Exception("a memory table needs a deterministic model, the cns encoder drops out otherwise")
+    codes = component_codes(component_path, model.cns_vocab_size, model.font_len)
+    cns_code = tf.compat.v1.placeholder(tf.int64, shape=[None, model.font_len], name="table_cns_code")
+    seq_len = tf.compat.v1.placeholder(tf.int64, shape=None, name="table_seq_len")
+    memory = model.cns_encoder(cns_code, seq_len, reuse=True, training=False)
+
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    table_path = os.path.join(save_dir, TABLE_NAME)
+    table = np.lib.format.open_memmap(table_path, mode="w+", dtype=dtype,
+                                      shape=(len(codes), model.font_len, model.cns_embedding_size))
+    start_time = time.time()
+    for i in range(0, len(codes), batch_size):
+        batch = [list(map(int, code.split(","))) for code in codes[i:i + batch_size]]
+        lengths = [len(num) for num in batch]
+        padded = [num + [0] * (model.font_len - len(num)) for num in batch]
+        table[i:i + len(batch)] = model.sess.run(memory, feed_dict={cns_code: padded, seq_len: lengths})
+        if (i // batch_size) % 20 == 0:
+            print("encoded %d/%d component codes, %.1f sec" % (i + len(batch), len(codes), time.time() - start_time))
+    table.flush()
+    del table
+
+    index = {
+        "font_len": model.font_len,
+        "cns_embedding_size": model.cns_embedding_size,
+        "dtype": np.dtype(dtype).name,
+        "codes": dict((code, row) for row, code in enumerate(codes)),
+    }
+    with open(os.path.join(save_dir, INDEX_NAME), "w") as f:
+        json.dump(index, f)
+    print("cns memory table of %d codes saved at %s" % (len(codes), table_path))
+    return table_path
+
+
+class CnsMemoryTable(object):
+    """
+    Read side of build_cns_memory_table, the table is memory mapped so only
+    the rows that are looked up get read
+    """
+
+    def __init__(self, table_dir):
+        with open(os.path.join(table_dir, INDEX_NAME)) as f:
+            index = json.load(f)
+        self.rows = index["codes"]
+        self.font_len = index["font_len"]
+        self.cns_embedding_size = index["cns_embedding_size"]
+        self.table = np.load(os.path.join(table_dir, TABLE_NAME), mmap_mode="r")
+
+    def __contains__(self, code):
+        return code in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def lookup(self, codes):
+        rows = [self.rows[code] for code in codes]
+        return self.table[rows].astype(np.float32)
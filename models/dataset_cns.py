@@ -6,7 +6,7 @@ import numpy as np
 import random
 import os
 from models.utils import pad_seq, bytes_to_file, \
-    read_split_image, shift_and_resize_image, normalize_image
+    read_split_image, shift_and_resize_image, normalize_image, downsample_image
 
 
 class PickledImageProvider(object):
@@ -31,7 +31,19 @@ class PickledImageProvider(object):
             return examples
 
 
-def get_batch_iter(examples, batch_size, augment):
+def handle_cns(cns_code):
+    cns_code_batch = []
+    seq_len = []
+    max_len = 28    # get max_len from check_cns_len.py
+    for cns in cns_code:
+        num = list(map(int, cns.split(',')))
+        seq_len.append(len(num))
+        num += [0] * (max_len-len(num))
+        cns_code_batch.append(num)
+    return cns_code_batch, seq_len
+
+
+def get_batch_iter(examples, batch_size, augment, image_size=None):
     # the transpose ops requires deterministic
     # batch size, thus comes the padding
     padded = pad_seq(examples, batch_size)
@@ -55,6 +67,10 @@ def get_batch_iter(examples, batch_size, augment):
                 shift_y = int(np.ceil(np.random.uniform(0.01, nh - h)))
                 img_A = shift_and_resize_image(img_A, shift_x, shift_y, nw, nh)
                 img_B = shift_and_resize_image(img_B, shift_x, shift_y, nw, nh)
+            if image_size and image_size != img_A.shape[0]:
+                # progressive training reads the full size data at lower resolution
+                img_A = downsample_image(img_A, image_size)
+                img_B = downsample_image(img_B, image_size)
             img_A = normalize_image(img_A)
             img_B = normalize_image(img_B)
             img_A = np.expand_dims(img_A,axis=2)
@@ -63,17 +79,6 @@ def get_batch_iter(examples, batch_size, augment):
         finally:
             img.close()
 
-    def handle_cns(cns_code):
-        cns_code_batch = []
-        seq_len = []
-        max_len = 28    # get max_len from check_cns_len.py
-        for cns in cns_code:
-            num = list(map(int, cns.split(',')))
-            seq_len.append(len(num))
-            num += [0] * (max_len-len(num))
-            cns_code_batch.append(num)
-        return cns_code_batch, seq_len
-
     def batch_iter():
         for i in range(0, len(padded), batch_size):
             batch = padded[i: i + batch_size]
@@ -87,8 +92,18 @@ def get_batch_iter(examples, batch_size, augment):
     return batch_iter()
 
 
+def shard_examples(examples, shard_index, num_shards):
+    """
+    Disjoint strided shard of the examples. Every shard is cut to the same
+    length, so synchronous replicas run the same number of batches per epoch
+    """
+    shard_len = len(examples) // num_shards
+    return examples[shard_index::num_shards][:shard_len]
+
+
 class TrainDataProvider(object):
-    def __init__(self, data_dir, train_name="cns_train.obj", val_name="cns_test.obj", filter_by=None):
+    def __init__(self, data_dir, train_name="cns_train.obj", val_name="cns_test.obj", filter_by=None,
+                 shard_index=0, num_shards=1):
         self.data_dir = data_dir
         self.filter_by = filter_by
         self.train_path = os.path.join(self.data_dir, train_name)
@@ -97,21 +112,24 @@ class TrainDataProvider(object):
         self.val = PickledImageProvider(self.val_path)
         if self.filter_by:
             print("filter by label ->", filter_by)
-            self.train.examples = filter(lambda e: e[1] in self.filter_by, self.train.examples)
-            self.val.examples = filter(lambda e: e[1] in self.filter_by, self.val.examples)
+            self.train.examples = list(filter(lambda e: e[1] in self.filter_by, self.train.examples))
+            self.val.examples = list(filter(lambda e: e[1] in self.filter_by, self.val.examples))
+        if num_shards > 1:
+            print("train shard -> %d/%d" % (shard_index, num_shards))
+            self.train.examples = shard_examples(list(self.train.examples), shard_index, num_shards)
         print("train examples -> %d, val examples -> %d" % (len(self.train.examples), len(self.val.examples)))
 
-    def get_train_iter(self, batch_size, shuffle=True):
+    def get_train_iter(self, batch_size, shuffle=True, image_size=None):
         training_examples = self.train.examples[:]
         if shuffle:
             np.random.shuffle(training_examples)
-        return get_batch_iter(training_examples, batch_size, augment=True)
+        return get_batch_iter(training_examples, batch_size, augment=True, image_size=image_size)
 
-    def get_val_iter(self, batch_size, shuffle=True):
+    def get_val_iter(self, batch_size, shuffle=True, image_size=None):
         val_examples = self.val.examples[:]
         if shuffle:
             np.random.shuffle(val_examples)
-        return get_batch_iter(val_examples, batch_size, augment=True)
+        return get_batch_iter(val_examples, batch_size, augment=True, image_size=image_size)
 
     def get_val_iter_bk(self, batch_size, shuffle=True):
         """
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import multiprocessing
+import socket
+import subprocess
+import sys
+import tensorflow as tf
+
+
+def parse_hosts(hosts):
+    return [h.strip() for h in hosts.split(",") if h.strip()] if hosts else []
+
+
+def cluster_spec(ps_hosts, worker_hosts):
+    return tf.train.ClusterSpec({"ps": parse_hosts(ps_hosts), "worker": parse_hosts(worker_hosts)})
+
+
+def replica_device(cluster, task_index):
+    """
+    Variables go to the ps tasks, compute stays on this worker
+    """
+    return tf.compat.v1.train.replica_device_setter(
+        worker_device="/job:worker/task:%d" % task_index, cluster=cluster)
+
+
+def free_ports(num):
+    # bind everything first, so the same port is never handed out twice
+    socks = list()
+    for _ in range(num):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind(("localhost", 0))
+        socks.append(s)
+    ports = [s.getsockname()[1] for s in socks]
+    for s in socks:
+        s.close()
+    return ports
+
+
+def launch_local_cluster(num_workers, argv, num_ps=1):
+    """
+    Run a ps task and num_workers worker tasks of the current script on
+    localhost, each with an even share of the cores. Returns the worst
+    worker exit code
+    """
+    ports = free_ports(num_ps + num_workers)
+    ps_hosts = ",".join("localhost:%d" % p for p in ports[:num_ps])
+    worker_hosts = ",".join("localhost:%d" % p for p in ports[num_ps:])
+    threads = max(1, multiprocessing.cpu_count() // num_workers)
+    # later flags win in argparse, so the original command line is kept as is
+    base = [sys.executable, sys.argv[0]] + list(argv) + [
+        "--local_workers", "0",
+        "--ps_hosts", ps_hosts,
+        "--worker_hosts", worker_hosts,
+    ]
+
+    print("local cluster: ps -> %s, worker -> %s" % (ps_hosts, worker_hosts))
+    ps_procs = [subprocess.Popen(base + ["--job_name", "ps", "--task_index", str(i)])
+                for i in range(num_ps)]
+    worker_procs = [subprocess.Popen(base + ["--job_name", "worker", "--task_index", str(i),
+                                             "--intra_op_threads", str(threads)])
+                    for i in range(num_workers)]
+    try:
+        codes = [p.wait() for p in worker_procs]
+    finally:
+        # ps tasks serve forever, stop them once the workers are done
+        for p in ps_procs + worker_procs:
+            if p.poll() is None:
+                p.terminate()
+    return max(codes)
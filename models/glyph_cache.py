@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import collections
+import glob
+import hashlib
+import os
+import shutil
+import threading
+import time
+import tensorflow as tf
+
+
+def checkpoint_digest(model_dir):
+    """
+    Digest of the latest checkpoint in model_dir, from the names, sizes and
+    modification times of its files, so a new or rewritten checkpoint gets
+    a new digest without hashing the weights
+    """
+    ckpt = tf.train.get_checkpoint_state(model_dir)
+    if not ckpt:
+        raise Exception("no checkpoint in %s" % model_dir)
+    digest = hashlib.sha1(ckpt.model_checkpoint_path.encode("utf-8"))
+    for path in sorted(glob.glob(ckpt.model_checkpoint_path + ".*")):
+        stat = os.stat(path)
+        digest.update(("%s:%d:%d" % (os.path.basename(path), stat.st_size, stat.st_mtime_ns)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def example_key(cns_code, img_bytes):
+    """
+    Cache key of a packed example that has no unicode character attached
+    """
+    return hashlib.sha1(cns_code.encode("utf-8") + img_bytes).hexdigest()[:16]
+
+
+class GlyphCache(object):
+    """
+    Generated images keyed by (character, style, checkpoint digest). An in
+    memory LRU of capacity entries in front of an optional directory that is
+    kept under max_disk_mb by dropping the least recently used files. The
+    digest of model_dir is checked at most every refresh_secs, a new one
+    drops both tiers
+    """
+
+    def __init__(self, model_dir, capacity=1024, cache_dir=None, max_disk_mb=0, refresh_secs=5.0):
+        self.model_dir = model_dir
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.refresh_secs = refresh_secs
+        self.lock = threading.Lock()
+        self.memory = collections.OrderedDict()
+        # path -> size in least recently used order
+        self.disk = collections.OrderedDict()
+        self.disk_bytes = 0
+        self.stats = collections.Counter()
+        self.digest = checkpoint_digest(model_dir)
+        self.checked = time.time()
+        if self.cache_dir:
+            self.scan_disk()
+
+    def digest_dir(self):
+        return os.path.join(self.cache_dir, self.digest)
+
+    def path(self, char, style):
+        # hex of the code points keeps file names of characters safe
+        name = char if char.isascii() and char.isalnum() else "".join("%04x" % ord(c) for c in char)
+        return os.path.join(self.digest_dir(), "style_%d" % style, name + ".png")
+
+    def scan_disk(self):
+        # entries of other checkpoints are stale
+        for name in os.listdir(self.cache_dir) if os.path.isdir(self.cache_dir) else []:
+            if name != self.digest:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+        files = glob.glob(os.path.join(self.digest_dir(), "style_*", "*.png"))
+        for path in sorted(files, key=os.path.getmtime):
+            size = os.path.getsize(path)
+            self.disk[path] = size
+            self.disk_bytes += size
+
+    def refresh(self):
+        """
+        Drop everything if the checkpoint changed, True if it did
+        """
+        if time.time() - self.checked < self.refresh_secs:
+            return False
+        digest = checkpoint_digest(self.model_dir)
+        with self.lock:
+            self.checked = time.time()
+            if digest == self.digest:
+                return False
+            print("checkpoint changed %s -> %s, drop cached glyphs" % (self.digest, digest))
+            self.stats["invalidations"] += 1
+            self.memory.clear()
+            self.disk.clear()
+            self.disk_bytes = 0
+            if self.cache_dir:
+                shutil.rmtree(self.digest_dir(), ignore_errors=True)
+            self.digest = digest
+            return True
+
+    def get(self, char, style):
+        key = (char, style)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self.memory[key]
+            path = self.path(char, style) if self.cache_dir else None
+            if path is None or path not in self.disk:
+                self.stats["misses"] += 1
+                return None
+            self.disk.move_to_end(path)
+            self.stats["disk_hits"] += 1
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            # evicted by another thread in between
+            return None
+        self.put_memory(key, data)
+        return data
+
+    def put(self, char, style, data, digest=None):
+        # digest of the checkpoint data came from, if it is not the current
+        # one any more the glyph is dropped
+        if digest is not None and digest != self.digest:
+            with self.lock:
+                self.stats["stale_puts"] += 1
+            return
+        self.put_memory((char, style), data)
+        if not self.cache_dir or not self.max_disk_bytes:
+            return
+        path = self.path(char, style)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write aside and rename, readers never see half a file
+        tmp_path = "%s.%d.tmp" % (path, threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.disk_bytes += len(data) - self.disk.pop(path, 0)
+            self.disk[path] = len(data)
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+                old_path, size = self.disk.popitem(last=False)
+                self.disk_bytes -= size
+                self.stats["disk_evictions"] += 1
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+
+    def put_memory(self, key, data):
+        if not self.capacity:
+            return
+        with self.lock:
+            self.memory[key] = data
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.capacity:
+                self.memory.popitem(last=False)
+
+    def metrics(self):
+        with self.lock:
+            return dict(self.stats, digest=self.digest, memory_entries=len(self.memory),
+                        disk_entries=len(self.disk), disk_mb=self.disk_bytes / (1024. * 1024.))
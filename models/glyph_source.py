@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import random
+from functools import lru_cache
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from models.utils import normalize_image, pad_seq
+
+CANVAS_SIZE = 256
+CHAR_SIZE = 256
+MAX_CNS_LEN = 28
+CNS_VOCAB_SIZE = 518
+
+
+def load_tab_file(path, key_column, value_column):
+    table = dict()
+    with open(path, "rb") as f:
+        for line in f:
+            split = line.decode().strip().split("\t")
+            if len(split) == 2:
+                table[split[key_column]] = split[value_column]
+    return table
+
+
+def code_in_vocab(code, vocab_size=CNS_VOCAB_SIZE, max_len=MAX_CNS_LEN):
+    """
+    True if the cns encoder can embed code: numeric component ids below
+    vocab_size, at most max_len of them. A few decompositions name
+    components outside the numbered set
+    """
+    ids = code.split(",")
+    return all(i.isdigit() for i in ids) and len(ids) <= max_len and max(map(int, ids)) < vocab_size
+
+
+class GlyphSource(object):
+    """
+    Source side of an example for any character: the glyph rendered with
+    the source font, same as preprocess/, and its CNS component code
+    """
+
+    def __init__(self, font_path, cns_char_path="cns_char.txt", component_path="CNS_component.txt",
+                 canvas_size=CANVAS_SIZE, char_size=CHAR_SIZE, cache_size=4096, vocab_size=CNS_VOCAB_SIZE):
+        self.font = ImageFont.truetype(font_path, char_size)
+        self.vocab_size = vocab_size
+        self.canvas_size = canvas_size
+        self.char_size = char_size
+        # unicode hex -> cns code, cns code -> components
+        self.cns_by_unicode = load_tab_file(cns_char_path, 1, 0)
+        self.components = load_tab_file(component_path, 0, 1)
+        # rendering dominates, characters repeat across requests and styles
+        self.example = lru_cache(maxsize=cache_size)(self.example)
+
+    def component_code(self, ch):
+        """
+        Comma separated component ids of ch, None if ch is not a CNS character
+        """
+        cns = self.cns_by_unicode.get(format(ord(ch), "04X"))
+        components = self.components.get(cns)
+        if components is None:
+            return None
+        # the first decomposition, same as preprocess/char_info.py
+        return components.split(";")[0]
+
+    def in_vocab(self, ch):
+        """
+        True if ch has a component code the cns encoder can embed
+        """
+        code = self.component_code(ch)
+        return code is not None and code_in_vocab(code, self.vocab_size)
+
+    def charset(self):
+        """
+        Every character of the CNS index whose components the cns encoder
+        can embed, by code point
+        """
+        chars = [chr(int(code, 16)) for code, cns in self.cns_by_unicode.items() if cns in self.components]
+        known = [ch for ch in chars if self.in_vocab(ch)]
+        if len(known) < len(chars):
+            print("skip %d characters with components outside of the cns vocabulary" % (len(chars) - len(known)))
+        return sorted(known)
+
+    def render(self, ch):
+        """
+        Glyph of ch scaled to char_size and centered on a white canvas
+        """
+        left, top, right, bottom = self.font.getbbox(ch)
+        width, height = max(right, 1), max(bottom, 1)
+        img = Image.new("L", (width, height), 255)
+        ImageDraw.Draw(img).text((0, 0), ch, fill=0, font=self.font)
+
+        factor = width * 1.0 / self.char_size
+        max_height = self.canvas_size * 2
+        if height / factor > max_height:  # too long
+            img = img.crop((0, 0, width, int(max_height * factor)))
+        if height / factor > self.char_size + 5:
+            factor = height * 1.0 / self.char_size
+        img = img.resize((max(int(width / factor), 1), max(int(height / factor), 1)), resample=Image.LANCZOS)
+
+        canvas = Image.new("L", (self.canvas_size, self.canvas_size), 255)
+        canvas.paste(img, ((self.canvas_size - img.size[0]) // 2, (self.canvas_size - img.size[1]) // 2))
+        return np.asarray(canvas)
+
+    def example(self, ch):
+        """
+        (cns_code, seq_len, image) of ch laid out like get_batch_iter does,
+        the source glyph fills both the target and the source channel.
+        Cached, do not modify the returned image
+        """
+        code = self.component_code(ch)
+        if code is None:
+            raise Exception("no CNS components for %s" % ch)
+        if not code_in_vocab(code, self.vocab_size):
+            raise Exception("components %s of %s are outside of the cns vocabulary" % (code, ch))
+        num = list(map(int, code.split(",")))
+        seq_len = len(num)
+        num += [0] * (MAX_CNS_LEN - seq_len)
+        img = normalize_image(self.render(ch).astype(np.float32))
+        return num, seq_len, np.stack([img, img], axis=2)
+
+    def batch_iter(self, chars, batch_size, embedding_ids):
+        """
+        Stream chars in batches shaped like get_batch_iter, with the chars of
+        every batch up front. Characters without components, or with
+        components outside of the cns vocabulary, are left out
+        """
+        known = [ch for ch in chars if self.in_vocab(ch)]
+        if len(known) < len(chars):
+            skipped = "".join(ch for ch in chars if not self.in_vocab(ch))
+            print("no CNS components in the vocabulary, skip: %s" % skipped)
+        if not known:
+            return
+        padded = pad_seq(known, batch_size)
+        for i in range(0, len(padded), batch_size):
+            batch = padded[i:i + batch_size]
+            cns_code, seq_len, images = zip(*[self.example(ch) for ch in batch])
+            labels = [random.choice(embedding_ids) for _ in batch]
+            yield batch, list(cns_code), list(seq_len), labels, np.array(images, dtype=np.float32)
+
+
+def read_chars(chars):
+    """
+    Characters of a text file, or of the string itself if there is no such
+    file. Whitespace and repeats are dropped, the order is kept
+    """
+    if os.path.isfile(chars):
+        with open(chars, encoding="utf-8") as f:
+            chars = f.read()
+    seen = set()
+    unique = list()
+    for ch in chars:
+        if not ch.isspace() and ch not in seen:
+            seen.add(ch)
+            unique.append(ch)
+    return unique
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from models.utils import scale_back
+
+# file extension of every output format, bits is a 1 bit PNG
+EXTENSIONS = {"jpg": ".jpg", "png": ".png", "bits": ".png"}
+
+
+def glyph_name(cns_code, seq_len, index):
+    """
+    File name of a packed example, its component code as in the .obj and
+    its index there, distinct characters can share a decomposition
+    """
+    return "%s_%d" % (",".join(str(i) for i in cns_code[:seq_len]), index)
+
+
+def char_name(ch):
+    return "%04X" % ord(ch)
+
+
+def to_uint8(image):
+    """
+    Generator output in (-1, 1) to a 2d gray scale image
+    """
+    return (scale_back(np.clip(image, -1., 1.)) * 255).astype(np.uint8).squeeze(axis=-1)
+
+
+class GlyphWriter(object):
+    """
+    Write generated glyphs on a thread pool, one file per character and
+    style at save_dir/style_<id>/inferred_<name>.<ext>, the layout
+    calligraphy_evaluate_metric.py reads. Encoding and disk io of one batch
+    overlap with the generator run of the next, at most max_pending batches
+    are queued before write_batch blocks
+    """
+
+    def __init__(self, save_dir, image_format="jpg", num_workers=4, max_pending=8, threshold=0.5):
+        if image_format not in EXTENSIONS:
+            raise Exception("unknown output format %s, use one of %s" % (image_format, sorted(EXTENSIONS)))
+        self.save_dir = save_dir
+        self.image_format = image_format
+        self.threshold = int(threshold * 255)
+        self.pool = ThreadPoolExecutor(max_workers=num_workers)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.futures = list()
+        self.created = set()
+        self.count = 0
+
+    def path(self, name, style):
+        return os.path.join(self.save_dir, "style_%d" % style,
+                            "inferred_%s%s" % (name, EXTENSIONS[self.image_format]))
+
+    def write_image(self, path, image):
+        img = to_uint8(image)
+        if self.image_format == "bits":
+            Image.fromarray(img > self.threshold).save(path, optimize=True)
+        else:
+            import imageio.v3 as iio
+
+            iio.imwrite(path, img)
+
+    def write_all(self, names, styles, images):
+        try:
+            for name, style, image in zip(names, styles, images):
+                self.write_image(self.path(name, style), image)
+        finally:
+            self.pending.release()
+
+    def write_batch(self, names, styles, images):
+        """
+        Queue a batch, only the first len(names) images are written so the
+        padding of the last batch can be left out
+        """
+        for style in set(styles):
+            if style not in self.created:
+                style_dir = os.path.dirname(self.path("", style))
+                if not os.path.exists(style_dir):
+                    os.makedirs(style_dir)
+                self.created.add(style)
+        self.pending.acquire()
+        self.futures.append(self.pool.submit(self.write_all, list(names), list(styles), images[:len(names)]))
+        self.count += len(names)
+        # surface failures early and keep the list short
+        pending = list()
+        for f in self.futures:
+            if f.done():
+                f.result()
+            else:
+                pending.append(f)
+        self.futures = pending
+
+    def close(self):
+        for f in self.futures:
+            f.result()
+        self.pool.shutdown()
+        print("%d glyphs written to %s" % (self.count, self.save_dir))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def make_writer(save_dir, image_format="jpg", num_workers=4):
+    """
+    GlyphWriter for file formats, AtlasWriter for atlas and atlas_bits
+    """
+    from models.atlas import ATLAS_FORMATS, AtlasWriter
+
+    if image_format in ATLAS_FORMATS:
+        return AtlasWriter(save_dir, image_format)
+    return GlyphWriter(save_dir, image_format, num_workers=num_workers)
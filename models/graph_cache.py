@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import time
+
+# bump when the way graphs are cached changes
+GRAPH_CACHE_VERSION = 1
+# the code the graph is built from, an edit to any of them rebuilds it
+SOURCE_FILES = ("unet_onehot_cns_font_attention.py", "ops.py", "transformer_modules.py")
+HANDLES = ("input_handle", "loss_handle", "eval_handle")
+
+
+def default_graph_cache_dir():
+    return os.path.join(os.path.expanduser("~"), ".calligan", "graphs")
+
+
+def graph_cache_dir(args):
+    # None when --graph_cache=0
+    if not args.graph_cache:
+        return None
+    return args.graph_cache_dir or default_graph_cache_dir()
+
+
+def graph_fingerprint(model, **build_kwargs):
+    """
+    Digest of everything the graph of build_model depends on: the scalar
+    hyperparameters of the model, the build arguments, the tensorflow
+    version and the source of the model code
+    """
+    import tensorflow as tf
+
+    hparams = dict((k, v) for k, v in vars(model).items() if v is None or isinstance(v, (bool, int, float, str)))
+    hparams.pop("restored_checkpoint", None)
+    digest = hashlib.sha1(json.dumps({"version": GRAPH_CACHE_VERSION, "tf": tf.__version__, "hparams": hparams,
+                                      "build": build_kwargs}, sort_keys=True).encode("utf-8"))
+    model_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in SOURCE_FILES:
+        with open(os.path.join(model_dir, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:20]
+
+
+def handle_names(model):
+    return dict((handle, dict((field, None if t is None else t.name) for field, t in
+                              getattr(model, handle)._asdict().items())) for handle in HANDLES)
+
+
+def set_handles(model, names):
+    from models.unet_onehot_cns_font_attention import InputHandle, LossHandle, EvalHandle
+
+    graph = model.sess.graph
+    for handle, handle_type in zip(HANDLES, (InputHandle, LossHandle, EvalHandle)):
+        setattr(model, handle, handle_type(**dict(
+            (field, None if name is None else graph.get_tensor_by_name(name))
+            for field, name in names[handle].items())))
+    setattr(model, "cns_memory", model.input_handle.cns_memory)
+    setattr(model, "style_weights", model.input_handle.style_weights)
+
+
+def build_model_cached(model, cache_dir, **build_kwargs):
+    """
+    model.build_model(**build_kwargs), or the same graph imported from the
+    MetaGraph cached in cache_dir by a run with the same fingerprint, which
+    skips building it op by op in python. Only into an empty graph, the
+    names of the handles have to come out the same. The variables of an
+    imported graph are not in the variable store, fan-out graphs that
+    reuse them need the graph built. Returns "cached" or "built"
+    """
+    import tensorflow as tf
+
+    start_time = time.time()
+    graph = model.sess.graph
+    if not cache_dir or graph.get_operations():
+        model.build_model(**build_kwargs)
+        return "built"
+    fingerprint = graph_fingerprint(model, **build_kwargs)
+    meta_path = os.path.join(cache_dir, "graph_%s.meta" % fingerprint)
+    names_path = os.path.join(cache_dir, "graph_%s.json" % fingerprint)
+    if os.path.exists(meta_path) and os.path.exists(names_path):
+        with open(names_path) as f:
+            names = json.load(f)
+        with graph.as_default():
+            tf.compat.v1.train.import_meta_graph(meta_path, clear_devices=True)
+        set_handles(model, names)
+        print("graph %s loaded from cache in %.2f sec" % (fingerprint, time.time() - start_time))
+        return "cached"
+
+    model.build_model(**build_kwargs)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    # the handle names first, a meta file always has its names
+    with open(names_path + ".tmp", "w") as f:
+        json.dump(handle_names(model), f)
+    os.replace(names_path + ".tmp", names_path)
+    tf.compat.v1.train.export_meta_graph(filename=meta_path + ".tmp", graph=graph, clear_devices=True)
+    os.replace(meta_path + ".tmp", meta_path)
+    print("graph %s built and cached in %.2f sec" % (fingerprint, time.time() - start_time))
+    return "built"
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import json
+import time
+
+JOB_TYPES = ("infer", "fanout", "interpolate")
+
+
+def style_pairs(embedding_ids, uroboros=False):
+    """
+    (from, to) style pairs that interpolate along embedding_ids, back to
+    the first one with uroboros
+    """
+    if len(embedding_ids) < 2:
+        raise Exception("no need to interpolate yourself unless you are a narcissist")
+    chains = list(embedding_ids)
+    if uroboros:
+        chains.append(chains[0])
+    return [(chains[i], chains[i + 1]) for i in range(len(chains) - 1)]
+
+
+def load_jobs(path):
+    """
+    Job file of the form
+        {"model_dir": optional, "jobs": [{"type": "infer", "source_obj": .., "embedding_ids": [0], "save_dir": ..},
+                                         {"type": "infer", "chars": "永和", "embedding_ids": [1, 2], "save_dir": ..},
+                                         {"type": "fanout", "source_obj": .., "embedding_ids": [0, 1, 2], "save_dir": ..},
+                                         {"type": "interpolate", "source_obj": .., "embedding_ids": [0, 1],
+                                          "steps": 10, "uroboros": false, "save_dir": ..}]}
+    checked up front, so a typo in the last job does not cost the run
+    """
+    with open(path, encoding="utf-8") as f:
+        job_file = json.load(f)
+    jobs = job_file["jobs"]
+    for i, job in enumerate(jobs):
+        job.setdefault("name", "%s_%d" % (job.get("type"), i))
+        if job.get("type") not in JOB_TYPES:
+            raise Exception("job %s: type must be one of %s" % (job["name"], ", ".join(JOB_TYPES)))
+        for key in ("embedding_ids", "save_dir"):
+            if key not in job:
+                raise Exception("job %s: %s is missing" % (job["name"], key))
+        if job["type"] == "infer" and not (job.get("source_obj") or job.get("chars")):
+            raise Exception("job %s: needs source_obj or chars" % job["name"])
+        if job["type"] != "infer" and not job.get("source_obj"):
+            raise Exception("job %s: needs source_obj" % job["name"])
+        if job["type"] == "interpolate":
+            style_pairs(job["embedding_ids"], job.get("uroboros", False))
+    return job_file.get("model_dir"), jobs
+
+
+def run_job(model, job, model_dir, glyph_source=None, image_format="jpg", writer_threads=4, inst_norm=False):
+    embedding_ids = job["embedding_ids"]
+    image_format = job.get("output_format", image_format)
+    if job["type"] == "fanout":
+        model.build_fanout(len(embedding_ids), inst_norm=inst_norm)
+        model.infer_fanout(model_dir=model_dir, source_obj=job["source_obj"], embedding_ids=embedding_ids,
+                           save_dir=job["save_dir"], image_format=image_format, writer_threads=writer_threads)
+    elif job["type"] == "interpolate":
+        model.interpolate(model_dir=model_dir, source_obj=job["source_obj"],
+                          pairs=style_pairs(embedding_ids, job.get("uroboros", False)),
+                          save_dir=job["save_dir"], steps=job.get("steps", 10))
+    elif job.get("chars"):
+        from models.glyph_source import read_chars
+
+        model.infer_chars(read_chars(job["chars"]), glyph_source(), embedding_ids=embedding_ids,
+                          model_dir=model_dir, save_dir=job["save_dir"], image_format=image_format,
+                          writer_threads=writer_threads)
+    else:
+        model.infer(model_dir=model_dir, source_obj=job["source_obj"],
+                    embedding_ids=embedding_ids[0] if len(embedding_ids) == 1 else embedding_ids,
+                    save_dir=job["save_dir"], image_format=image_format, writer_threads=writer_threads)
+
+
+def run_jobs(model, jobs, model_dir, glyph_source=None, image_format="jpg", writer_threads=4, inst_norm=False):
+    """
+    Run jobs one after the other in the session of model. The graph of
+    every fan-out job is built before the generator is restored, which
+    happens once for all jobs. glyph_source is a callable, a font is only
+    loaded if a job asks for chars. Returns the seconds of each job
+    """
+    for job in jobs:
+        if job["type"] == "fanout":
+            model.build_fanout(len(job["embedding_ids"]), inst_norm=inst_norm)
+    start_time = time.time()
+    model.restore_generator(model_dir)
+    report = [{"name": "restore", "seconds": time.time() - start_time}]
+    for i, job in enumerate(jobs):
+        start_time = time.time()
+        run_job(model, job, model_dir, glyph_source, image_format, writer_threads, inst_norm)
+        report.append({"name": job["name"], "type": job["type"], "seconds": time.time() - start_time})
+        print("job %d/%d %s done in %.2f sec" % (i + 1, len(jobs), job["name"], report[-1]["seconds"]))
+    return report
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import numpy as np
+from PIL import Image
+
+METRICS = ("mse", "ssim", "psnr")
+# bump when a metric changes, cached values of other versions are dropped
+METRIC_VERSION = 1
+
+
+def read_gray(path):
+    """
+    Image file as a 2d float32 gray scale array in [0, 1]
+    """
+    with Image.open(path) as img:
+        return np.asarray(img.convert("L"), dtype=np.float32) / 255.
+
+
+def mse(x, y):
+    """
+    Mean squared error of every pair in two [n, h, w] stacks
+    """
+    diff = x.astype(np.float32) - y.astype(np.float32)
+    return np.mean(diff * diff, axis=(1, 2))
+
+
+def psnr(x, y, data_range=1.):
+    """
+    Peak signal to noise ratio in dB of every pair, inf for identical images
+    """
+    err = mse(x, y).astype(np.float64)
+    with np.errstate(divide="ignore"):
+        return 10. * np.log10((data_range ** 2) / err)
+
+
+def ssim(x, y, data_range=1., win_size=7, k1=0.01, k2=0.03):
+    """
+    Mean structural similarity of every pair in two [n, h, w] stacks, with
+    the uniform window and sample covariance skimage uses by default. The
+    five local moments of the whole stack are filtered in one call and, as
+    in skimage, the border where the window leaves the image is cropped
+    """
+    from scipy.ndimage import uniform_filter
+
+    x = x.astype(np.float32)
+    y = y.astype(np.float32)
+    np_win = win_size * win_size
+    cov_norm = np_win / (np_win - 1.)
+    pad = (win_size - 1) // 2
+    moments = uniform_filter(np.stack([x, y, x * x, y * y, x * y]), size=(1, 1, win_size, win_size))
+    ux, uy, uxx, uyy, uxy = moments[..., pad:-pad, pad:-pad]
+    vx = cov_norm * (uxx - ux * ux)
+    vy = cov_norm * (uyy - uy * uy)
+    vxy = cov_norm * (uxy - ux * uy)
+    c1 = (k1 * data_range) ** 2
+    c2 = (k2 * data_range) ** 2
+    s = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux * ux + uy * uy + c1) * (vx + vy + c2))
+    return s.mean(axis=(-2, -1), dtype=np.float64)
+
+
+def batch_metrics(x, y):
+    """
+    {metric: [n] array} of two [n, h, w] stacks in [0, 1]
+    """
+    return {"mse": mse(x, y), "ssim": ssim(x, y), "psnr": psnr(x, y)}
+
+
+def file_metrics(pairs):
+    """
+    Decode the (ground truth, prediction) path pairs and compute their
+    metrics as one batch, the unit of work of a parallel evaluation.
+    Pairs of different sizes are compared one at a time
+    """
+    gts = [read_gray(gt) for gt, _ in pairs]
+    preds = [read_gray(pred) for _, pred in pairs]
+    shapes = set(img.shape for img in gts + preds)
+    if len(shapes) == 1:
+        result = batch_metrics(np.stack(gts), np.stack(preds))
+    else:
+        per_pair = [batch_metrics(gt[None], pred[None]) for gt, pred in zip(gts, preds)]
+        result = dict((m, np.concatenate([r[m] for r in per_pair])) for m in METRICS)
+    return dict((m, result[m].tolist()) for m in METRICS)
+
+
+def summarize(values):
+    """
+    Report of {style: {metric: [values]}}: count and means per style, and
+    overall the mean of the style means, every style weighs the same
+    """
+    report = {"styles": dict(), "overall": dict()}
+    for style, style_values in sorted(values.items()):
+        entry = {"count": len(style_values[METRICS[0]])}
+        if entry["count"]:
+            entry.update((m, float(np.mean(style_values[m]))) for m in METRICS)
+        report["styles"][str(style)] = entry
+    scored = [e for e in report["styles"].values() if e["count"]]
+    report["overall"] = {"count": sum(e["count"] for e in scored), "styles": len(scored)}
+    if scored:
+        report["overall"].update((m, float(np.mean([e[m] for e in scored]))) for m in METRICS)
+    return report
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:20]
+
+
+class MetricCache(object):
+    """
+    Metrics of image pairs keyed by the content digests of both images, in
+    a json file, so re-evaluating only scores new or changed pairs
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pairs = dict()
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                cache = json.load(f)
+            if cache.get("version") == METRIC_VERSION and cache.get("metrics") == list(METRICS):
+                self.pairs = cache["pairs"]
+
+    @staticmethod
+    def key(gt_digest, pred_digest):
+        return "%s:%s" % (gt_digest, pred_digest)
+
+    def get(self, key):
+        values = self.pairs.get(key)
+        if values is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(zip(METRICS, values))
+
+    def put(self, key, values):
+        self.pairs[key] = [values[m] for m in METRICS]
+
+    def save(self):
+        dir_name = os.path.dirname(self.path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"version": METRIC_VERSION, "metrics": list(METRICS), "pairs": self.pairs}, f)
+        os.replace(self.path + ".tmp", self.path)
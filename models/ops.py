@@ -126,12 +126,23 @@ def conditional_instance_norm(
         mu, sigma = tf.nn.moments(x, [1, 2], keepdims=True)
         norm = (x - mu) / tf.sqrt(sigma + 1e-5)
 
-        batch_scale = tf.reshape(
-            tf.nn.embedding_lookup([scale], ids=ids), [batch_size, 1, 1, output_filters]
-        )
-        batch_shift = tf.reshape(
-            tf.nn.embedding_lookup([shift], ids=ids), [batch_size, 1, 1, output_filters]
-        )
+        if mixed:
+            # ids are [batch_size, labels_num] weights that mix the labels
+            batch_scale = tf.reshape(
+                tf.matmul(ids, scale), [batch_size, 1, 1, output_filters]
+            )
+            batch_shift = tf.reshape(
+                tf.matmul(ids, shift), [batch_size, 1, 1, output_filters]
+            )
+        else:
+            batch_scale = tf.reshape(
+                tf.nn.embedding_lookup([scale], ids=ids),
+                [batch_size, 1, 1, output_filters],
+            )
+            batch_shift = tf.reshape(
+                tf.nn.embedding_lookup([shift], ids=ids),
+                [batch_size, 1, 1, output_filters],
+            )
 
         z = norm * batch_scale + batch_shift
         return z
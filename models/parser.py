@@ -22,35 +22,144 @@ def arg_parse():
                         help="number for distinct embeddings")
     parser.add_argument('--embedding_dim', dest='embedding_dim', type=int, default=256, help="dimension for embedding")
     parser.add_argument('--epoch', dest='epoch', type=int, default=100, help='number of epoch')
-    parser.add_argument('--batch_size', dest='batch_size', type=int, default=16, help='number of examples in batch')
+    parser.add_argument('--batch_size', dest='batch_size', type=int, default=None,
+                        help='number of examples in batch, 16 if not given, or the tuned one for inference')
     parser.add_argument('--lr', dest='lr', type=float, default=0.001, help='initial learning rate for adam')
     parser.add_argument('--schedule', dest='schedule', type=int, default=10, help='number of epochs to half learning rate')
-    parser.add_argument('--resume', dest='resume', type=int, default=1, help='resume from previous training')
+    parser.add_argument('--resume', dest='resume', type=int, default=1, help='resume from previous training, or skip the shards '
+                        'bulk_infer.py already finished in save_dir')
     parser.add_argument('--freeze_encoder', dest='freeze_encoder', type=int, default=0,
                         help="freeze encoder weights during training")
     parser.add_argument('--fine_tune', dest='fine_tune', type=str, default=None,
                         help='specific labels id to be fine tuned')
+    parser.add_argument('--adapt_from', dest='adapt_from', type=str, default=None,
+                        help='checkpoint dir of a model with embedding_num - 1 styles, learn the new style id '
+                             'embedding_num - 1 from a few examples and only update its own parameters')
     parser.add_argument('--inst_norm', dest='inst_norm', type=int, default=0,
                         help='use conditional instance normalization in your model')
     parser.add_argument('--sample_steps', dest='sample_steps', type=int, default=10,
                         help='number of batches in between two samples are drawn from validation set')
+    parser.add_argument('--eval_steps', dest='eval_steps', type=int, default=0,
+                        help='number of batches in between two evaluations of mse, ssim and psnr per style '
+                             'on the whole validation set, 0 to turn off')
     parser.add_argument('--checkpoint_steps', dest='checkpoint_steps', type=int, default=500,
                         help='number of batches in between two checkpoints')
     parser.add_argument('--flip_labels', dest='flip_labels', type=int, default=None,
                         help='whether flip training data labels or not, in fine tuning')
 
+    parser.add_argument('--progressive_sizes', dest='progressive_sizes', type=str, default=None,
+                        help='train at growing image sizes, e.g. 64,128,256')
+    parser.add_argument('--progressive_epochs', dest='progressive_epochs', type=str, default=None,
+                        help='epochs per progressive stage, e.g. 5,5,90')
+    parser.add_argument('--target_l1', dest='target_l1', type=float, default=None,
+                        help='report the wall clock time until validation l1 loss reaches this value')
+    parser.add_argument('--intra_op_threads', dest='intra_op_threads', type=int, default=0,
+                        help='threads used inside a single op, 0 lets tensorflow decide')
+    parser.add_argument('--inter_op_threads', dest='inter_op_threads', type=int, default=0,
+                        help='ops run in parallel, 0 lets tensorflow decide')
+
+    parser.add_argument('--tuning_config', dest='tuning_config', type=str, default=None,
+                        help='tuned threads and batch size, defaults to ~/.calligan/tuning_<host>.json')
+
+    parser.add_argument('--xla', dest='xla', type=int, default=0,
+                        help='jit compile the generator and the training step with XLA')
+    parser.add_argument('--graph_cache', dest='graph_cache', type=int, default=1,
+                        help='reload the inference graph saved by an earlier run with the same hyperparameters '
+                             'instead of building it again')
+    parser.add_argument('--graph_cache_dir', dest='graph_cache_dir', type=str, default=None,
+                        help='where built inference graphs are kept, defaults to ~/.calligan/graphs')
+
+    # args for tune.py
+    parser.add_argument('--tune_batch_sizes', dest='tune_batch_sizes', type=str, default='1,2,4,8,16,32',
+                        help='batch sizes to try')
+    parser.add_argument('--tune_intra_op_threads', dest='tune_intra_op_threads', type=str, default=None,
+                        help='intra op thread counts to try, powers of two up to the core count if not given')
+    parser.add_argument('--tune_inter_op_threads', dest='tune_inter_op_threads', type=str, default='1,2',
+                        help='inter op thread counts to try')
+    parser.add_argument('--tune_steps', dest='tune_steps', type=int, default=3,
+                        help='timed steps per trial after the warm up step')
+    parser.add_argument('--xla_report', dest='xla_report', type=int, default=0,
+                        help='only compare XLA against the default runtime at the tuned or given setting')
+    parser.add_argument('--memory_budget_mb', dest='memory_budget_mb', type=int, default=0,
+                        help='peak RSS allowed for a trial, 80%% of physical memory if 0')
+
+    # args for data parallel training
+    parser.add_argument('--local_workers', dest='local_workers', type=int, default=0,
+                        help='spawn a localhost cluster with this many worker processes')
+    parser.add_argument('--ps_hosts', dest='ps_hosts', type=str, default='',
+                        help='comma separated host:port list of parameter servers')
+    parser.add_argument('--worker_hosts', dest='worker_hosts', type=str, default='',
+                        help='comma separated host:port list of workers')
+    parser.add_argument('--job_name', dest='job_name', type=str, default='worker', help='ps or worker')
+    parser.add_argument('--task_index', dest='task_index', type=int, default=0,
+                        help='index of this task in its job, worker 0 is the chief')
+
     # args for infer.py
     parser.add_argument('--model_dir', dest='model_dir',
                         help='directory that saves the model checkpoints')
     parser.add_argument('--source_obj', dest='source_obj', type=str, help='the source images for inference')
+    parser.add_argument('--chars', dest='chars', type=str, default=None,
+                        help='characters, or a utf-8 text file of them, to infer instead of --source_obj')
     parser.add_argument('--embedding_ids', default='embedding_ids', type=str, help='embeddings involved')
     parser.add_argument('--save_dir', default='save_dir', type=str, help='path to save inferred images')
+    parser.add_argument('--output_format', dest='output_format', type=str, default='jpg',
+                        help='jpg, png or bits (1 bit png) files at save_dir/style_<id>/inferred_<name>, '
+                             'or atlas (gray) and atlas_bits tiles packed in save_dir/atlas.bin')
+    parser.add_argument('--writer_threads', dest='writer_threads', type=int, default=4,
+                        help='threads that encode and write the generated glyphs')
+    parser.add_argument('--evaluate', dest='evaluate', type=int, default=0,
+                        help='score the generator against the targets of source_obj instead of saving images, '
+                             'the report goes to save_dir/metrics.json')
     parser.add_argument('--interpolate', dest='interpolate', type=int, default=0,
                         help='interpolate between different embedding vectors')
     parser.add_argument('--steps', dest='steps', type=int, default=10, help='interpolation steps in between vectors')
+    parser.add_argument('--deterministic', dest='deterministic', type=int, default=0,
+                        help='no dropout at inference, the same input always gives the same glyph')
+    parser.add_argument('--fanout', dest='fanout', type=int, default=0,
+                        help='render every source in all embedding_ids, encoding each character only once')
     parser.add_argument('--uroboros', dest='uroboros', type=int, default=0,
                         help='you have stepped into uncharted territory')
 
+    # args for serve.py
+    parser.add_argument('--src_font', dest='src_font', type=str, default='preprocess/SimSun.ttf',
+                        help='font the source glyphs are rendered with')
+    parser.add_argument('--host', dest='host', type=str, default='localhost', help='address the server listens on')
+    parser.add_argument('--port', dest='port', type=int, default=8000, help='port the server listens on')
+    parser.add_argument('--unix_socket', dest='unix_socket', type=str, default=None,
+                        help='listen on this unix socket instead of host and port')
+    parser.add_argument('--max_latency_ms', dest='max_latency_ms', type=float, default=10.,
+                        help='longest time a request waits for its batch to fill up')
+
+    parser.add_argument('--cns_memory_dir', dest='cns_memory_dir', type=str, default=None,
+                        help='look up the cns encoder output in the table exported by export.py, '
+                             'needs --deterministic=1')
+    parser.add_argument('--cache_size', dest='cache_size', type=int, default=1024,
+                        help='generated glyphs kept in memory, caching turns dropout off as --deterministic=1 does')
+    parser.add_argument('--cache_dir', dest='cache_dir', type=str, default=None,
+                        help='keep generated glyphs on disk as well, by checkpoint, style and character')
+    parser.add_argument('--cache_mb', dest='cache_mb', type=float, default=512,
+                        help='size limit of the disk cache, least recently used glyphs are dropped first')
+
+    # args for export.py
+    parser.add_argument('--export_dir', dest='export_dir', type=str, default=None,
+                        help='where export.py writes the generator and its cns memory table')
+    parser.add_argument('--component_path', dest='component_path', type=str, default='CNS_component.txt',
+                        help='component codes the cns memory table covers')
+    parser.add_argument('--memory_float16', dest='memory_float16', type=int, default=0,
+                        help='store the cns memory table in float16, half the size but no longer exact')
+
+    # args for run_jobs.py
+    parser.add_argument('--jobs', dest='jobs', type=str, default=None,
+                        help='json file of infer, fanout and interpolate jobs to run on one restored model')
+    parser.add_argument('--job_report', dest='job_report', type=str, default=None,
+                        help='write the seconds each job took to this json file')
+
+    # args for bulk_infer.py
+    parser.add_argument('--shard_size', dest='shard_size', type=int, default=2048,
+                        help='characters per shard, the unit of work and of resuming')
+    parser.add_argument('--bulk_workers', dest='bulk_workers', type=int, default=2,
+                        help='worker processes, each restores its own copy of the generator')
+
     # args for style classifier
     parser.add_argument('--style_classifier_dir', dest='style_classifier_dir', default='../experiment_style_classifier/checkpoint/experiment_0_batch_32',
                         help='directory that saves the style classifier checkpoint')
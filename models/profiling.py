@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import multiprocessing
+import queue as queue_lib
+import resource
+import sys
+import time
+import numpy as np
+
+
+def synthetic_batch(batch_size, image_size=256, embedding_num=7, font_len=28, cns_vocab_size=518):
+    """
+    Random batch shaped like the output of get_batch_iter
+    """
+    images = np.random.uniform(-1., 1., (batch_size, image_size, image_size, 2)).astype(np.float32)
+    labels = np.random.randint(0, embedding_num, batch_size).tolist()
+    seq_len = np.random.randint(1, font_len + 1, batch_size)
+    cns_code = np.zeros((batch_size, font_len), dtype=np.int64)
+    for i, n in enumerate(seq_len):
+        cns_code[i, :n] = np.random.randint(1, cns_vocab_size, n)
+    return cns_code.tolist(), seq_len.tolist(), labels, images
+
+
+def thread_grid(cores):
+    # powers of two up to the core count, and the core count itself
+    grid = [1]
+    while grid[-1] * 2 <= cores:
+        grid.append(grid[-1] * 2)
+    if grid[-1] != cores:
+        grid.append(cores)
+    return grid
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    if sys.platform == "darwin":
+        rss /= 1024.
+    return rss / 1024.
+
+
+def profile_model(batch_size, intra_op_threads=0, inter_op_threads=0, train=True, steps=5,
+                  inst_norm=False, xla=False, split_steps=False, **model_kwargs):
+    """
+    Build a fresh UNet, feed it synthetic batches and time the generator
+    forward pass and, with train=True, the full D + G + G training iteration,
+    with split_steps also a single D and a single G step on their own.
+    The first run of each op is reported apart as warm up, with xla=True it
+    includes the compilation. The single steps run on ops the full iteration
+    already warmed, so they have no warm up of their own
+    """
+    import tensorflow as tf
+    from models.unet_onehot_cns_font_attention import UNet
+
+    config = tf.compat.v1.ConfigProto()
+    config.intra_op_parallelism_threads = intra_op_threads
+    config.inter_op_parallelism_threads = inter_op_threads
+
+    with tf.Graph().as_default(), tf.compat.v1.Session(config=config) as sess:
+        model = UNet(batch_size=batch_size, xla=xla, **model_kwargs)
+        model.register_session(sess)
+        model.build_model(is_training=train, inst_norm=inst_norm)
+        input_handle, loss_handle, eval_handle = model.retrieve_handles()
+        if train:
+            train_handle = model.build_optimizers()
+        tf.compat.v1.global_variables_initializer().run()
+
+        cns_code, seq_len, labels, images = synthetic_batch(
+            batch_size, model.input_width, model.embedding_num, model.font_len, model.cns_vocab_size)
+        feed_dict = {
+            input_handle.real_data: images,
+            input_handle.embedding_ids: labels,
+            input_handle.no_target_data: images,
+            input_handle.no_target_ids: labels,
+            input_handle.cns_code: cns_code,
+            input_handle.seq_len: seq_len,
+        }
+
+        def timed(fetches):
+            start = time.time()
+            sess.run(fetches, feed_dict=feed_dict)
+            return time.time() - start
+
+        def measure(run_once, warmup=True):
+            first = run_once() if warmup else None
+            times = [run_once() for _ in range(steps)]
+            steady = float(np.median(times))
+            timing = {"step_sec": steady, "images_per_sec": batch_size / steady}
+            if warmup:
+                timing["warmup_sec"] = first
+            return timing
+
+        result = {
+            "batch_size": batch_size,
+            "intra_op_threads": intra_op_threads,
+            "inter_op_threads": inter_op_threads,
+            "infer": measure(lambda: timed(eval_handle.generator)),
+        }
+        if train:
+            feed_dict[train_handle.learning_rate] = 0.0002
+            result["train"] = measure(lambda: timed(train_handle.d_optimizer)
+                                      + timed(train_handle.g_optimizer)
+                                      + timed(train_handle.g_optimizer))
+            # after the full iteration, which would otherwise find the ops warmed up
+            if split_steps:
+                result["d_step"] = measure(lambda: timed(train_handle.d_optimizer), warmup=False)
+                result["g_step"] = measure(lambda: timed(train_handle.g_optimizer), warmup=False)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def _child(queue, fn, kwargs):
+    try:
+        queue.put(fn(**kwargs))
+    except Exception as e:
+        queue.put({"error": "%s: %s" % (type(e).__name__, e)})
+
+
+def run_isolated(fn, **kwargs):
+    """
+    Run fn(**kwargs) in a fresh process, so peak RSS and thread pools of one
+    trial never leak into the next one
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(queue, fn, kwargs))
+    proc.start()
+    try:
+        while True:
+            try:
+                return queue.get(timeout=1.0)
+            except queue_lib.Empty:
+                # killed before it could report, usually by the OOM killer
+                if not proc.is_alive():
+                    return {"error": "trial process exited with code %s" % proc.exitcode}
+    finally:
+        proc.join()
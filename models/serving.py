@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import base64
+import collections
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from models.glyph_source import code_in_vocab
+from models.utils import encode_png
+
+GlyphRequest = collections.namedtuple("GlyphRequest", ["char", "style", "future", "enqueued"])
+
+
+class LatencyStats(object):
+    def __init__(self, window=1000):
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+
+    def add(self, sec):
+        self.samples.append(sec)
+        self.count += 1
+
+    def summary(self):
+        if not self.samples:
+            return {"count": self.count}
+        ms = np.array(self.samples) * 1000.
+        return {"count": self.count, "mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+                "p90_ms": float(np.percentile(ms, 90)), "p99_ms": float(np.percentile(ms, 99))}
+
+
+class BatchingGenerator(object):
+    """
+    Serve a restored UNet to many threads. Requests are queued and a single
+    worker thread runs them in batches of up to the model's batch size,
+    waiting at most max_latency for a batch to fill up. Requests found in
+    the cache never reach the queue, when the cache sees a new checkpoint
+    reload() is run before the next batch. A batch only goes into the cache
+    if the checkpoint did not change while it ran. With a memory table the
+    cns encoder output is looked up instead of computed
+    """
+
+    def __init__(self, model, glyph_source, max_latency=0.01, cache=None, memory_table=None, reload=None):
+        self.model = model
+        self.glyph_source = glyph_source
+        self.cache = cache
+        self.memory_table = memory_table
+        self.reload = reload
+        self.stale = False
+        self.max_batch_size = model.batch_size
+        self.max_latency = max_latency
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.queue_latency = LatencyStats()
+        self.batch_latency = LatencyStats()
+        self.total_latency = LatencyStats()
+        self.batch_sizes = collections.Counter()
+        self.worker = threading.Thread(target=self.run, name="batcher")
+        self.worker.daemon = True
+
+    def start(self):
+        self.worker.start()
+        return self
+
+    def check(self, char, style):
+        """
+        ValueError for a request the model can not run, before it is queued,
+        a bad character would fail every request batched with it
+        """
+        if not 0 <= style < self.model.embedding_num:
+            raise ValueError("style must be in [0, %d)" % self.model.embedding_num)
+        if len(char) != 1:
+            raise ValueError("one character per glyph, got %r" % char)
+        code = self.glyph_source.component_code(char)
+        if code is None:
+            raise ValueError("no CNS components for %s" % char)
+        if not code_in_vocab(code, self.model.cns_vocab_size, self.model.font_len):
+            raise ValueError("components %s of %s are outside of the cns vocabulary" % (code, char))
+
+    def submit(self, char, style):
+        self.check(char, style)
+        future = Future()
+        if self.cache:
+            if self.cache.refresh():
+                self.stale = True
+            cached = self.cache.get(char, style)
+            if cached is not None:
+                future.set_result(cached)
+                return future
+        self.queue.put(GlyphRequest(char, style, future, time.time()))
+        return future
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = batch[0].enqueued + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            try:
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            start = time.time()
+            # before the reload, a checkpoint that comes in while it runs
+            # keeps the batch out of the cache
+            digest = self.cache.digest if self.cache else None
+            try:
+                if self.stale and self.reload:
+                    self.stale = False
+                    self.reload()
+                images = self.run_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            done = time.time()
+            with self.lock:
+                self.batch_sizes[len(batch)] += 1
+                self.batch_latency.add(done - start)
+                for request in batch:
+                    self.queue_latency.add(start - request.enqueued)
+                    self.total_latency.add(done - request.enqueued)
+            for request, image in zip(batch, images):
+                if self.cache:
+                    self.cache.put(request.char, request.style, image, digest=digest)
+                request.future.set_result(image)
+
+    def run_batch(self, batch):
+        cns_code, seq_len, images = zip(*[self.glyph_source.example(r.char) for r in batch])
+        labels = [r.style for r in batch]
+        # the graph has a fixed batch size, fill up with the last request
+        padding = self.max_batch_size - len(batch)
+        cns_code = list(cns_code) + [cns_code[-1]] * padding
+        seq_len = list(seq_len) + [seq_len[-1]] * padding
+        labels = labels + [labels[-1]] * padding
+        images = np.array(list(images) + [images[-1]] * padding, dtype=np.float32)
+        cns_memory = None
+        if self.memory_table is not None:
+            codes = [self.glyph_source.component_code(r.char) for r in batch]
+            if all(code in self.memory_table for code in codes):
+                cns_memory = self.memory_table.lookup(codes + [codes[-1]] * padding)
+        fake_images = self.model.generate(images, labels, cns_code, seq_len, cns_memory=cns_memory)
+        return [encode_png(img) for img in fake_images[:len(batch)]]
+
+    def generate(self, chars, style, timeout=None):
+        # all or nothing, no request is queued if one of them is bad
+        for ch in chars:
+            self.check(ch, style)
+        futures = [self.submit(ch, style) for ch in chars]
+        return [f.result(timeout=timeout) for f in futures]
+
+    def metrics(self):
+        with self.lock:
+            metrics = {
+                "queue_depth": self.queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_latency_ms": self.max_latency * 1000.,
+                "batch_sizes": dict((str(k), v) for k, v in sorted(self.batch_sizes.items())),
+                "queue_latency": self.queue_latency.summary(),
+                "batch_latency": self.batch_latency.summary(),
+                "total_latency": self.total_latency.summary(),
+            }
+        if self.cache:
+            metrics["cache"] = self.cache.metrics()
+        return metrics
+
+
+class GlyphRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /glyph?char=永&style=0           -> PNG
+    POST /generate {"chars": .., "style": ..} -> {"images": [{"char": .., "png": base64}]}
+    GET  /metrics                          -> queue depth and latencies as JSON
+    """
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, obj):
+        self.send_body(status, "application/json", json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            if url.path == "/metrics":
+                self.send_json(200, self.server.generator.metrics())
+            elif url.path == "/glyph":
+                char = query["char"][0]
+                if not char:
+                    raise ValueError("char is empty")
+                style = int(query.get("style", ["0"])[0])
+                png = self.server.generator.generate(char[:1], style)[0]
+                self.send_body(200, "image/png", png)
+            else:
+                self.send_json(404, {"error": "unknown path %s" % url.path})
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {"error": str(e)})
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/generate":
+            self.send_json(404, {"error": "unknown path %s" % url.path})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length).decode("utf-8"))
+            chars = body["chars"]
+            pngs = self.server.generator.generate(chars, int(body.get("style", 0)))
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+            return
+        images = [{"char": ch, "png": base64.b64encode(png).decode("ascii")} for ch, png in zip(chars, pngs)]
+        self.send_json(200, {"images": images})
+
+
+class UnixGlyphServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(generator, host="localhost", port=8000, unix_socket=None):
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixGlyphServer(unix_socket, GlyphRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), GlyphRequestHandler)
+    server.generator = generator
+    return server
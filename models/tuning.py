@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import json
+import os
+import socket
+
+DEFAULT_BATCH_SIZE = 16
+
+
+def default_tuning_path():
+    # one file per host, home directories are often shared between machines
+    return os.path.join(os.path.expanduser("~"), ".calligan", "tuning_%s.json" % socket.gethostname())
+
+
+def load_tuning(path=None):
+    path = path or default_tuning_path()
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_tuning(tuning, path=None):
+    path = path or default_tuning_path()
+    dir_name = os.path.dirname(path)
+    if dir_name and not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+    with open(path, "w") as f:
+        json.dump(tuning, f, indent=2)
+    print("tuning config saved at %s" % path)
+
+
+def apply_tuning(args, role):
+    """
+    Fill in thread counts and batch size that were not given on the command
+    line from the tuned config of this host. role is "train" or "infer".
+    Training only takes the tuned threads, its batch size changes the
+    checkpoint dir and the hyperparameters of the GAN, so it has to be
+    asked for with --batch_size
+    """
+    tuning = load_tuning(args.tuning_config)
+    best = tuning.get(role) if tuning else None
+    if best:
+        if not args.intra_op_threads:
+            args.intra_op_threads = best["intra_op_threads"]
+        if not args.inter_op_threads:
+            args.inter_op_threads = best["inter_op_threads"]
+        if args.batch_size is None and role != "train":
+            args.batch_size = best["batch_size"]
+            print("use tuned batch size %d" % args.batch_size)
+        elif args.batch_size is None and best["batch_size"] != DEFAULT_BATCH_SIZE:
+            print("tuned batch size %d is not used for training, pass --batch_size=%d to train with it"
+                  % (best["batch_size"], best["batch_size"]))
+        print("use tuned threads intra_op: %d, inter_op: %d" % (args.intra_op_threads, args.inter_op_threads))
+    if args.batch_size is None:
+        args.batch_size = DEFAULT_BATCH_SIZE
+    return args
+
+
+def session_config(args):
+    import tensorflow as tf
+
+    config = tf.compat.v1.ConfigProto()
+    config.gpu_options.allow_growth = True
+    config.intra_op_parallelism_threads = args.intra_op_threads
+    config.inter_op_parallelism_threads = args.inter_op_threads
+    return config
@@ -4,9 +4,10 @@ from __future__ import absolute_import
 
 import tensorflow as tf
 import numpy as np
-import imageio.v3 as iio
 import os
 import time
+import json
+import contextlib
 from collections import namedtuple
 from models.ops import (
     conv2d,
@@ -18,8 +19,23 @@ from models.ops import (
     conditional_instance_norm,
     conv2d_sn,
 )
-from models.dataset_cns import TrainDataProvider, InjectDataProvider
-from models.utils import scale_back, merge, save_concat_images
+from models.dataset_cns import (
+    TrainDataProvider,
+    InjectDataProvider,
+    PickledImageProvider,
+    get_batch_iter,
+)
+from models.utils import (
+    scale_back,
+    merge,
+    save_concat_images,
+    pad_seq,
+    encode_png,
+    decode_png,
+)
+from models.glyph_cache import example_key
+from models.glyph_writer import make_writer, glyph_name, char_name
+from models.metrics import METRICS, batch_metrics, summarize
 from models.transformer_modules import (
     get_token_embeddings,
     ff,
@@ -50,9 +66,15 @@ InputHandle = namedtuple(
         "no_target_ids",
         "cns_code",
         "seq_len",
+        "cns_memory",
+        "style_weights",
     ],
 )
 EvalHandle = namedtuple("EvalHandle", ["encoder", "generator", "target", "source"])
+FanoutHandle = namedtuple(
+    "FanoutHandle", ["source", "cns_code", "seq_len", "style_ids", "generator"]
+)
+TrainHandle = namedtuple("TrainHandle", ["learning_rate", "d_optimizer", "g_optimizer"])
 
 """
 onehot + cns 
@@ -81,6 +103,8 @@ class UNet(object):
         cns_embedding_size=128,
         lstm_num_units=128,
         z_dim=32,
+        xla=False,
+        deterministic=False,
     ):
         self.experiment_dir = experiment_dir
         self.experiment_id = experiment_id
@@ -104,6 +128,16 @@ class UNet(object):
         self.d_ff = 512
         self.font_len = 28
         self.cns_encoder_dir = cns_encoder_dir
+        self.xla = xla
+        # inference without dropout, same output for the same input
+        self.deterministic = deterministic
+        # fan-out graphs by number of styles
+        self.fanout_handles = dict()
+        # inference restores the generator once per checkpoint
+        self.generator_saver = None
+        self.restored_checkpoint = None
+        # when the first glyphs came out, for the time to first inference
+        self.first_output_time = None
         # init all the directories
         self.sess = None
         # experiment_dir is needed for training
@@ -123,6 +157,13 @@ class UNet(object):
                 os.makedirs(self.sample_dir)
                 print("create sample directory")
 
+    def jit_scope(self):
+        # let XLA fuse the many small elementwise ops (lrelu, bias add and
+        # reshape, instance norm moments, attention split/concat)
+        if self.xla:
+            return tf.xla.experimental.jit_scope()
+        return contextlib.nullcontext()
+
     def encoder(self, images, is_training, reuse=False):
         with tf.compat.v1.variable_scope("generator"):
             if reuse:
@@ -152,22 +193,27 @@ class UNet(object):
             return e8, encode_layers
 
     def decoder(
-        self, encoded, encoding_layers, ids, inst_norm, is_training, reuse=False
+        self,
+        encoded,
+        encoding_layers,
+        style_weights,
+        inst_norm,
+        is_training,
+        reuse=False,
+        batch_size=None,
     ):
+        # the fan-out graph decodes more images than it encodes
+        batch_size = batch_size or self.batch_size
         with tf.compat.v1.variable_scope("generator"):
             if reuse:
                 tf.compat.v1.get_variable_scope().reuse_variables()
 
             s = self.output_width
-            s2, s4, s8, s16, s32, s64, s128 = (
-                int(s / 2),
-                int(s / 4),
-                int(s / 8),
-                int(s / 16),
-                int(s / 32),
-                int(s / 64),
-                int(s / 128),
-            )
+            # match the skip connections, below 256 px the innermost encoder
+            # layers bottom out at 1x1 instead of halving again
+            s2, s4, s8, s16, s32, s64, s128 = [
+                encoding_layers["e%d" % i].get_shape().as_list()[1] for i in range(1, 8)
+            ]
 
             def decode_layer(
                 x,
@@ -180,7 +226,7 @@ class UNet(object):
             ):
                 dec = deconv2d(
                     tf.nn.relu(x),
-                    [self.batch_size, output_width, output_width, output_filters],
+                    [batch_size, output_width, output_width, output_filters],
                     scope="g_d%d_deconv" % layer,
                 )
                 if layer != 8:
@@ -192,13 +238,14 @@ class UNet(object):
                     if inst_norm:
                         dec = conditional_instance_norm(
                             dec,
-                            ids,
+                            style_weights,
                             self.embedding_num,
+                            mixed=True,
                             scope="g_d%d_inst_norm" % layer,
                         )
                     else:
                         dec = batch_norm(dec, is_training, scope="g_d%d_bn" % layer)
-                if dropout:
+                if dropout and (is_training or not self.deterministic):
                     dec = tf.nn.dropout(dec, 0.5)
                 if do_concat:
                     dec = tf.concat([dec, enc_layer], 3)
@@ -251,7 +298,7 @@ class UNet(object):
             output = tf.nn.tanh(d8)  # scale to (-1, 1)
             return output
 
-    def cns_encoder(self, cns_code, seq_len, reuse=False):
+    def cns_encoder(self, cns_code, seq_len, reuse=False, training=True):
         with tf.compat.v1.variable_scope("cns_encoder"):
             if reuse:
                 tf.compat.v1.get_variable_scope().reuse_variables()
@@ -268,7 +315,7 @@ class UNet(object):
             enc *= self.cns_embedding_size**0.5  # scale
 
             enc += positional_encoding(enc, self.font_len)
-            enc = tf.compat.v1.layers.dropout(enc, 0.3, training=True)
+            enc = tf.compat.v1.layers.dropout(enc, 0.3, training=training)
 
             # Blocks
             for i in range(self.num_blocks):
@@ -283,7 +330,7 @@ class UNet(object):
                         key_masks=src_masks,
                         num_heads=self.num_heads,
                         dropout_rate=0.3,
-                        training=True,
+                        training=training,
                         causality=False,
                     )
                     # feed forward
@@ -304,13 +351,33 @@ class UNet(object):
         e8, enc_layers = self.encoder(images, is_training=is_training, reuse=reuse)
         # local_embeddings = tf.nn.embedding_lookup(embeddings, ids=embedding_ids)
         # local_embeddings = tf.reshape(local_embeddings, [self.batch_size, 1, 1, self.embedding_dim])
-        one_hot = tf.reshape(
+        style_weights = tf.reshape(
             tf.one_hot(indices=embedding_ids, depth=self.embedding_num),
-            shape=[self.batch_size, 1, 1, self.embedding_num],
+            shape=[self.batch_size, self.embedding_num],
+        )
+        if not reuse:
+            # any mix of the styles can be fed here, e.g. to interpolate
+            style_weights = tf.compat.v1.placeholder_with_default(
+                style_weights, style_weights.get_shape(), name="style_weights"
+            )
+            setattr(self, "style_weights", style_weights)
+        one_hot = tf.reshape(
+            style_weights, shape=[self.batch_size, 1, 1, self.embedding_num]
         )
 
         # encoder_state = self.cns_encoder(cns_code, seq_len, reuse=reuse)
-        z = self.cns_encoder(cns_code, seq_len, reuse=reuse)
+        z = self.cns_encoder(
+            cns_code,
+            seq_len,
+            reuse=reuse,
+            training=is_training or not self.deterministic,
+        )
+        if not reuse:
+            # a precomputed memory table can be fed here instead of cns_code
+            z = tf.compat.v1.placeholder_with_default(
+                z, z.get_shape(), name="cns_memory"
+            )
+            setattr(self, "cns_memory", z)
         encoder_state = tf.reshape(
             z, [self.batch_size, 1, 1, self.cns_embedding_size * self.font_len]
         )
@@ -318,7 +385,7 @@ class UNet(object):
         output = self.decoder(
             embedded,
             enc_layers,
-            embedding_ids,
+            style_weights,
             inst_norm,
             is_training=is_training,
             reuse=reuse,
@@ -401,159 +468,171 @@ class UNet(object):
             :, :, :, self.input_filters : self.input_filters + self.output_filters
         ]
 
-        # embedding = init_embedding(self.embedding_num, self.embedding_dim)
-        fake_B, encoded_real_A = self.generator(
-            real_A,
-            embedding_ids,
-            cns_code,
-            seq_len,
-            is_training=is_training,
-            inst_norm=inst_norm,
-        )
-        real_AB = tf.concat([real_A, real_B], 3)
-        fake_AB = tf.concat([real_A, fake_B], 3)
-
-        # Note it is not possible to set reuse flag back to False
-        # initialize all variables before setting reuse to True
-        real_D, real_D_logits, real_category_logits = self.discriminator(
-            real_AB, is_training=is_training, reuse=False
-        )
-        fake_D, fake_D_logits, fake_category_logits = self.discriminator(
-            fake_AB, is_training=is_training, reuse=True
-        )
-
-        # encoding constant loss
-        # this loss assume that generated imaged and real image
-        # should reside in the same space and close to each other
-        encoded_fake_B = self.encoder(fake_B, is_training, reuse=True)[0]
-        const_loss = (
-            tf.reduce_mean(tf.square(encoded_real_A - encoded_fake_B))
-        ) * self.Lconst_penalty
-
-        # category loss
-        true_labels = tf.reshape(
-            tf.one_hot(indices=embedding_ids, depth=self.embedding_num),
-            shape=[self.batch_size, self.embedding_num],
-        )
-
-        real_category_loss = tf.reduce_mean(
-            tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=real_category_logits, labels=true_labels
-            )
-        )
-        fake_category_loss = tf.reduce_mean(
-            tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=fake_category_logits, labels=true_labels
+        # losses and their gradients form the training step that is compiled
+        # with XLA when enabled
+        with self.jit_scope():
+            # embedding = init_embedding(self.embedding_num, self.embedding_dim)
+            fake_B, encoded_real_A = self.generator(
+                real_A,
+                embedding_ids,
+                cns_code,
+                seq_len,
+                is_training=is_training,
+                inst_norm=inst_norm,
             )
-        )
-        category_loss = self.Lcategory_penalty * (
-            real_category_loss + fake_category_loss
-        )
+            real_AB = tf.concat([real_A, real_B], 3)
+            fake_AB = tf.concat([real_A, fake_B], 3)
 
-        # binary real/fake loss
-        d_loss_real = tf.reduce_mean(
-            tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=real_D_logits, labels=tf.ones_like(real_D)
+            # Note it is not possible to set reuse flag back to False
+            # initialize all variables before setting reuse to True
+            real_D, real_D_logits, real_category_logits = self.discriminator(
+                real_AB, is_training=is_training, reuse=False
             )
-        )
-        d_loss_fake = tf.reduce_mean(
-            tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=fake_D_logits, labels=tf.zeros_like(fake_D)
+            fake_D, fake_D_logits, fake_category_logits = self.discriminator(
+                fake_AB, is_training=is_training, reuse=True
             )
-        )
-        # L1 loss between real and generated images
-        l1_loss = self.L1_penalty * tf.reduce_mean(tf.abs(fake_B - real_B))
-        # total variation loss
-        width = self.output_width
-        tv_loss = (
-            tf.nn.l2_loss(fake_B[:, 1:, :, :] - fake_B[:, : width - 1, :, :]) / width
-            + tf.nn.l2_loss(fake_B[:, :, 1:, :] - fake_B[:, :, : width - 1, :]) / width
-        ) * self.Ltv_penalty
-
-        # maximize the chance generator fool the discriminator
-        cheat_loss = tf.reduce_mean(
-            tf.nn.sigmoid_cross_entropy_with_logits(
-                logits=fake_D_logits, labels=tf.ones_like(fake_D)
-            )
-        )
-        d_loss = d_loss_real + d_loss_fake + category_loss / 2.0
-        g_loss = (
-            cheat_loss
-            + l1_loss
-            + self.Lcategory_penalty * fake_category_loss
-            + const_loss
-            + tv_loss
-        )
 
-        if no_target_source:
-            # no_target source are examples that don't have the corresponding target images
-            # however, except L1 loss, we can compute category loss, binary loss and constant losses with those examples
-            # it is useful when discriminator get saturated and d_loss drops to near zero
-            # those data could be used as additional source of losses to break the saturation
-            no_target_A = no_target_data[
-                :, :, :, self.input_filters : self.input_filters + self.output_filters
-            ]
-            no_target_B, encoded_no_target_A = self.generator(
-                no_target_A,
-                no_target_ids,
-                cns_code=cns_code,
-                seq_len=seq_len,
-                is_training=is_training,
-                inst_norm=inst_norm,
-                reuse=True,
-            )
-            no_target_labels = tf.reshape(
-                tf.one_hot(indices=no_target_ids, depth=self.embedding_num),
+            # encoding constant loss
+            # this loss assume that generated imaged and real image
+            # should reside in the same space and close to each other
+            encoded_fake_B = self.encoder(fake_B, is_training, reuse=True)[0]
+            const_loss = (
+                tf.reduce_mean(tf.square(encoded_real_A - encoded_fake_B))
+            ) * self.Lconst_penalty
+
+            # category loss
+            true_labels = tf.reshape(
+                tf.one_hot(indices=embedding_ids, depth=self.embedding_num),
                 shape=[self.batch_size, self.embedding_num],
             )
-            no_target_AB = tf.concat([no_target_A, no_target_B], 3)
-            (
-                no_target_D,
-                no_target_D_logits,
-                no_target_category_logits,
-            ) = self.discriminator(no_target_AB, is_training=is_training, reuse=True)
-            encoded_no_target_B = self.encoder(no_target_B, is_training, reuse=True)[0]
-
-            no_target_const_loss = (
-                tf.reduce_mean(tf.square(encoded_no_target_A - encoded_no_target_B))
-                * self.Lconst_penalty
+
+            real_category_loss = tf.reduce_mean(
+                tf.nn.sigmoid_cross_entropy_with_logits(
+                    logits=real_category_logits, labels=true_labels
+                )
             )
-            no_target_category_loss = (
-                tf.reduce_mean(
-                    tf.nn.sigmoid_cross_entropy_with_logits(
-                        logits=no_target_category_logits, labels=no_target_labels
-                    )
+            fake_category_loss = tf.reduce_mean(
+                tf.nn.sigmoid_cross_entropy_with_logits(
+                    logits=fake_category_logits, labels=true_labels
                 )
-                * self.Lcategory_penalty
+            )
+            category_loss = self.Lcategory_penalty * (
+                real_category_loss + fake_category_loss
             )
 
-            d_loss_no_target = tf.reduce_mean(
+            # binary real/fake loss
+            d_loss_real = tf.reduce_mean(
                 tf.nn.sigmoid_cross_entropy_with_logits(
-                    logits=no_target_D_logits, labels=tf.zeros_like(no_target_D)
+                    logits=real_D_logits, labels=tf.ones_like(real_D)
                 )
             )
-            cheat_loss += tf.reduce_mean(
+            d_loss_fake = tf.reduce_mean(
                 tf.nn.sigmoid_cross_entropy_with_logits(
-                    logits=no_target_D_logits, labels=tf.ones_like(no_target_D)
+                    logits=fake_D_logits, labels=tf.zeros_like(fake_D)
                 )
             )
-
-            d_loss = (
-                d_loss_real
-                + d_loss_fake
-                + d_loss_no_target
-                + (category_loss + no_target_category_loss) / 3.0
+            # L1 loss between real and generated images
+            l1_loss = self.L1_penalty * tf.reduce_mean(tf.abs(fake_B - real_B))
+            # total variation loss
+            width = self.output_width
+            tv_loss = (
+                tf.nn.l2_loss(fake_B[:, 1:, :, :] - fake_B[:, : width - 1, :, :])
+                / width
+                + tf.nn.l2_loss(fake_B[:, :, 1:, :] - fake_B[:, :, : width - 1, :])
+                / width
+            ) * self.Ltv_penalty
+
+            # maximize the chance generator fool the discriminator
+            cheat_loss = tf.reduce_mean(
+                tf.nn.sigmoid_cross_entropy_with_logits(
+                    logits=fake_D_logits, labels=tf.ones_like(fake_D)
+                )
             )
+            d_loss = d_loss_real + d_loss_fake + category_loss / 2.0
             g_loss = (
-                cheat_loss / 2.0
+                cheat_loss
                 + l1_loss
-                + self.Lcategory_penalty
-                * (fake_category_loss + no_target_category_loss)
-                / 2.0
-                + (const_loss + no_target_const_loss) / 2.0
+                + self.Lcategory_penalty * fake_category_loss
+                + const_loss
                 + tv_loss
             )
 
+            if no_target_source:
+                # no_target source are examples that don't have the corresponding target images
+                # however, except L1 loss, we can compute category loss, binary loss and constant losses with those examples
+                # it is useful when discriminator get saturated and d_loss drops to near zero
+                # those data could be used as additional source of losses to break the saturation
+                no_target_A = no_target_data[
+                    :,
+                    :,
+                    :,
+                    self.input_filters : self.input_filters + self.output_filters,
+                ]
+                no_target_B, encoded_no_target_A = self.generator(
+                    no_target_A,
+                    no_target_ids,
+                    cns_code=cns_code,
+                    seq_len=seq_len,
+                    is_training=is_training,
+                    inst_norm=inst_norm,
+                    reuse=True,
+                )
+                no_target_labels = tf.reshape(
+                    tf.one_hot(indices=no_target_ids, depth=self.embedding_num),
+                    shape=[self.batch_size, self.embedding_num],
+                )
+                no_target_AB = tf.concat([no_target_A, no_target_B], 3)
+                (
+                    no_target_D,
+                    no_target_D_logits,
+                    no_target_category_logits,
+                ) = self.discriminator(
+                    no_target_AB, is_training=is_training, reuse=True
+                )
+                encoded_no_target_B = self.encoder(
+                    no_target_B, is_training, reuse=True
+                )[0]
+
+                no_target_const_loss = (
+                    tf.reduce_mean(tf.square(encoded_no_target_A - encoded_no_target_B))
+                    * self.Lconst_penalty
+                )
+                no_target_category_loss = (
+                    tf.reduce_mean(
+                        tf.nn.sigmoid_cross_entropy_with_logits(
+                            logits=no_target_category_logits, labels=no_target_labels
+                        )
+                    )
+                    * self.Lcategory_penalty
+                )
+
+                d_loss_no_target = tf.reduce_mean(
+                    tf.nn.sigmoid_cross_entropy_with_logits(
+                        logits=no_target_D_logits, labels=tf.zeros_like(no_target_D)
+                    )
+                )
+                cheat_loss += tf.reduce_mean(
+                    tf.nn.sigmoid_cross_entropy_with_logits(
+                        logits=no_target_D_logits, labels=tf.ones_like(no_target_D)
+                    )
+                )
+
+                d_loss = (
+                    d_loss_real
+                    + d_loss_fake
+                    + d_loss_no_target
+                    + (category_loss + no_target_category_loss) / 3.0
+                )
+                g_loss = (
+                    cheat_loss / 2.0
+                    + l1_loss
+                    + self.Lcategory_penalty
+                    * (fake_category_loss + no_target_category_loss)
+                    / 2.0
+                    + (const_loss + no_target_const_loss) / 2.0
+                    + tv_loss
+                )
+
         # Enable eager execution.
         tf.compat.v1.enable_v2_behavior()
 
@@ -582,6 +661,8 @@ class UNet(object):
             no_target_ids=no_target_ids,
             cns_code=cns_code,
             seq_len=seq_len,
+            cns_memory=getattr(self, "cns_memory"),
+            style_weights=getattr(self, "style_weights"),
         )
 
         loss_handle = LossHandle(
@@ -604,6 +685,79 @@ class UNet(object):
         setattr(self, "loss_handle", loss_handle)
         setattr(self, "eval_handle", eval_handle)
 
+    def build_fanout(self, num_styles, inst_norm=False):
+        """
+        Generator graph that renders every character of a batch in
+        num_styles styles. The content and cns encoders run once per
+        character, only the decoder runs per style. Call after build_model,
+        the variables are shared. Built once per num_styles
+        """
+        if num_styles in self.fanout_handles:
+            setattr(self, "fanout_handle", self.fanout_handles[num_styles])
+            return self.fanout_handles[num_styles]
+        source = tf.compat.v1.placeholder(
+            tf.float32,
+            [self.batch_size, self.input_width, self.input_width, self.input_filters],
+            name="fanout_source_images",
+        )
+        cns_code = tf.compat.v1.placeholder(
+            tf.int64, shape=[None, None], name="fanout_cns_code"
+        )
+        seq_len = tf.compat.v1.placeholder(tf.int64, shape=None, name="fanout_seq_len")
+        style_ids = tf.compat.v1.placeholder(
+            tf.int64, shape=[num_styles], name="fanout_style_ids"
+        )
+        fanout_size = self.batch_size * num_styles
+
+        def repeat(x):
+            # character major, the styles of one character are adjacent
+            return tf.repeat(x, num_styles, axis=0)
+
+        with self.jit_scope():
+            e8, enc_layers = self.encoder(source, is_training=False, reuse=True)
+            z = self.cns_encoder(
+                cns_code, seq_len, reuse=True, training=not self.deterministic
+            )
+            encoder_state = tf.reshape(
+                z, [self.batch_size, 1, 1, self.cns_embedding_size * self.font_len]
+            )
+            style_weights = tf.one_hot(
+                indices=tf.tile(style_ids, [self.batch_size]), depth=self.embedding_num
+            )
+            one_hot = tf.reshape(
+                style_weights, shape=[fanout_size, 1, 1, self.embedding_num]
+            )
+            embedded = tf.concat([repeat(e8), one_hot, repeat(encoder_state)], 3)
+            output = self.decoder(
+                embedded,
+                dict((k, repeat(v)) for k, v in enc_layers.items()),
+                style_weights,
+                inst_norm,
+                is_training=False,
+                reuse=True,
+                batch_size=fanout_size,
+            )
+        output = tf.reshape(
+            output,
+            [
+                self.batch_size,
+                num_styles,
+                self.output_width,
+                self.output_width,
+                self.output_filters,
+            ],
+        )
+        fanout_handle = FanoutHandle(
+            source=source,
+            cns_code=cns_code,
+            seq_len=seq_len,
+            style_ids=style_ids,
+            generator=output,
+        )
+        self.fanout_handles[num_styles] = fanout_handle
+        setattr(self, "fanout_handle", fanout_handle)
+        return fanout_handle
+
     def register_session(self, sess):
         self.sess = sess
 
@@ -622,6 +776,38 @@ class UNet(object):
 
         return g_vars, d_vars  # , cns_vars
 
+    def style_axis(self, var_name):
+        """
+        Axis and offset of the per style slots of a style indexed variable,
+        None for variables shared by all styles
+        """
+        if "g_d1_deconv/W" in var_name:
+            # input channels of the first decoder layer are [e8, one hot, cns]
+            return 3, self.generator_dim * 8
+        if "inst_norm/scale" in var_name or "inst_norm/shift" in var_name:
+            return 0, 0
+        if "d_fc2/W" in var_name:
+            return 1, 0
+        if "d_fc2/b" in var_name:
+            return 0, 0
+        return None
+
+    def retrieve_style_vars(self, style_id):
+        """
+        Generator variables holding the parameters of a single style, with
+        a gradient mask that selects that style's slot
+        """
+        style_vars = list()
+        for var in tf.compat.v1.trainable_variables():
+            if "g_" not in var.name or self.style_axis(var.name) is None:
+                continue
+            axis, offset = self.style_axis(var.name)
+            shape = var.get_shape().as_list()
+            mask = np.zeros([n if i == axis else 1 for i, n in enumerate(shape)])
+            mask.reshape(-1)[offset + style_id] = 1.0
+            style_vars.append((var, tf.constant(mask, dtype=tf.float32)))
+        return style_vars
+
     def retrieve_generator_vars(self):
         all_vars = tf.compat.v1.global_variables()
         generate_vars = [
@@ -638,8 +824,103 @@ class UNet(object):
 
         return input_handle, loss_handle, eval_handle
 
+    def build_optimizers(self, freeze_encoder=False, num_replicas=1, adapt_style=None):
+        """
+        Create the D and G train ops. When num_replicas > 1, each optimizer is
+        wrapped in a SyncReplicasOptimizer so the gradients of all worker
+        replicas are averaged before a single synchronous update. With
+        adapt_style G only updates the parameters of that style
+        """
+        g_vars, d_vars = self.retrieve_trainable_vars(freeze_encoder=freeze_encoder)
+        style_masks = None
+        if adapt_style is not None:
+            style_masks = self.retrieve_style_vars(adapt_style)
+            g_vars = [var for var, _ in style_masks]
+            print("adapt style %d, train %s" % (adapt_style, [v.name for v in g_vars]))
+        _, loss_handle, _ = self.retrieve_handles()
+
+        learning_rate = tf.compat.v1.placeholder(tf.float32, name="learning_rate")
+        d_step, g_step = None, None
+        self.sync_optimizers, self.sync_vars = [], []
+        if num_replicas > 1:
+            # the aggregated update is applied by a chief queue runner that
+            # can not be fed, so the learning rate has to live in a variable
+            sync_lr = tf.compat.v1.Variable(
+                0.0, trainable=False, name="sync_learning_rate"
+            )
+            self.sync_lr_update = sync_lr.assign(learning_rate)
+            d_opt = tf.compat.v1.train.SyncReplicasOptimizer(
+                tf.compat.v1.train.AdamOptimizer(sync_lr, beta1=0.5),
+                replicas_to_aggregate=num_replicas,
+                total_num_replicas=num_replicas,
+            )
+            g_opt = tf.compat.v1.train.SyncReplicasOptimizer(
+                tf.compat.v1.train.AdamOptimizer(sync_lr, beta1=0.5),
+                replicas_to_aggregate=num_replicas,
+                total_num_replicas=num_replicas,
+            )
+            # separate steps, D and G are aggregated by different accumulators
+            d_step = tf.compat.v1.Variable(0, trainable=False, name="d_global_step")
+            g_step = tf.compat.v1.Variable(0, trainable=False, name="g_global_step")
+            # set by the chief once the weights are restored, the other
+            # replicas must not take steps on freshly initialized weights
+            sync_ready = tf.compat.v1.Variable(
+                False, trainable=False, name="sync_ready"
+            )
+            self.sync_ready = sync_ready
+            self.sync_ready_update = sync_ready.assign(True)
+            self.sync_optimizers = [d_opt, g_opt]
+            self.sync_vars = [sync_lr, d_step, g_step, sync_ready]
+        else:
+            d_opt = tf.compat.v1.train.AdamOptimizer(learning_rate, beta1=0.5)
+            g_opt = tf.compat.v1.train.AdamOptimizer(learning_rate, beta1=0.5)
+
+        # only the gradients are compiled, the sync replicas accumulators
+        # have no XLA kernels
+        with self.jit_scope():
+            d_grads = d_opt.compute_gradients(loss_handle.d_loss, var_list=d_vars)
+            g_grads = g_opt.compute_gradients(loss_handle.g_loss, var_list=g_vars)
+        if style_masks is not None:
+            # zero gradients leave Adam's moments at zero, so the masked out
+            # slots of the shared variables never move
+            g_grads = [
+                (grad * mask, var)
+                for (grad, var), (_, mask) in zip(g_grads, style_masks)
+            ]
+        d_optimizer = d_opt.apply_gradients(d_grads, global_step=d_step)
+        g_optimizer = g_opt.apply_gradients(g_grads, global_step=g_step)
+        train_handle = TrainHandle(
+            learning_rate=learning_rate,
+            d_optimizer=d_optimizer,
+            g_optimizer=g_optimizer,
+        )
+        setattr(self, "train_handle", train_handle)
+        return train_handle
+
+    def retrieve_checkpoint_vars(self):
+        # the sync replicas variables only exist in distributed runs, keep
+        # them out of checkpoints so those stay interchangeable with local ones
+        sync_names = set(var.name for var in getattr(self, "sync_vars", []))
+        all_vars = tf.compat.v1.global_variables()
+        return [var for var in all_vars if var.name not in sync_names]
+
+    def wait_for_variables(self, poll_secs=1.0):
+        # non chief replicas wait until the chief has initialized and restored
+        uninitialized = tf.compat.v1.report_uninitialized_variables(
+            tf.compat.v1.global_variables()
+        )
+        while len(self.sess.run(uninitialized)) > 0:
+            print("waiting for chief to initialize variables")
+            time.sleep(poll_secs)
+        while not self.sess.run(self.sync_ready):
+            print("waiting for chief to restore variables")
+            time.sleep(poll_secs)
+
     def get_model_id_and_dir(self):
         model_id = "experiment_%d_batch_%d" % (self.experiment_id, self.batch_size)
+        if self.input_width != 256:
+            # progressive training stages below full size keep their own checkpoints
+            model_id += "_size_%d" % self.input_width
         model_dir = os.path.join(self.checkpoint_dir, model_id)
         return model_id, model_dir
 
@@ -662,6 +943,77 @@ class UNet(object):
         else:
             print("fail to restore model %s" % model_dir)
 
+    def restore_compatible_model(self, model_dir):
+        """
+        Restore every variable whose name and shape match the checkpoint,
+        e.g. the previous stage of progressive training. The rest keeps its
+        initial value
+        """
+        ckpt = tf.train.get_checkpoint_state(model_dir)
+        if not ckpt:
+            print("fail to restore model %s" % model_dir)
+            return
+
+        ckpt_shapes = tf.train.load_checkpoint(
+            ckpt.model_checkpoint_path
+        ).get_variable_to_shape_map()
+        restore_vars, skipped = list(), list()
+        for var in self.retrieve_checkpoint_vars():
+            name = var.op.name
+            if ckpt_shapes.get(name) == var.get_shape().as_list():
+                restore_vars.append(var)
+            else:
+                skipped.append(name)
+        saver = tf.compat.v1.train.Saver(var_list=restore_vars)
+        saver.restore(self.sess, ckpt.model_checkpoint_path)
+        print(
+            "restored %d variables from %s, skipped %d: %s"
+            % (len(restore_vars), model_dir, len(skipped), ", ".join(skipped))
+        )
+
+    def restore_grown_styles(self, model_dir):
+        """
+        Restore a checkpoint trained with one style less. Style indexed
+        variables get a new slot for the last style id, initialized with the
+        mean of the existing styles. Optimizer state starts over
+        """
+        ckpt = tf.train.get_checkpoint_state(model_dir)
+        if not ckpt:
+            raise Exception("no checkpoint to adapt from in %s" % model_dir)
+
+        reader = tf.train.load_checkpoint(ckpt.model_checkpoint_path)
+        new_style = self.embedding_num - 1
+        for var in self.retrieve_checkpoint_vars():
+            name = var.op.name
+            if "Adam" in name or "_power" in name or not reader.has_tensor(name):
+                continue
+            value = reader.get_tensor(name)
+            shape = var.get_shape().as_list()
+            style_axis = self.style_axis(name)
+            if style_axis is None:
+                if list(value.shape) != shape:
+                    raise Exception(
+                        "%s is %s in %s but %s in the model, and is not indexed by style"
+                        % (name, list(value.shape), model_dir, shape)
+                    )
+            else:
+                axis, offset = style_axis
+                grown_shape = list(value.shape)
+                grown_shape[axis] += 1
+                if grown_shape != shape:
+                    raise Exception(
+                        "%s is %s in %s but %s in the model, the checkpoint needs "
+                        "exactly one style less than the model"
+                        % (name, list(value.shape), model_dir, shape)
+                    )
+                styles = np.take(value, range(offset, offset + new_style), axis=axis)
+                value = np.insert(
+                    value, offset + new_style, styles.mean(axis=axis), axis=axis
+                )
+                print("grow %s %s -> %s" % (name, styles.shape, value.shape))
+            var.load(value, self.sess)
+        print("restored model %s with new style %d" % (model_dir, new_style))
+
     def restore_cns_encoder(self, model_dir):
         all_vars = tf.compat.v1.global_variables()
         cns_vars = [var for var in all_vars if "cns_encoder" in var.name]
@@ -696,6 +1048,91 @@ class UNet(object):
         )
         return fake_images, real_images, d_loss, g_loss, l1_loss
 
+    def generate(
+        self,
+        input_images,
+        embedding_ids,
+        cns_code,
+        seq_len,
+        cns_memory=None,
+        style_weights=None,
+    ):
+        """
+        Generator output only, no target needed and no losses computed.
+        With cns_memory from a memory table the cns encoder is skipped,
+        style_weights [batch_size, embedding_num] mix styles in place of
+        embedding_ids
+        """
+        input_handle, _, eval_handle = self.retrieve_handles()
+        feed_dict = {input_handle.real_data: input_images}
+        if style_weights is None:
+            feed_dict[input_handle.embedding_ids] = embedding_ids
+        else:
+            feed_dict[input_handle.style_weights] = style_weights
+        if cns_memory is None:
+            feed_dict[input_handle.cns_code] = cns_code
+            feed_dict[input_handle.seq_len] = seq_len
+        else:
+            feed_dict[input_handle.cns_memory] = cns_memory
+        fake_images = self.sess.run(eval_handle.generator, feed_dict=feed_dict)
+        if self.first_output_time is None:
+            self.first_output_time = time.time()
+        return fake_images
+
+    def generate_fanout(self, input_images, cns_code, seq_len, style_ids):
+        """
+        [batch_size, len(style_ids), h, w, c] glyphs from the fan-out graph,
+        input_images as fed to generate()
+        """
+        fanout_handle = self.fanout_handles[len(style_ids)]
+        fake_images = self.sess.run(
+            fanout_handle.generator,
+            feed_dict={
+                fanout_handle.source: input_images[
+                    :,
+                    :,
+                    :,
+                    self.input_filters : self.input_filters + self.output_filters,
+                ],
+                fanout_handle.cns_code: cns_code,
+                fanout_handle.seq_len: seq_len,
+                fanout_handle.style_ids: style_ids,
+            },
+        )
+        if self.first_output_time is None:
+            self.first_output_time = time.time()
+        return fake_images
+
+    def generate_cached(
+        self, cache, keys, input_images, embedding_ids, cns_code, seq_len
+    ):
+        """
+        generate() that skips the model when the whole batch is in the cache
+        """
+        cached = [cache.get(key, style) for key, style in zip(keys, embedding_ids)]
+        if all(data is not None for data in cached):
+            return np.array([decode_png(data) for data in cached])
+        fake_images = self.generate(input_images, embedding_ids, cns_code, seq_len)
+        for key, style, img in zip(keys, embedding_ids, fake_images):
+            cache.put(key, style, encode_png(img))
+        return fake_images
+
+    def restore_generator(self, model_dir):
+        """
+        Initialize and restore the generator for inference. Nothing to do if
+        the latest checkpoint of model_dir is the one loaded last time
+        """
+        ckpt = tf.train.get_checkpoint_state(model_dir)
+        if ckpt and ckpt.model_checkpoint_path == self.restored_checkpoint:
+            return
+        self.sess.run(tf.compat.v1.global_variables_initializer())
+        if self.generator_saver is None:
+            self.generator_saver = tf.compat.v1.train.Saver(
+                var_list=self.retrieve_generator_vars()
+            )
+        self.restore_model(self.generator_saver, model_dir)
+        self.restored_checkpoint = ckpt.model_checkpoint_path if ckpt else None
+
     def validate_model(self, val_iter, epoch, step):
         for bid, batch in enumerate(val_iter):
             cns_code, seq_len, labels, images = batch
@@ -723,6 +1160,8 @@ class UNet(object):
         sample_img_path = os.path.join(
             model_sample_dir, "sample_%02d_%04d.jpg" % (epoch, step)
         )
+        import imageio.v3 as iio
+
         iio.imwrite(sample_img_path, merged_pair)
         return l1_loss
 
@@ -737,6 +1176,69 @@ class UNet(object):
             test.append(l1_loss)
         return sum(test) / len(test)
 
+    def evaluate_examples(self, examples):
+        """
+        MSE, SSIM and PSNR of the generator against the targets of packed
+        examples, grouped by their style label, as calligraphy_evaluate_metric.py
+        reports them but on the float outputs without writing any image
+        """
+        input_handle, _, eval_handle = self.retrieve_handles()
+        values = dict()
+        remaining = len(examples)
+        # a copy, get_batch_iter pads the list it is given in place
+        batch_iter = get_batch_iter(
+            list(examples),
+            self.batch_size,
+            augment=False,
+            image_size=self.input_width,
+        )
+        for cns_code, seq_len, labels, images in batch_iter:
+            fake_imgs, real_imgs = self.sess.run(
+                [eval_handle.generator, eval_handle.target],
+                feed_dict={
+                    input_handle.real_data: images,
+                    input_handle.embedding_ids: labels,
+                    input_handle.cns_code: cns_code,
+                    input_handle.seq_len: seq_len,
+                },
+            )
+            # the last batch is padded with examples from the start
+            real = min(remaining, self.batch_size)
+            remaining -= real
+            fake_imgs = scale_back(np.clip(fake_imgs[:real, :, :, 0], -1.0, 1.0))
+            real_imgs = scale_back(real_imgs[:real, :, :, 0])
+            metrics = batch_metrics(real_imgs, fake_imgs)
+            for i, label in enumerate(labels[:real]):
+                style_values = values.setdefault(
+                    label, dict((m, list()) for m in METRICS)
+                )
+                for m in METRICS:
+                    style_values[m].append(float(metrics[m][i]))
+        return summarize(values)
+
+    def log_evaluation(self, report, step, passed):
+        for style, entry in sorted(report["styles"].items(), key=lambda e: int(e[0])):
+            print(
+                "Eval: step %d, style %s, mse: %.5f, ssim: %.5f, psnr: %.3f"
+                % (step, style, entry["mse"], entry["ssim"], entry["psnr"])
+            )
+        overall = report["overall"]
+        print(
+            "Eval: step %d, all styles, mse: %.5f, ssim: %.5f, psnr: %.3f"
+            % (step, overall["mse"], overall["ssim"], overall["psnr"])
+        )
+        if hasattr(self, "log_dir"):
+            # one json report per line
+            with open(os.path.join(self.log_dir, "eval_history.jsonl"), "a") as f:
+                f.write(json.dumps(dict(report, step=step, seconds=passed)) + "\n")
+
+    def evaluate(self, source_obj, model_dir):
+        """
+        evaluate_examples() of a packed .obj with targets, e.g. cns_test.obj
+        """
+        self.restore_generator(model_dir)
+        return self.evaluate_examples(PickledImageProvider(source_obj).examples)
+
     def export_generator(self, save_dir, model_dir, model_name="gen_model"):
         saver = tf.compat.v1.train.Saver()
         self.restore_model(saver, model_dir)
@@ -744,8 +1246,64 @@ class UNet(object):
         gen_saver = tf.compat.v1.train.Saver(var_list=self.retrieve_generator_vars())
         gen_saver.save(self.sess, os.path.join(save_dir, model_name), global_step=0)
 
-    def infer(self, source_obj, embedding_ids, model_dir, save_dir):
+    def infer_chars(
+        self,
+        chars,
+        glyph_source,
+        embedding_ids,
+        model_dir,
+        save_dir,
+        cache=None,
+        image_format="jpg",
+        writer_threads=4,
+    ):
+        """
+        infer() for plain characters, their source glyphs are rendered on
+        the fly instead of read from a packed .obj. Files are named by the
+        unicode code point
+        """
+        self.restore_generator(model_dir)
+        batch_iter = glyph_source.batch_iter(chars, self.batch_size, embedding_ids)
+        written = set()
+        with make_writer(save_dir, image_format, num_workers=writer_threads) as writer:
+            for batch_chars, cns_code, seq_len, labels, source_imgs in batch_iter:
+                if cache is None:
+                    fake_imgs = self.generate(source_imgs, labels, cns_code, seq_len)
+                else:
+                    fake_imgs = self.generate_cached(
+                        cache, batch_chars, source_imgs, labels, cns_code, seq_len
+                    )
+                # the padding of the last batch repeats earlier characters,
+                # also of the same batch
+                new = list()
+                for i, ch in enumerate(batch_chars):
+                    if ch not in written:
+                        written.add(ch)
+                        new.append(i)
+                writer.write_batch(
+                    [char_name(batch_chars[i]) for i in new],
+                    [labels[i] for i in new],
+                    fake_imgs[new],
+                )
+                print("generated %s" % "".join(batch_chars[i] for i in new))
+
+    def infer(
+        self,
+        source_obj,
+        embedding_ids,
+        model_dir,
+        save_dir,
+        cache=None,
+        image_format="jpg",
+        writer_threads=4,
+    ):
+        """
+        Generate every example of source_obj, one file per example named by
+        its component code and index. Writing runs on a thread pool next to
+        the model
+        """
         source_provider = InjectDataProvider(source_obj)
+        num_examples = len(source_provider.data.examples)
 
         if isinstance(embedding_ids, int) or len(embedding_ids) == 1:
             embedding_id = (
@@ -759,25 +1317,38 @@ class UNet(object):
                 self.batch_size, embedding_ids
             )
 
-        tf.compat.v1.global_variables_initializer().run()
-        saver = tf.compat.v1.train.Saver(var_list=self.retrieve_generator_vars())
-        self.restore_model(saver, model_dir)
+        self.restore_generator(model_dir)
 
-        def save_imgs(imgs, count):
-            p = os.path.join(save_dir, "inferred_%04d.jpg" % count)
-            save_concat_images(imgs, img_path=p)
-            print("generated images saved at %s" % p)
+        keys = None
+        if cache is not None:
+            # same order as the batches of source_iter
+            examples = pad_seq(source_provider.data.examples[:], self.batch_size)
+            keys = [example_key(e[0], e[2]) for e in examples]
 
         count = 0
         batch_buffer = list()
+        writer = make_writer(save_dir, image_format, num_workers=writer_threads)
         for cns_code, seq_len, labels, source_imgs in source_iter:
-            fake_imgs = self.generate_fake_samples(
-                source_imgs, labels, cns_code, seq_len
-            )[0]
-            save_imgs(fake_imgs, count)
+            if keys is None:
+                fake_imgs = self.generate(source_imgs, labels, cns_code, seq_len)
+            else:
+                batch_keys = keys[
+                    count * self.batch_size : (count + 1) * self.batch_size
+                ]
+                fake_imgs = self.generate_cached(
+                    cache, batch_keys, source_imgs, labels, cns_code, seq_len
+                )
+            # leave out the padding of the last batch
+            real = min(self.batch_size, num_examples - count * self.batch_size)
+            names = [
+                glyph_name(c, n, count * self.batch_size + i)
+                for i, (c, n) in enumerate(zip(cns_code[:real], seq_len))
+            ]
+            writer.write_batch(names, labels, fake_imgs)
             # img_path = os.path.join(save_dir, "inferred_%04d.jpg" % count)
             # iio.imwrite(img_path, fake_imgs.squeeze())
             count += 1
+        writer.close()
         """
         for labels, source_imgs in source_iter:
             fake_imgs = self.generate_fake_samples(source_imgs, labels)[0]
@@ -792,97 +1363,90 @@ class UNet(object):
             save_imgs(batch_buffer, count)
         """
 
-    def interpolate(self, source_obj, between, model_dir, save_dir, steps):
-        tf.compat.v1.global_variables_initializer().run()
-        saver = tf.compat.v1.train.Saver(var_list=self.retrieve_generator_vars())
-        self.restore_model(saver, model_dir)
-        # new interpolated dimension
-        new_x_dim = steps + 1
-        alphas = np.linspace(0.0, 1.0, new_x_dim)
-
-        def _interpolate_tensor(_tensor):
-            """
-            Compute the interpolated tensor here
-            """
-
-            x = _tensor[between[0]]
-            y = _tensor[between[1]]
-
-            interpolated = list()
-            for alpha in alphas:
-                interpolated.append(x * (1.0 - alpha) + alpha * y)
-
-            interpolated = np.asarray(interpolated, dtype=np.float32)
-            return interpolated
-
-        def filter_embedding_vars(var):
-            var_name = var.name
-            if var_name.find("embedding") != -1:
-                return True
-            if (
-                var_name.find("inst_norm/shift") != -1
-                or var_name.find("inst_norm/scale") != -1
-            ):
-                return True
-            return False
-
-        embedding_vars = filter(filter_embedding_vars, tf.trainable_variables())
-        # here comes the hack, we overwrite the original tensor
-        # with interpolated ones. Note, the shape might differ
-
-        # this is to restore the embedding at the end
-        embedding_snapshot = list()
-        for e_var in embedding_vars:
-            val = e_var.eval(session=self.sess)
-            embedding_snapshot.append((e_var, val))
-            t = _interpolate_tensor(val)
-            op = tf.assign(e_var, t, validate_shape=False)
-            print(
-                "overwrite %s tensor" % e_var.name,
-                "old_shape ->",
-                e_var.get_shape(),
-                "new shape ->",
-                t.shape,
+    def infer_fanout(
+        self,
+        source_obj,
+        embedding_ids,
+        model_dir,
+        save_dir,
+        image_format="jpg",
+        writer_threads=4,
+    ):
+        """
+        infer() for all of embedding_ids at once, needs build_fanout with
+        len(embedding_ids) styles
+        """
+        source_provider = InjectDataProvider(source_obj)
+        num_examples = len(source_provider.data.examples)
+        writer = make_writer(save_dir, image_format, num_workers=writer_threads)
+        source_iter = source_provider.get_single_embedding_iter(
+            self.batch_size, embedding_ids[0]
+        )
+        self.restore_generator(model_dir)
+
+        for count, (cns_code, seq_len, _, source_imgs) in enumerate(source_iter):
+            fake_imgs = self.generate_fanout(
+                source_imgs, cns_code, seq_len, embedding_ids
             )
-            self.sess.run(op)
+            real = min(self.batch_size, num_examples - count * self.batch_size)
+            names = [
+                glyph_name(c, n, count * self.batch_size + i)
+                for i, (c, n) in enumerate(zip(cns_code[:real], seq_len))
+            ]
+            for i, style in enumerate(embedding_ids):
+                writer.write_batch(names, [style] * len(names), fake_imgs[:, i])
+            print("generated %d styles of batch %d" % (len(embedding_ids), count))
+        writer.close()
+
+    def interpolate(self, source_obj, pairs, model_dir, save_dir, steps):
+        """
+        Frames that morph every source from style s to style e for each (s, e)
+        in pairs, in steps + 1 steps. The generator is restored once and the
+        styles are mixed through style_weights, one batch of sources at a time
+        """
+        self.restore_generator(model_dir)
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        alphas = np.linspace(0.0, 1.0, steps + 1)
+        eye = np.eye(self.embedding_num, dtype=np.float32)
 
         source_provider = InjectDataProvider(source_obj)
-        input_handle, _, eval_handle, _ = self.retrieve_handles()
-        for step_idx in range(len(alphas)):
-            alpha = alphas[step_idx]
+        source_iter = source_provider.get_single_embedding_iter(self.batch_size, 0)
+        # merged batches of every frame
+        frames = dict(
+            ((s, e, step_idx), list())
+            for s, e in pairs
+            for step_idx in range(len(alphas))
+        )
+        for cns_code, seq_len, _, source_imgs in source_iter:
+            for s, e in pairs:
+                for step_idx, alpha in enumerate(alphas):
+                    weights = eye[s] * (1.0 - alpha) + eye[e] * alpha
+                    generated = self.generate(
+                        source_imgs,
+                        None,
+                        cns_code,
+                        seq_len,
+                        style_weights=np.tile(weights, (self.batch_size, 1)),
+                    )
+                    # one column per batch, save_concat_images adds the channels
+                    frames[(s, e, step_idx)].append(
+                        np.concatenate(scale_back(generated), axis=0)
+                    )
+
+        for (s, e, step_idx), batch_buffer in sorted(frames.items()):
+            if not batch_buffer:
+                continue
             print(
                 "interpolate %d -> %.4f + %d -> %.4f"
-                % (between[0], 1.0 - alpha, between[1], alpha)
+                % (s, 1.0 - alphas[step_idx], e, alphas[step_idx])
+            )
+            save_concat_images(
+                batch_buffer,
+                os.path.join(
+                    save_dir, "frame_%02d_%02d_step_%02d.jpg" % (s, e, step_idx)
+                ),
             )
-            source_iter = source_provider.get_single_embedding_iter(self.batch_size, 0)
-            batch_buffer = list()
-            count = 0
-            for _, source_imgs in source_iter:
-                count += 1
-                labels = [step_idx] * self.batch_size
-                (generated,) = self.sess.run(
-                    [eval_handle.generator],
-                    feed_dict={
-                        input_handle.real_data: source_imgs,
-                        input_handle.embedding_ids: labels,
-                    },
-                )
-                merged_fake_images = merge(scale_back(generated), [self.batch_size, 1])
-                batch_buffer.append(merged_fake_images)
-            if len(batch_buffer):
-                save_concat_images(
-                    batch_buffer,
-                    os.path.join(
-                        save_dir,
-                        "frame_%02d_%02d_step_%02d.jpg"
-                        % (between[0], between[1], step_idx),
-                    ),
-                )
-        # restore the embedding variables
-        print("restore embedding values")
-        for var, val in embedding_snapshot:
-            op = tf.assign(var, val, validate_shape=False)
-            self.sess.run(op)
 
     def train(
         self,
@@ -894,23 +1458,38 @@ class UNet(object):
         freeze_encoder=False,
         fine_tune=None,
         sample_steps=50,
+        num_replicas=1,
+        task_index=0,
+        resume_from=None,
+        adapt_from=None,
+        eval_steps=0,
     ):
-        g_vars, d_vars = self.retrieve_trainable_vars(freeze_encoder=freeze_encoder)
         input_handle, loss_handle, _ = self.retrieve_handles()
 
         if not self.sess:
             raise Exception("no session registered")
 
-        learning_rate = tf.compat.v1.placeholder(tf.float32, name="learning_rate")
-        d_optimizer = tf.compat.v1.train.AdamOptimizer(
-            learning_rate, beta1=0.5
-        ).minimize(loss_handle.d_loss, var_list=d_vars)
-        g_optimizer = tf.compat.v1.train.AdamOptimizer(
-            learning_rate, beta1=0.5
-        ).minimize(loss_handle.g_loss, var_list=g_vars)
+        is_chief = task_index == 0
+        # adapting trains only the newest style, the last id
+        adapt_style = self.embedding_num - 1 if adapt_from else None
+        train_handle = self.build_optimizers(
+            freeze_encoder=freeze_encoder,
+            num_replicas=num_replicas,
+            adapt_style=adapt_style,
+        )
+        learning_rate = train_handle.learning_rate
+        d_optimizer = train_handle.d_optimizer
+        g_optimizer = train_handle.g_optimizer
         # cns_optimizer = tf.compat.v1.train.AdamOptimizer(0.0002, beta1=0.5).minimize(loss_handle.g_loss, var_list=cns_vars)
+        # no spare tokens: every replica waits for the aggregated update before
+        # its next step, so all gradients come from the same step in lockstep
+        sync_hooks = [
+            opt.make_session_run_hook(is_chief, num_tokens=0)
+            for opt in self.sync_optimizers
+        ]
+        for hook in sync_hooks:
+            hook.begin()
 
-        tf.compat.v1.global_variables_initializer().run()
         real_data = input_handle.real_data
         embedding_ids = input_handle.embedding_ids
         no_target_data = input_handle.no_target_data
@@ -918,27 +1497,52 @@ class UNet(object):
         cns_code = input_handle.cns_code
         seq_len = input_handle.seq_len
 
-        # filter by one type of labels
-        data_provider = TrainDataProvider(self.data_dir, filter_by=fine_tune)
+        # filter by one type of labels, each replica reads its own shard
+        data_provider = TrainDataProvider(
+            self.data_dir,
+            filter_by=fine_tune,
+            shard_index=task_index,
+            num_shards=num_replicas,
+        )
         total_batches = data_provider.compute_total_batch_num(self.batch_size)
         # val_batch_iter = data_provider.get_val_iter(self.batch_size, shuffle=False)
         # val_batch_iter = data_provider.get_val_iter_bk(self.batch_size, shuffle=False)
 
-        saver = tf.compat.v1.train.Saver(max_to_keep=2)
+        saver = tf.compat.v1.train.Saver(
+            var_list=self.retrieve_checkpoint_vars(), max_to_keep=2
+        )
 
-        self.restore_cns_encoder(self.cns_encoder_dir)
+        if is_chief:
+            tf.compat.v1.global_variables_initializer().run()
+            self.restore_cns_encoder(self.cns_encoder_dir)
+
+            if adapt_from:
+                self.restore_grown_styles(adapt_from)
+            elif resume_from:
+                self.restore_compatible_model(resume_from)
+            elif resume:
+                _, model_dir = self.get_model_id_and_dir()
+                self.restore_model(saver, model_dir)
+            if self.sync_optimizers:
+                self.sess.run(self.sync_ready_update)
+        else:
+            self.wait_for_variables()
 
-        if resume:
-            _, model_dir = self.get_model_id_and_dir()
-            self.restore_model(saver, model_dir)
+        coord = tf.compat.v1.train.Coordinator()
+        for hook in sync_hooks:
+            hook.after_create_session(self.sess, coord)
 
         current_lr = lr
         counter = 0
         start_time = time.time()
         best_l1loss = 100
+        # (seconds since start, step, validation l1 loss)
+        val_history = list()
 
         for ei in range(epoch):
-            train_batch_iter = data_provider.get_train_iter(self.batch_size)
+            train_batch_iter = data_provider.get_train_iter(
+                self.batch_size, image_size=self.input_width
+            )
 
             if (ei + 1) % schedule == 0:
                 update_lr = current_lr / 2.0
@@ -946,6 +1550,10 @@ class UNet(object):
                 update_lr = max(update_lr, 0.0002)
                 print("decay learning rate from %.5f to %.5f" % (current_lr, update_lr))
                 current_lr = update_lr
+            if is_chief and self.sync_optimizers:
+                self.sess.run(
+                    self.sync_lr_update, feed_dict={learning_rate: current_lr}
+                )
 
             for bid, batch in enumerate(train_batch_iter):
                 counter += 1
@@ -1045,25 +1653,35 @@ class UNet(object):
                     )
                 )
 
-                if counter % sample_steps == 0:
+                if is_chief and counter % sample_steps == 0:
                     # sample the current model states with val data
                     # valid_l1loss = self.validate_model(val_batch_iter, ei, counter)
                     val_batch_iter = data_provider.get_val_iter(
-                        self.batch_size, shuffle=False
+                        self.batch_size, shuffle=False, image_size=self.input_width
                     )
                     valid_l1loss = self.validate_all(val_batch_iter)
                     print(valid_l1loss)
+                    val_history.append(
+                        (time.time() - start_time, counter, valid_l1loss)
+                    )
                     # self.valid_l1_loss_total = 0
                     # self.valid_count = 0
                     if valid_l1loss < best_l1loss:
                         best_l1loss = valid_l1loss
                         self.checkpoint(saver, counter)
+                if is_chief and eval_steps and counter % eval_steps == 0:
+                    # image metrics per style on the whole validation set
+                    report = self.evaluate_examples(data_provider.val.examples)
+                    self.log_evaluation(report, counter, time.time() - start_time)
                 """
                 if counter % checkpoint_steps == 0:
                     print("Checkpoint: save checkpoint step %d" % counter)
                     self.checkpoint(saver, counter)
                 """
 
-        # save the last checkpoint
-        print("Checkpoint: last checkpoint step %d" % counter)
-        self.checkpoint(saver, counter)
+        coord.request_stop()
+        if is_chief:
+            # save the last checkpoint
+            print("Checkpoint: last checkpoint step %d" % counter)
+            self.checkpoint(saver, counter)
+        return val_history
@@ -2,8 +2,6 @@
 from __future__ import print_function
 from __future__ import absolute_import
 
-import imageio.v3 as iio
-from skimage.transform import resize
 import numpy as np
 from io import BytesIO
 
@@ -14,7 +12,8 @@ def pad_seq(seq, batch_size):
     if seq_len % batch_size == 0:
         return seq
     padded = batch_size - (seq_len % batch_size)
-    seq.extend(seq[:padded])
+    # cycle, a sequence shorter than the padding repeats more than once
+    seq.extend([seq[i % seq_len] for i in range(padded)])
     return seq
 
 
@@ -31,7 +30,8 @@ def normalize_image(img):
 
 
 def read_split_image(img):
-    mat = iio.imread(img).astype(np.float)
+    import imageio.v3 as iio
+    mat = iio.imread(img).astype(np.float32)
     side = int(mat.shape[1] / 2)
     assert side * 2 == mat.shape[1]
     img_A = mat[:, :side]  # target
@@ -41,7 +41,8 @@ def read_split_image(img):
 
 
 def read_split_image_rgb(img):
-    mat = iio.imread(img).astype(np.float)
+    import imageio.v3 as iio
+    mat = iio.imread(img).astype(np.float32)
     side = int(mat.shape[1] / 2)
     assert side * 2 == mat.shape[1]
     img_A = mat[:, :side]  # target
@@ -51,17 +52,32 @@ def read_split_image_rgb(img):
 
 
 def shift_and_resize_image(img, shift_x, shift_y, nw, nh):
+    from skimage.transform import resize
     w, h = img.shape
     enlarged = resize(img, (nw, nh))
     return enlarged[shift_x:shift_x + w, shift_y:shift_y + h]
 
 
 def shift_and_resize_image_rgb(img, shift_x, shift_y, nw, nh):
+    from skimage.transform import resize
     w, h, _ = img.shape
     enlarged = resize(img, (nw, nh))
     return enlarged[shift_x:shift_x + w, shift_y:shift_y + h]
 
 
+def downsample_image(img, size):
+    """
+    Shrink a square image to size x size, by block averaging when the
+    factor is a whole number
+    """
+    w, h = img.shape
+    factor = w // size
+    if factor * size == w and factor * size == h:
+        return img.reshape(size, factor, size, factor).mean(axis=(1, 3))
+    from skimage.transform import resize
+    return resize(img, (size, size), preserve_range=True)
+
+
 def scale_back(images):
     return (images + 1.) / 2.
 
@@ -77,7 +93,26 @@ def merge(images, size):
     return img
 
 
+def encode_png(image):
+    """
+    Generator output in (-1, 1) to gray scale PNG bytes
+    """
+    import imageio.v3 as iio
+    img = (scale_back(np.clip(image, -1., 1.)) * 255).astype(np.uint8)
+    return iio.imwrite("<bytes>", img.squeeze(), extension=".png")
+
+
+def decode_png(data):
+    """
+    Inverse of encode_png, up to the 8 bit quantization
+    """
+    import imageio.v3 as iio
+    img = iio.imread(data).astype(np.float32)
+    return np.expand_dims(normalize_image(img), axis=2)
+
+
 def save_concat_images(imgs, img_path):
+    import imageio.v3 as iio
     concated = np.concatenate(imgs, axis=1)
     concated_3_channels = (np.tile(concated, [1, 1, 3]) * 255).astype(np.uint8)
     iio.imwrite(img_path, concated_3_channels)
@@ -29,6 +29,9 @@ def _draw_single_char(font, ch, width, height):
 def get_textsize(font, ch):
     img = Image.new("L", (1, 1), 255)
     draw = ImageDraw.Draw(img)
+    if not hasattr(draw, "textsize"):  # removed in Pillow 10
+        left, top, right, bottom = draw.textbbox((0, 0), ch, font=font)
+        return max(right, 1), max(bottom, 1)
     char_size = draw.textsize(ch, font=font)
     return char_size
 
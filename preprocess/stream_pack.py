@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import argparse
+import collections
+import hashlib
+import io
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageEnhance, ImageFont
+
+from preprocessing_helper import draw_single_char, CANVAS_SIZE, CHAR_SIZE, draw_example_src_only
+
+TRAIN_OBJ = "cns_train.obj"
+VAL_OBJ = "cns_test.obj"
+STATE_NAME = "stream_state.json"
+
+
+def load_components(cns_char_path="cns_char.txt", component_path="CNS_component.txt"):
+    """
+    unicode hex -> first component decomposition, the code char_info.get_component
+    gives, with both tables read once instead of per character
+    """
+    def read(path):
+        table = list()
+        with open(path, "rb") as f:
+            for line in f:
+                split = line.decode().strip().split("\t")
+                if len(split) == 2:
+                    table.append(split)
+        return table
+
+    components = dict((cns, component.split(";")[0]) for cns, component in read(component_path))
+    return dict((code, components[cns]) for cns, code in read(cns_char_path) if cns in components)
+
+
+_worker = dict()
+
+
+def init_worker(src_font, cns_char_path, component_path):
+    _worker["font"] = ImageFont.truetype(src_font, CHAR_SIZE)
+    _worker["components"] = load_components(cns_char_path, component_path)
+
+
+def make_example(path, char):
+    """
+    (cns_code, jpg bytes) of a crawled image, normalized and paired with
+    its source glyph as preprocess_all_image_grayscale.py does, or (None,
+    reason) if it cannot be used
+    """
+    component = _worker["components"].get(format(ord(char), "04X"))
+    if component is None:
+        return None, "no cns code"
+    try:
+        image = Image.open(path)
+        # read calligraphy image and modify size
+        calli_img = draw_single_char(image, canvas_size=CANVAS_SIZE, char_size=CHAR_SIZE)
+        calli_img = ImageEnhance.Contrast(calli_img).enhance(2.)
+        calli_img = ImageEnhance.Brightness(calli_img).enhance(2.)
+        together = draw_example_src_only(char, _worker["font"], calli_img, CANVAS_SIZE, CHAR_SIZE)
+    except OSError:
+        return None, "cannot open"
+    if together is None:
+        return None, "blank"
+    buf = io.BytesIO()
+    together.save(buf, format="JPEG")
+    return component, buf.getvalue()
+
+
+def is_val(char, split_ratio):
+    # by character, so every style of a character lands on the same side
+    return int(hashlib.md5(char.encode("utf-8")).hexdigest()[:8], 16) < split_ratio * 2 ** 32
+
+
+class StreamPacker(object):
+    """
+    Appends examples to save_dir/cns_train.obj and cns_test.obj, the files
+    package_cns.py writes. How far the manifest has been packed, the size
+    of both files at that point, the label of every album and the images
+    packed so far are kept in save_dir/stream_state.json. On start the obj
+    files are cut back to the recorded sizes, so examples written after the
+    last commit are not packed twice
+    """
+
+    def __init__(self, save_dir, split_ratio=0.1, albums=None):
+        self.save_dir = save_dir
+        self.split_ratio = split_ratio
+        self.state_path = os.path.join(save_dir, STATE_NAME)
+        self.state = {"offset": 0, "sizes": {TRAIN_OBJ: 0, VAL_OBJ: 0}, "labels": dict(), "packed": list(),
+                      "counts": collections.Counter()}
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as f:
+                self.state = json.load(f)
+            self.state["counts"] = collections.Counter(self.state["counts"])
+        for i, album in enumerate(albums or []):
+            if self.state["labels"].get(album, i) != i:
+                raise Exception("album %s was packed with label %d" % (album, self.state["labels"][album]))
+            self.state["labels"][album] = i
+        self.packed = set(self.state["packed"])
+        self.files = dict()
+        for name in (TRAIN_OBJ, VAL_OBJ):
+            path = os.path.join(save_dir, name)
+            f = open(path, "ab")
+            f.truncate(self.state["sizes"][name])
+            f.seek(0, os.SEEK_END)
+            self.files[name] = f
+
+    @property
+    def offset(self):
+        return self.state["offset"]
+
+    @staticmethod
+    def key(entry):
+        return "%s:%s" % (entry["album"], entry["sha1"])
+
+    def label(self, album):
+        if album not in self.state["labels"]:
+            self.state["labels"][album] = len(self.state["labels"])
+            print("album %s is label %d" % (album, self.state["labels"][album]))
+        return self.state["labels"][album]
+
+    def add(self, entry, cns_code, img_bytes):
+        name = VAL_OBJ if is_val(entry["char"], self.split_ratio) else TRAIN_OBJ
+        # one write per example, a reader sees whole examples or a cut off last one
+        self.files[name].write(pickle.dumps((cns_code, self.label(entry["album"]), img_bytes)))
+        self.packed.add(self.key(entry))
+        self.state["counts"][name] += 1
+
+    def skip(self, reason):
+        self.state["counts"][reason] += 1
+
+    def commit(self, offset):
+        for name, f in self.files.items():
+            f.flush()
+            self.state["sizes"][name] = f.tell()
+        self.state["offset"] = offset
+        self.state["packed"] = sorted(self.packed)
+        with open(self.state_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def follow(manifest_path, offset=0, follow=False, idle_exit=600., poll=1.):
+    """
+    (entry, offset after its line) of every complete line of the manifest
+    from offset on. With follow, wait for the crawler to append more and
+    yield (None, None) while waiting, stop once nothing came for idle_exit
+    seconds
+    """
+    last_line = time.time()
+    while True:
+        lines = list()
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "rb") as f:
+                f.seek(offset)
+                lines = f.readlines()
+        for line in lines:
+            if not line.endswith(b"\n"):  # still being written
+                break
+            offset += len(line)
+            last_line = time.time()
+            yield json.loads(line.decode("utf-8")), offset
+        if not follow or time.time() - last_line > idle_exit:
+            return
+        yield None, None
+        time.sleep(poll)
+
+
+def stream_pack(crawl_dir, save_dir, src_font, workers=4, max_pending=None, split_ratio=0.1, albums=None,
+                follow_manifest=False, idle_exit=600., commit_seconds=1., cns_char_path="cns_char.txt",
+                component_path="CNS_component.txt"):
+    """
+    Pack the images of crawl_dir/manifest.jsonl into save_dir as they are
+    listed. Images are normalized on a pool of worker processes, at most
+    max_pending are in flight, so a fast crawler waits for the workers
+    instead of piling up work. Examples are appended in manifest order
+    and committed every commit_seconds
+    """
+    packer = StreamPacker(save_dir, split_ratio, albums)
+    max_pending = max_pending or workers * 4
+    manifest_path = os.path.join(crawl_dir, "manifest.jsonl")
+    pending = collections.deque()
+    queued = set()
+    last_commit = time.time()
+
+    def finish(limit):
+        # wait until fewer than limit images are pending, and take the ones done.
+        # in manifest order, the committed offset never passes an unfinished image
+        while pending and (len(pending) >= limit or pending[0][2] is None or pending[0][2].done()):
+            entry, offset, future = pending.popleft()
+            if future is not None:
+                queued.discard(packer.key(entry))
+                cns_code, result = future.result()
+                if cns_code is None:
+                    packer.skip(result)
+                    with open(os.path.join(save_dir, "error_msg.txt"), "a", encoding="utf-8") as f:
+                        f.write("%s: %s \n" % (entry["file"], result))
+                else:
+                    packer.add(entry, cns_code, result)
+            packer.state["offset"] = offset
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(src_font, cns_char_path, component_path)) as pool:
+        try:
+            for entry, offset in follow(manifest_path, packer.offset, follow_manifest, idle_exit):
+                if entry is not None:
+                    key = packer.key(entry)
+                    if key in packer.packed or key in queued:
+                        pending.append((entry, offset, None))
+                    else:
+                        queued.add(key)
+                        future = pool.submit(make_example, os.path.join(crawl_dir, entry["file"]), entry["char"])
+                        pending.append((entry, offset, future))
+                finish(max_pending)
+                if time.time() - last_commit > commit_seconds:
+                    packer.commit(packer.offset)
+                    last_commit = time.time()
+                    print("packed %s" % dict(packer.state["counts"]))
+            finish(1)
+        finally:
+            packer.commit(packer.offset)
+            packer.close()
+    print("packed %s" % dict(packer.state["counts"]))
+    return packer.state["counts"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack crawled images for training while the crawler runs')
+    parser.add_argument('--crawl_dir', required=True, help='out_dir of crawler/async_crawler.py')
+    parser.add_argument('--save_dir', required=True, help='path to save pickled files')
+    parser.add_argument('--src_font', default='preprocess/SimSun.ttf', help='font of the source glyphs')
+    parser.add_argument('--split_ratio', type=float, default=0.1,
+                        help='share of characters held out for validation')
+    parser.add_argument('--albums', default=None,
+                        help='comma separated albums in label order, otherwise in the order they are first seen')
+    parser.add_argument('--workers', type=int, default=4, help='processes normalizing images')
+    parser.add_argument('--max_pending', type=int, default=None,
+                        help='images in flight before reading the manifest waits, 4 per worker by default')
+    parser.add_argument('--follow', action='store_true', help='keep packing what the crawler appends')
+    parser.add_argument('--idle_exit', type=float, default=600.,
+                        help='with --follow, stop after this many seconds without new images')
+    args = parser.parse_args()
+
+    albums = args.albums.split(",") if args.albums else None
+    stream_pack(args.crawl_dir, args.save_dir, args.src_font, workers=args.workers, max_pending=args.max_pending,
+                split_ratio=args.split_ratio, albums=albums, follow_manifest=args.follow, idle_exit=args.idle_exit)
+
+
+if __name__ == "__main__":
+    main()
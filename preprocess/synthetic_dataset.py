@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+
+import argparse
+import io
+import multiprocessing
+import os
+import pickle
+import time
+import zlib
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+def load_codes(component_path="CNS_component.txt", cns_char_path="cns_char.txt", cns_vocab_size=518, font_len=28):
+    """
+    First component decomposition of every character that has a unicode
+    code point, as preprocess_all_image_grayscale.py would label it, left
+    out if it does not fit the model's component vocabulary
+    """
+    def read(path):
+        table = dict()
+        with open(path, "rb") as f:
+            for line in f:
+                split = line.decode().strip().split("\t")
+                if len(split) == 2:
+                    table[split[0]] = split[1]
+        return table
+
+    components = read(component_path)
+    codes = list()
+    for cns in sorted(read(cns_char_path)):
+        code = components.get(cns, "").split(";")[0]
+        ids = code.split(",")
+        if all(i.isdigit() for i in ids) and len(ids) <= font_len and max(map(int, ids)) < cns_vocab_size:
+            codes.append(code)
+    return codes
+
+
+def strokes(code, rng):
+    """
+    Stroke skeleton of a character, polylines in [0, 1] coordinates. More
+    components give more strokes, like real glyphs
+    """
+    count = min(3 + 2 * len(code.split(",")), 18)
+    lines = list()
+    for _ in range(count):
+        x, y = rng.uniform(0.15, 0.85, 2)
+        kind = rng.randint(4)
+        if kind == 0:  # horizontal
+            points = [(x - 0.25, y), (x + 0.25, y + rng.uniform(-0.03, 0.03))]
+        elif kind == 1:  # vertical, sometimes with a hook
+            points = [(x, y - 0.3), (x, y + 0.3)]
+            if rng.rand() < 0.3:
+                points.append((x - 0.06, y + 0.24))
+        elif kind == 2:  # falling to the left
+            points = [(x + 0.15, y - 0.2), (x, y), (x - 0.2, y + 0.2)]
+        else:  # dot or falling to the right
+            length = rng.uniform(0.04, 0.25)
+            points = [(x - length / 2, y - length / 2), (x + length / 2, y + length / 2)]
+        lines.append([(min(max(px, 0.08), 0.92), min(max(py, 0.08), 0.92)) for px, py in points])
+    return lines
+
+
+def draw_glyph(lines, size, width, slant=0., jitter=0., rng=None):
+    img = Image.new("L", (size, size), 255)
+    draw = ImageDraw.Draw(img)
+    for line in lines:
+        points = list()
+        for x, y in line:
+            if jitter:
+                x, y = x + rng.normal(0, jitter), y + rng.normal(0, jitter)
+            points.append(((x + slant * (0.5 - y)) * size, y * size))
+        draw.line(points, fill=0, width=max(int(width), 1), joint="curve")
+    return img
+
+
+def make_example(code, label, rng, image_size=256, embedding_num=7):
+    """
+    (cns_code, label, jpg bytes) packed like package_cns.py does. The
+    source glyph depends only on the code, so every style of a character
+    shares it, the target is the same skeleton with the stroke width and
+    slant of the style and some hand jitter
+    """
+    lines = strokes(code, np.random.RandomState(zlib.crc32(code.encode("utf-8"))))
+    base_width = image_size / 40.
+    source = draw_glyph(lines, image_size, base_width)
+    style = (label - (embedding_num - 1) / 2.) / max(embedding_num, 1)
+    target = draw_glyph(lines, image_size, base_width * (1.5 + style) * rng.uniform(0.9, 1.1),
+                        slant=0.3 * style, jitter=0.01, rng=rng)
+    example = Image.new("L", (image_size * 2, image_size), 255)
+    example.paste(target, (0, 0))
+    example.paste(source, (image_size, 0))
+    buf = io.BytesIO()
+    example.save(buf, format="JPEG")
+    return code, label, buf.getvalue()
+
+
+_codes = list()
+
+
+def init_worker(codes):
+    _codes[:] = codes
+
+
+def make_chunk(task):
+    """
+    Pickled examples of one chunk and whether each goes to validation,
+    seeded by the chunk index, so the output does not depend on the
+    number of workers
+    """
+    index, count, seed, image_size, embedding_num, split_ratio = task
+    rng = np.random.RandomState([seed, index])
+    chunk = list()
+    for _ in range(count):
+        code = _codes[rng.randint(len(_codes))]
+        example = make_example(code, int(rng.randint(embedding_num)), rng, image_size, embedding_num)
+        chunk.append((pickle.dumps(example), rng.rand() < split_ratio))
+    return chunk
+
+
+def generate(save_dir, examples, split_ratio=0.1, embedding_num=7, image_size=256, num_chars=0, seed=0,
+             workers=None, chunk_size=256, component_path="CNS_component.txt", cns_char_path="cns_char.txt",
+             cns_vocab_size=518):
+    """
+    Write examples synthetic examples to save_dir/cns_train.obj and
+    cns_test.obj, the files TrainDataProvider reads. Chunks are made on a
+    pool of worker processes and written as they come in, so memory stays
+    flat however large the dataset is. num_chars limits the characters
+    drawn from, for datasets with several styles per character
+    """
+    codes = load_codes(component_path, cns_char_path, cns_vocab_size)
+    if num_chars:
+        codes = [codes[i] for i in np.random.RandomState(seed).permutation(len(codes))[:num_chars]]
+    print("%d component codes to sample from" % len(codes))
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+
+    tasks = [(i, min(chunk_size, examples - i * chunk_size), seed, image_size, embedding_num, split_ratio)
+             for i in range((examples + chunk_size - 1) // chunk_size)]
+    counts = {"train": 0, "val": 0}
+    start_time = time.time()
+    ctx = multiprocessing.get_context("spawn")
+    with open(os.path.join(save_dir, "cns_train.obj"), "wb") as ft, \
+            open(os.path.join(save_dir, "cns_test.obj"), "wb") as fv, \
+            ctx.Pool(workers, initializer=init_worker, initargs=(codes,)) as pool:
+        for i, chunk in enumerate(pool.imap(make_chunk, tasks)):
+            for data, val in chunk:
+                (fv if val else ft).write(data)
+                counts["val" if val else "train"] += 1
+            if (i + 1) % 20 == 0 or i + 1 == len(tasks):
+                done = counts["train"] + counts["val"]
+                print("%d/%d examples, %.0f MB, %.0f examples/sec"
+                      % (done, examples, (ft.tell() + fv.tell()) / (1024. * 1024.),
+                         done / (time.time() - start_time)))
+    print("train examples -> %d, val examples -> %d, in %.1f sec"
+          % (counts["train"], counts["val"], time.time() - start_time))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a packed dataset of synthetic glyphs of any size')
+    parser.add_argument('--save_dir', dest='save_dir', required=True, help='path to save pickled files')
+    parser.add_argument('--examples', type=int, default=10000, help='number of examples, train and val together')
+    parser.add_argument('--split_ratio', type=float, default=0.1, dest='split_ratio',
+                        help='split ratio between train and val')
+    parser.add_argument('--embedding_num', type=int, default=7, help='number of styles the labels cover')
+    parser.add_argument('--image_size', type=int, default=256)
+    parser.add_argument('--chars', type=int, default=0,
+                        help='distinct characters to draw from, every character of cns_char.txt by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='processes drawing glyphs, one per core by default')
+    parser.add_argument('--chunk_size', type=int, default=256, help='examples per task of a worker')
+    parser.add_argument('--cns_vocab_size', type=int, default=518,
+                        help='characters with component ids beyond the model vocabulary are left out')
+    args = parser.parse_args()
+
+    generate(args.save_dir, args.examples, split_ratio=args.split_ratio, embedding_num=args.embedding_num,
+             image_size=args.image_size, num_chars=args.chars, seed=args.seed, workers=args.workers,
+             chunk_size=args.chunk_size, cns_vocab_size=args.cns_vocab_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+import json
+import time
+import models.parser as parser
+import tensorflow as tf
+from models.glyph_source import GlyphSource
+from models.graph_cache import build_model_cached, graph_cache_dir
+from models.jobs import load_jobs, run_jobs
+from models.tuning import apply_tuning, session_config
+from models.unet_onehot_cns_font_attention import UNet
+
+
+def main(_):
+    args = apply_tuning(parser.arg_parse(), "infer")
+    config = session_config(args)
+    model_dir, jobs = load_jobs(args.jobs)
+    model_dir = model_dir or args.model_dir
+    glyph_sources = list()
+
+    def glyph_source():
+        # the font is loaded by the first job that renders chars
+        if not glyph_sources:
+            glyph_sources.append(GlyphSource(args.src_font))
+        return glyph_sources[0]
+
+    start_time = time.time()
+    with tf.compat.v1.Session(config=config) as sess:
+        model = UNet(batch_size=args.batch_size, embedding_num=args.embedding_num,
+                     cns_embedding_size=args.cns_embedding_size, xla=args.xla, deterministic=args.deterministic)
+        model.register_session(sess)
+        if any(job["type"] == "fanout" for job in jobs):
+            # the fan-out graphs reuse the variables through the variable store
+            model.build_model(is_training=False, inst_norm=args.inst_norm)
+        else:
+            build_model_cached(model, graph_cache_dir(args), is_training=False, inst_norm=args.inst_norm)
+        build_seconds = time.time() - start_time
+        report = run_jobs(model, jobs, model_dir, glyph_source=glyph_source, image_format=args.output_format,
+                          writer_threads=args.writer_threads, inst_norm=args.inst_norm)
+    report.insert(0, {"name": "build", "seconds": build_seconds})
+
+    print("%-24s %10s" % ("job", "seconds"))
+    for entry in report:
+        print("%-24s %10.2f" % (entry["name"], entry["seconds"]))
+    print("%-24s %10.2f" % ("total", time.time() - start_time))
+    if args.job_report:
+        with open(args.job_report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    tf.compat.v1.app.run()
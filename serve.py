@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+import models.parser as parser
+import tensorflow as tf
+from models.cns_memory import CnsMemoryTable
+from models.glyph_cache import GlyphCache
+from models.glyph_source import GlyphSource
+from models.graph_cache import build_model_cached, graph_cache_dir
+from models.serving import BatchingGenerator, make_server
+from models.tuning import apply_tuning, session_config
+from models.unet_onehot_cns_font_attention import UNet
+
+
+def main(_):
+    args = apply_tuning(parser.arg_parse(), "infer")
+    config = session_config(args)
+    if args.cns_memory_dir and not args.deterministic:
+        raise Exception("the cns memory table holds deterministic encodings, serve with --deterministic=1")
+    use_cache = bool(args.cache_size or args.cache_dir)
+    if use_cache and not args.deterministic:
+        # a cached dropout sample would be served for every later request
+        print("cached glyphs have to be reproducible, serve with dropout off, --cache_size=0 keeps it on")
+        args.deterministic = 1
+
+    with tf.compat.v1.Session(config=config) as sess:
+        model = UNet(batch_size=args.batch_size, input_width=args.image_size, output_width=args.image_size,
+                     embedding_num=args.embedding_num, cns_embedding_size=args.cns_embedding_size, xla=args.xla,
+                     deterministic=args.deterministic)
+        model.register_session(sess)
+        build_model_cached(model, graph_cache_dir(args), is_training=False, inst_norm=args.inst_norm)
+        model.restore_generator(args.model_dir)
+        # reuse one saver to pick up new checkpoints, no more ops from here on
+        saver = tf.compat.v1.train.Saver(var_list=model.retrieve_generator_vars())
+        sess.graph.finalize()
+
+        # also with nothing to cache, it notices new checkpoints
+        cache = GlyphCache(args.model_dir, capacity=args.cache_size, cache_dir=args.cache_dir,
+                           max_disk_mb=args.cache_mb)
+        glyph_source = GlyphSource(args.src_font, canvas_size=args.image_size)
+        memory_table = CnsMemoryTable(args.cns_memory_dir) if args.cns_memory_dir else None
+        generator = BatchingGenerator(model, glyph_source, max_latency=args.max_latency_ms / 1000., cache=cache,
+                                      memory_table=memory_table, reload=lambda: model.restore_model(saver, args.model_dir)).start()
+        server = make_server(generator, host=args.host, port=args.port, unix_socket=args.unix_socket)
+        print("serving %s on %s, batch size %d" % (args.model_dir, args.unix_socket or "%s:%d" % server.server_address,
+                                                   model.batch_size))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == '__main__':
+    tf.compat.v1.app.run()
@@ -1,33 +1,120 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 from __future__ import absolute_import
+import sys
+import time
 import tensorflow as tf
 import models.parser as parser
+import models.distributed as distributed
+from models.tuning import apply_tuning, session_config
 from models.unet_onehot_cns_font_attention import UNet
 
+
+def build_unet(args, sess, image_size):
+    model = UNet(args.experiment_dir, batch_size=args.batch_size, experiment_id=args.experiment_id,
+                 input_width=image_size, output_width=image_size, embedding_num=args.embedding_num,
+                 L1_penalty=args.L1_penalty, Lconst_penalty=args.Lconst_penalty,
+                 Ltv_penalty=args.Ltv_penalty, Lcategory_penalty=args.Lcategory_penalty,
+                 cns_encoder_dir=args.cns_encoder_dir, cns_embedding_size=args.cns_embedding_size,
+                 xla=args.xla)
+    model.register_session(sess)
+    if args.flip_labels:
+        model.build_model(is_training=True, inst_norm=args.inst_norm, no_target_source=True)
+    else:
+        model.build_model(is_training=True, inst_norm=args.inst_norm)
+    return model
+
+
+def fine_tune_labels(args):
+    if args.adapt_from and not args.fine_tune:
+        # the few examples of the new style are all adaptation needs
+        return set([args.embedding_num - 1])
+    if not args.fine_tune:
+        return None
+    ids = args.fine_tune.split(",")
+    return set([int(i) for i in ids])
+
+
+def report_time_to_l1(val_history, target_l1):
+    for passed, counter, l1_loss in val_history:
+        if l1_loss <= target_l1:
+            print("validation l1 loss %.5f <= %.5f after %.1f sec, step %d" % (l1_loss, target_l1, passed, counter))
+            return passed
+    print("validation l1 loss never reached %.5f" % target_l1)
+    return None
+
+
+def train_progressive(args, config):
+    """
+    Train at growing image sizes. Every stage starts from the previous
+    stage's checkpoint, only the discriminator's fully connected layers
+    depend on the image size and start over. The validation history only
+    has the last stage, l1 loss at a smaller size does not compare, the
+    earlier stages count towards its time
+    """
+    sizes = [int(i) for i in args.progressive_sizes.split(",")]
+    epochs = [int(i) for i in args.progressive_epochs.split(",")]
+    if len(sizes) != len(epochs):
+        raise Exception("need one epoch count for every progressive size")
+
+    val_history = list()
+    passed = 0.
+    resume_from = None
+    for size, epoch in zip(sizes, epochs):
+        print("progressive stage: size %d, %d epochs" % (size, epoch))
+        stage_start = time.time()
+        with tf.Graph().as_default(), tf.compat.v1.Session(config=config) as sess:
+            model = build_unet(args, sess, size)
+            history = model.train(lr=args.lr, epoch=epoch, resume=args.resume, resume_from=resume_from,
+                                  schedule=args.schedule, freeze_encoder=args.freeze_encoder,
+                                  fine_tune=fine_tune_labels(args), sample_steps=args.sample_steps,
+                                  flip_labels=args.flip_labels, eval_steps=args.eval_steps)
+            _, resume_from = model.get_model_id_and_dir()
+        # carry the wall clock over, graph building counts as well
+        if size == sizes[-1]:
+            val_history.extend((passed + t, counter, l1_loss) for t, counter, l1_loss in history)
+        passed += time.time() - stage_start
+        print("progressive stage size %d done, %.1f sec in total" % (size, passed))
+    return val_history
+
+
 def main(_):
     args = parser.arg_parse()
-    config = tf.compat.v1.ConfigProto()
-    config.gpu_options.allow_growth = True
-
-    with tf.compat.v1.Session(config=config) as sess:
-        model = UNet(args.experiment_dir, batch_size=args.batch_size, experiment_id=args.experiment_id,
-                     input_width=args.image_size, output_width=args.image_size, embedding_num=args.embedding_num,
-                     L1_penalty=args.L1_penalty, Lconst_penalty=args.Lconst_penalty,
-                     Ltv_penalty=args.Ltv_penalty, Lcategory_penalty=args.Lcategory_penalty,
-                     cns_encoder_dir=args.cns_encoder_dir, cns_embedding_size=args.cns_embedding_size)
-        model.register_session(sess)
-        if args.flip_labels:
-            model.build_model(is_training=True, inst_norm=args.inst_norm, no_target_source=True)
-        else:
-            model.build_model(is_training=True, inst_norm=args.inst_norm)
-        fine_tune_list = None
-        if args.fine_tune:
-            ids = args.fine_tune.split(",")
-            fine_tune_list = set([int(i) for i in ids])
-        model.train(lr=args.lr, epoch=args.epoch, resume=args.resume,
-                    schedule=args.schedule, freeze_encoder=args.freeze_encoder, fine_tune=fine_tune_list,
-                    sample_steps=args.sample_steps, flip_labels=args.flip_labels)
+    if args.local_workers:
+        sys.exit(distributed.launch_local_cluster(args.local_workers, sys.argv[1:]))
+
+    args = apply_tuning(args, "train")
+    config = session_config(args)
+
+    if args.progressive_sizes:
+        val_history = train_progressive(args, config)
+        if args.target_l1 is not None:
+            report_time_to_l1(val_history, args.target_l1)
+        return
+
+    target, device, num_replicas = "", None, 1
+    if args.worker_hosts:
+        cluster = distributed.cluster_spec(args.ps_hosts, args.worker_hosts)
+        server = tf.distribute.Server(cluster, job_name=args.job_name, task_index=args.task_index, config=config)
+        if args.job_name == "ps":
+            server.join()
+            return
+        # only talk to the ps tasks and ourselves, not to the other workers
+        config.device_filters.extend(["/job:ps", "/job:worker/task:%d" % args.task_index])
+        target = server.target
+        device = distributed.replica_device(cluster, args.task_index)
+        num_replicas = cluster.num_tasks("worker")
+
+    with tf.compat.v1.Session(target, config=config) as sess, tf.compat.v1.device(device):
+        model = build_unet(args, sess, args.image_size)
+        val_history = model.train(lr=args.lr, epoch=args.epoch, resume=args.resume,
+                                  schedule=args.schedule, freeze_encoder=args.freeze_encoder,
+                                  fine_tune=fine_tune_labels(args), sample_steps=args.sample_steps,
+                                  flip_labels=args.flip_labels,
+                                  num_replicas=num_replicas, task_index=args.task_index,
+                                  adapt_from=args.adapt_from, eval_steps=args.eval_steps)
+    if args.target_l1 is not None and args.task_index == 0:
+        report_time_to_l1(val_history, args.target_l1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from __future__ import absolute_import
+import multiprocessing
+import os
+import socket
+import time
+import models.parser as parser
+from models.profiling import profile_model, run_isolated, thread_grid
+from models.tuning import save_tuning, load_tuning
+
+
+def physical_memory_mb():
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024. * 1024.)
+
+
+def tune_role(role, args, intra_grid, inter_grid, batch_sizes, budget_mb):
+    """
+    Try every thread setting with growing batch sizes. A batch size that
+    blows the memory budget ends the sweep for that thread setting
+    """
+    trials = list()
+    for intra in intra_grid:
+        for inter in inter_grid:
+            for batch_size in batch_sizes:
+                result = run_isolated(profile_model, batch_size=batch_size, intra_op_threads=intra,
+                                      inter_op_threads=inter, train=(role == "train"), steps=args.tune_steps,
+                                      inst_norm=args.inst_norm, embedding_num=args.embedding_num,
+                                      cns_embedding_size=args.cns_embedding_size)
+                result.update({"role": role, "batch_size": batch_size,
+                               "intra_op_threads": intra, "inter_op_threads": inter})
+                trials.append(result)
+                if "error" in result:
+                    print("%s batch %d, intra %d, inter %d -> %s" % (role, batch_size, intra, inter,
+                                                                     result["error"]))
+                    break
+                print("%s batch %d, intra %d, inter %d -> %.2f images/sec, peak rss %.0f MB"
+                      % (role, batch_size, intra, inter, result[role]["images_per_sec"], result["peak_rss_mb"]))
+                if result["peak_rss_mb"] > budget_mb:
+                    print("over memory budget of %.0f MB" % budget_mb)
+                    result["over_budget"] = True
+                    break
+
+    fits = [t for t in trials if "error" not in t and not t.get("over_budget")]
+    if not fits:
+        return None, trials
+    best = max(fits, key=lambda t: t[role]["images_per_sec"])
+    return {
+        "batch_size": best["batch_size"],
+        "intra_op_threads": best["intra_op_threads"],
+        "inter_op_threads": best["inter_op_threads"],
+        "images_per_sec": best[role]["images_per_sec"],
+        "peak_rss_mb": best["peak_rss_mb"],
+    }, trials
+
+
+def xla_report(args):
+    """
+    Same setting with and without XLA. The extra warm up time of the XLA
+    run is the compilation, the step times give the steady state speedup
+    """
+    tuning = load_tuning(args.tuning_config) or {}
+    report = dict()
+    for role in ("train", "infer"):
+        best = tuning.get(role, {})
+        setting = {
+            "batch_size": args.batch_size or best.get("batch_size", 16),
+            "intra_op_threads": args.intra_op_threads or best.get("intra_op_threads", 0),
+            "inter_op_threads": args.inter_op_threads or best.get("inter_op_threads", 0),
+        }
+        runs = dict()
+        for xla in (False, True):
+            result = run_isolated(profile_model, train=(role == "train"), steps=args.tune_steps,
+                                  inst_norm=args.inst_norm, xla=xla, embedding_num=args.embedding_num,
+                                  cns_embedding_size=args.cns_embedding_size, **setting)
+            if "error" in result:
+                raise Exception("%s trial with xla=%s failed: %s" % (role, xla, result["error"]))
+            runs[xla] = result[role]
+        compile_sec = runs[True]["warmup_sec"] - runs[False]["warmup_sec"]
+        speedup = runs[False]["step_sec"] / runs[True]["step_sec"]
+        print("%s batch %d: compile %.2f sec, step %.4f -> %.4f sec, speedup %.2fx"
+              % (role, setting["batch_size"], compile_sec, runs[False]["step_sec"],
+                 runs[True]["step_sec"], speedup))
+        report[role] = dict(setting, compile_sec=compile_sec, speedup=speedup,
+                            default_step_sec=runs[False]["step_sec"], xla_step_sec=runs[True]["step_sec"])
+    return report
+
+
+def main():
+    args = parser.arg_parse()
+    if args.xla_report:
+        xla_report(args)
+        return
+
+    cores = multiprocessing.cpu_count()
+    budget_mb = args.memory_budget_mb or 0.8 * physical_memory_mb()
+    batch_sizes = sorted(int(i) for i in args.tune_batch_sizes.split(","))
+    inter_grid = [int(i) for i in args.tune_inter_op_threads.split(",")]
+    if args.tune_intra_op_threads:
+        intra_grid = [int(i) for i in args.tune_intra_op_threads.split(",")]
+    else:
+        intra_grid = thread_grid(cores)
+
+    start_time = time.time()
+    tuning = {"host": socket.gethostname(), "cpu_count": cores, "memory_budget_mb": budget_mb, "trials": []}
+    for role in ("train", "infer"):
+        best, trials = tune_role(role, args, intra_grid, inter_grid, batch_sizes, budget_mb)
+        tuning["trials"].extend(trials)
+        if best is None:
+            print("no %s setting fits into %.0f MB" % (role, budget_mb))
+            continue
+        tuning[role] = best
+        print("best %s: batch %d, intra %d, inter %d, %.2f images/sec"
+              % (role, best["batch_size"], best["intra_op_threads"], best["inter_op_threads"],
+                 best["images_per_sec"]))
+    print("tuning took %.1f sec" % (time.time() - start_time))
+    save_tuning(tuning, args.tuning_config)
+
+
+if __name__ == '__main__':
+    main()